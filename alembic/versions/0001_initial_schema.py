@@ -0,0 +1,101 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('mobile_number', sa.String(), nullable=False),
+        sa.Column('password_hash', sa.String(), nullable=True),
+        sa.Column('subscription_tier', sa.Enum('BASIC', 'FREE', 'PRO', name='subscriptiontier'), nullable=True),
+        sa.Column('subscription_status', sa.Enum('ACTIVE', 'INACTIVE', 'CANCELLED', name='subscriptionstatus'), nullable=True),
+        sa.Column('daily_usage_count', sa.Integer(), nullable=True),
+        sa.Column('last_usage_reset', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_users_id', 'users', ['id'])
+    op.create_index('ix_users_mobile_number', 'users', ['mobile_number'], unique=True)
+
+    op.create_table(
+        'chatrooms',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=True),
+        sa.Column('last_activity', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('modified_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_chatrooms_id', 'chatrooms', ['id'])
+
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('chatroom_id', sa.Integer(), sa.ForeignKey('chatrooms.id'), nullable=True),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('is_user_message', sa.Boolean(), nullable=True),
+        sa.Column('gemini_response', sa.Text(), nullable=True),
+        sa.Column('processing_status', sa.String(), nullable=True),
+        sa.Column('processing_latency', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_messages_id', 'messages', ['id'])
+
+    op.create_table(
+        'subscriptions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('stripe_subscription_id', sa.String(), nullable=True, unique=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('tier', sa.String(), nullable=True),
+        sa.Column('current_period_start', sa.DateTime(), nullable=True),
+        sa.Column('current_period_end', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_subscriptions_id', 'subscriptions', ['id'])
+
+    op.create_table(
+        'stripe_events',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('ordering_key', sa.String(), nullable=False),
+        sa.Column('stripe_created', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_stripe_events_ordering', 'stripe_events', ['ordering_key', 'status', 'stripe_created'])
+
+    # Left behind by the removed OTP model
+    op.execute('DROP TABLE IF EXISTS otps')
+
+def downgrade():
+    op.drop_index('ix_stripe_events_ordering', table_name='stripe_events')
+    op.drop_table('stripe_events')
+    op.drop_index('ix_subscriptions_id', table_name='subscriptions')
+    op.drop_table('subscriptions')
+    op.drop_index('ix_messages_id', table_name='messages')
+    op.drop_table('messages')
+    op.drop_index('ix_chatrooms_id', table_name='chatrooms')
+    op.drop_table('chatrooms')
+    op.drop_index('ix_users_mobile_number', table_name='users')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_table('users')
+    sa.Enum(name='subscriptionstatus').drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name='subscriptiontier').drop(op.get_bind(), checkfirst=True)
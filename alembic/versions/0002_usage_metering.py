@@ -0,0 +1,48 @@
+"""Usage metering events and rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'usage_events',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True),
+        sa.Column('event_id', sa.String(32), nullable=False, unique=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=True),
+        sa.Column('model', sa.String(), nullable=True),
+        sa.Column('outcome', sa.String(), nullable=False),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=True),
+        sa.Column('response_tokens', sa.Integer(), nullable=True),
+        sa.Column('latency_ms', sa.Float(), nullable=True),
+        sa.Column('occurred_at', sa.DateTime(), nullable=False),
+        sa.Column('hour_start', sa.DateTime(), nullable=False),
+        sa.Column('recorded_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_usage_events_user_hour', 'usage_events', ['user_id', 'hour_start'])
+
+    op.create_table(
+        'usage_rollups',
+        sa.Column('user_id', sa.Integer(), primary_key=True),
+        sa.Column('granularity', sa.String(8), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(), primary_key=True),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.Integer(), nullable=False),
+        sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('response_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('latency_ms_total', sa.Float(), nullable=False),
+    )
+
+def downgrade():
+    op.drop_table('usage_rollups')
+    op.drop_index('ix_usage_events_user_hour', table_name='usage_events')
+    op.drop_table('usage_events')
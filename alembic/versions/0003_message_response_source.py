@@ -0,0 +1,21 @@
+"""Tag messages with where their response came from
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('messages', sa.Column('response_source', sa.String(), nullable=True))
+    op.add_column('messages', sa.Column('cache_similarity', sa.Float(), nullable=True))
+
+def downgrade():
+    op.drop_column('messages', 'cache_similarity')
+    op.drop_column('messages', 'response_source')
@@ -0,0 +1,44 @@
+"""Store message text as bytes so large values can be compressed
+
+Existing rows become their UTF-8 bytes, which CompressedText reads as plain text; run
+python -m app.tasks.compression_tasks afterwards to compress them in batches.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (('content', False), ('gemini_response', True))
+
+def upgrade():
+    # SQLite keeps whatever it is given per value, so only typed databases need converting
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    for column, nullable in COLUMNS:
+        op.alter_column(
+            'messages', column,
+            type_=sa.LargeBinary(),
+            existing_type=sa.Text(),
+            existing_nullable=nullable,
+            postgresql_using=f"convert_to({column}, 'UTF8')"
+        )
+
+def downgrade():
+    # Run python -m app.tasks.compression_tasks --decompress first, or compressed rows will not convert
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    for column, nullable in COLUMNS:
+        op.alter_column(
+            'messages', column,
+            type_=sa.Text(),
+            existing_type=sa.LargeBinary(),
+            existing_nullable=nullable,
+            postgresql_using=f"convert_from({column}, 'UTF8')"
+        )
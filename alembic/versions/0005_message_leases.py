@@ -0,0 +1,23 @@
+"""Lease columns on messages for crash-safe Gemini processing
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('messages', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('messages', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_messages_lease', 'messages', ['processing_status', 'lease_expires_at'])
+
+def downgrade():
+    op.drop_index('ix_messages_lease', table_name='messages')
+    op.drop_column('messages', 'lease_expires_at')
+    op.drop_column('messages', 'lease_owner')
@@ -0,0 +1,19 @@
+"""Pending Stripe cancellation on subscriptions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('subscriptions', sa.Column('cancel_requested_at', sa.DateTime(), nullable=True))
+
+def downgrade():
+    op.drop_column('subscriptions', 'cancel_requested_at')
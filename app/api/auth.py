@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPBearer
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from datetime import timedelta
-from ..database import get_db
+from ..database import get_db, mark_recent_write, replica_engines
 from ..schemas.user import UserCreate, UserLogin, UserResponse, Token, OTPRequest, OTPVerify, TokenRefresh
 from ..services.auth_service import AuthService
-from ..utils.jwt_utils import create_access_token, create_refresh_token, verify_token
-from ..middleware.rate_limit_middleware import RateLimitMiddleware, cache_service
+from ..utils.jwt_utils import verify_access_token, verify_token
+from ..clients import get_revocation_store, get_token_service
+from ..middleware.rate_limit_middleware import RateLimitMiddleware
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer()
@@ -30,6 +31,9 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         )
     
     user = auth_service.create_user(user_data)
+    if replica_engines:
+        # No token to pin reads by yet; the first ones after login must still find this row
+        mark_recent_write(user.id)
     return user
 
 @router.post("/login", response_model=Token)
@@ -55,16 +59,8 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
             detail="Invalid credentials"
         )
     
-    # Create tokens
-    access_token = create_access_token(data={"user_id": user.id})
-    refresh_token = create_refresh_token(data={"user_id": user.id})
-    
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "token_type": "bearer",
-        "expires_in": 3600
-    }
+    # Create tokens (a new refresh family per login)
+    return get_token_service().issue_tokens(user.id)
 
 @router.post("/send-otp")
 async def send_otp(otp_request: OTPRequest, db: Session = Depends(get_db)):
@@ -134,6 +130,9 @@ async def reset_password(mobile_number: str, new_password: str, otp: str, db: Se
             detail="User not found"
         )
     
+    # Sign out every session that used the old password
+    get_revocation_store().bump_version(auth_service.get_user_by_mobile(mobile_number).id)
+    
     return {"message": "Password reset successfully"}
 
 @router.post("/refresh-token", response_model=Token)
@@ -154,13 +153,18 @@ async def refresh_token(token_data: TokenRefresh):
             detail="Invalid token payload"
         )
     
-    # Create new tokens
-    access_token = create_access_token(data={"user_id": user_id})
-    refresh_token = create_refresh_token(data={"user_id": user_id})
+    # Rotate: the presented refresh token is spent, reusing it revokes the whole family
+    return get_token_service().rotate(payload)
+
+@router.post("/logout")
+async def logout(all_devices: bool = False, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke this session's tokens, or every token of the user with all_devices"""
+    payload = verify_access_token(credentials.credentials)
+    if not payload or not payload.get("user_id"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token"
+        )
     
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "token_type": "bearer",
-        "expires_in": 3600
-    }
\ No newline at end of file
+    get_token_service().logout(payload, all_devices=all_devices)
+    return {"message": "Logged out successfully"}
@@ -0,0 +1,165 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from ..config import settings
+from ..database import SessionLocal, mark_recent_write, open_read_session, replica_engines
+from ..middleware.auth_middleware import AuthMiddleware, security
+from ..schemas.batch import BatchOperation, BatchRequest, BatchResponse
+from ..utils.jwt_utils import verify_access_token
+from ..utils.request_batch import RequestBatch, end_batch, start_batch
+from ..utils.tracing import tracer
+
+router = APIRouter(prefix="/batch", tags=["Batch"])
+
+# Describe the outer request's body or transport; each operation gets its own
+_DROPPED_HEADERS = {b"content-length", b"content-type", b"accept-encoding", b"transfer-encoding", b"if-none-match"}
+_RESPONSE_HEADERS_DROPPED = {"content-length", "content-type", "content-encoding"}
+
+@router.post("", response_model=BatchResponse)
+async def run_batch(
+    batch_request: BatchRequest,
+    request: Request,
+    credentials = Depends(security)
+):
+    """Run several API calls in one round trip, e.g. everything a client loads on launch
+
+    The token is verified and the user loaded once, every operation shares one DB session,
+    and consecutive GETs run concurrently. Other methods run alone, in order. Results come
+    back in request order with their own status, so one failing operation fails only itself.
+    """
+    operations = batch_request.requests
+    if len(operations) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BATCH_MAX_REQUESTS} requests per batch"
+        )
+
+    token = credentials.credentials
+    payload = verify_access_token(token)
+    if not payload or not payload.get("user_id"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token"
+        )
+
+    # Reads may use a replica; a batch that writes anything runs on the primary
+    if all(operation.method == "GET" for operation in operations):
+        db = open_read_session(payload["user_id"])
+    else:
+        db = SessionLocal()
+    batch = RequestBatch(db, token)
+    batch.payloads[token] = payload
+    context = start_batch(batch)
+    try:
+        batch.user = AuthMiddleware(None, credentials).get_current_user(db)
+
+        results = []
+        index = 0
+        while index < len(operations):
+            end = index + 1
+            if operations[index].method == "GET":
+                while end < len(operations) and operations[end].method == "GET":
+                    end += 1
+            results += await asyncio.gather(*(
+                _run_operation(request, batch, operation) for operation in operations[index:end]
+            ))
+            index = end
+
+        if replica_engines and db.info.get("wrote"):
+            mark_recent_write(batch.user.id)
+    finally:
+        end_batch(context)
+        batch.close()
+
+    return {"responses": results}
+
+async def _run_operation(request: Request, batch: RequestBatch, operation: BatchOperation) -> dict:
+    with tracer.start_as_current_span("batch.operation") as span:
+        span.set_attribute("http.method", operation.method)
+        span.set_attribute("http.target", operation.path)
+        if operation.path.split("?", 1)[0].rstrip("/") == router.prefix:
+            return _result(operation, status.HTTP_400_BAD_REQUEST, {"detail": "Batches cannot be nested"})
+        try:
+            status_code, headers, body = await _dispatch(request, operation)
+        except StarletteHTTPException as e:
+            # Raised by the router itself (no matching route or method)
+            return _result(operation, e.status_code, {"detail": e.detail})
+        except Exception as e:
+            print(f"Batch operation {operation.method} {operation.path} failed: {e}")
+            batch.db.rollback()
+            return _result(operation, status.HTTP_500_INTERNAL_SERVER_ERROR, {"detail": "Internal server error"})
+        span.set_attribute("http.status_code", status_code)
+        if status_code >= 400 and operation.method != "GET":
+            batch.db.rollback()  # leave nothing half-written for the operations after it
+        return _result(operation, status_code, body, headers)
+
+def _result(operation: BatchOperation, status_code: int, body, headers: dict = None) -> dict:
+    return {"id": operation.id, "status": status_code, "headers": headers or {}, "body": body}
+
+async def _dispatch(request: Request, operation: BatchOperation):
+    """Call the app's router in-process with a scope derived from the batch request"""
+    path, _, query = operation.path.partition("?")
+    body = b"" if operation.body is None else json.dumps(operation.body).encode()
+    headers = [(name, value) for name, value in request.scope["headers"] if name not in _DROPPED_HEADERS]
+    headers += [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in operation.headers.items()
+        if name.lower() not in ("authorization", "host", "content-length", "content-type")
+    ]
+    headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+    # Keeps the app's exception handlers (scope["starlette.exception_handlers"]), so
+    # HTTPException and validation errors become responses just as they would directly
+    scope = {
+        key: value for key, value in request.scope.items()
+        if key not in ("route", "endpoint", "path_params")
+    }
+    scope.update({
+        "method": operation.method,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+    })
+
+    response = {"status": 500, "headers": [], "body": b""}
+    done = asyncio.Event()
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+            if not message.get("more_body"):
+                done.set()
+
+    try:
+        await request.app.router(scope, receive, send)
+    finally:
+        done.set()
+
+    response_headers = {
+        name.decode("latin-1"): value.decode("latin-1") for name, value in response["headers"]
+    }
+    content_type = response_headers.get("content-type", "")
+    for name in _RESPONSE_HEADERS_DROPPED:
+        response_headers.pop(name, None)
+    payload = response["body"]
+    if not payload:
+        decoded = None
+    elif content_type.startswith("application/json"):
+        decoded = json.loads(payload)
+    else:
+        decoded = payload.decode("utf-8", errors="replace")
+    return response["status"], response_headers, decoded
@@ -1,54 +1,169 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import math
+import time
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List
-from ..database import get_db
-from ..schemas.chatroom import ChatroomCreate, ChatroomResponse, ChatroomList, MessageCreate, MessageResponse
+from sqlalchemy import desc, func
+from typing import List, Optional
+from ..database import get_db, get_read_db
+from ..sharding import get_chat_db, get_chat_read_db
+from ..clients import get_redis, get_chat_stream, get_gemini_dispatcher, get_stream_admission
+from ..config import settings
+from ..schemas.chatroom import (
+    ChatroomCreate, ChatroomResponse, ChatroomList, MessageCreate, MessageImportResponse, MessageResponse
+)
 from ..models.chatroom import Chatroom, Message
 from ..middleware.auth_middleware import AuthMiddleware, security
 from ..middleware.rate_limit_middleware import RateLimitMiddleware
-from ..tasks.gemini_tasks import process_gemini_message
+from ..services.gemini_scheduler import AdmissionRejected, estimate_tokens
+from ..services.import_service import ImportLineError, MessageImporter, ndjson_lines
+from ..services.message_lease import lease_owner, pending_lease_expiry
+from ..services.subscription_service import get_effective_tier
+from ..utils.etag_utils import make_etag, is_not_modified, not_modified_response
+from ..utils.tracing import tracer, inject_trace_context
+from ..utils.idempotency import IdempotentRequest
+from ..utils.jwt_utils import get_token_user_id
 
 router = APIRouter(prefix="/chatrooms", tags=["Chatrooms"])
 
+def chatroom_etag(chatroom: Chatroom, *extra) -> str:
+    """ETag for a chatroom and its messages, derived from the chatroom row only"""
+    return make_etag(
+        "chatroom",
+        chatroom.id,
+        chatroom.modified_at,
+        chatroom.message_count,
+        chatroom.last_activity,
+        *extra
+    )
+
 @router.post("/", response_model=ChatroomResponse)
 async def create_chatroom(
     chatroom_data: ChatroomCreate,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chat_db)
 ):
     """Create a new chatroom"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
     chatroom = Chatroom(
         user_id=user.id,
         title=chatroom_data.title
     )
     
-    db.add(chatroom)
-    db.commit()
-    db.refresh(chatroom)
+    chat_db.add(chatroom)
+    chat_db.commit()
+    chat_db.refresh(chatroom)
     
     return chatroom
 
+@router.post("/import", response_model=MessageImportResponse)
+async def import_messages(
+    request: Request,
+    title: Optional[str] = Query(None, min_length=1, max_length=100),
+    chatroom_id: Optional[int] = None,
+    credentials = Depends(security),
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chat_db)
+):
+    """Import conversation history from an NDJSON body into a new (title) or existing chatroom
+    
+    Each line is {"content": ..., "gemini_response": ..., "created_at": ...}. Imported messages
+    are not sent to Gemini and do not count against the daily limit.
+    """
+    auth_middleware = AuthMiddleware(None, credentials)
+    user = auth_middleware.get_current_user(db)
+    
+    if (title is None) == (chatroom_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pass either title (new chatroom) or chatroom_id"
+        )
+    
+    user_id = user.id
+    if chatroom_id is not None and not chat_db.query(Chatroom.id).filter(
+        Chatroom.id == chatroom_id,
+        Chatroom.user_id == user_id
+    ).first():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chatroom not found"
+        )
+    # Hold no transaction (or row locks) while the client uploads
+    db.commit()
+    chat_db.commit()
+
+    def write_all():
+        if chatroom_id is None:
+            chatroom = Chatroom(user_id=user_id, title=title, message_count=0)
+            chat_db.add(chatroom)
+            chat_db.flush()  # id for the message rows; committed together with them
+        else:
+            chatroom = chat_db.query(Chatroom).filter(Chatroom.id == chatroom_id).one()
+        imported = importer.finish(chatroom)
+        return chatroom, imported
+
+    # Lines are buffered as they stream in; each batch is validated off the event loop, and
+    # everything is written in one transaction once the body is complete
+    importer = MessageImporter(chat_db)
+    try:
+        async for line in ndjson_lines(request.stream(), settings.MESSAGE_IMPORT_MAX_LINE_BYTES):
+            importer.add_line(line)
+            if importer.full:
+                await run_in_threadpool(importer.validate)
+        chatroom, imported = await run_in_threadpool(write_all)
+    except ImportLineError as e:
+        chat_db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Nothing imported; line {e.line}: {e.detail}"
+        )
+    except Exception:
+        chat_db.rollback()
+        raise
+    finally:
+        importer.close()
+    
+    return {
+        "chatroom_id": chatroom.id,
+        "imported": imported,
+        "message_count": chatroom.message_count
+    }
+
 @router.get("/", response_model=ChatroomList)
 async def get_chatrooms(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    chat_db: Session = Depends(get_chat_read_db)
 ):
     """Get user's chatrooms"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
+    
+    # One aggregate over chatrooms doubles as the total count and the list version
+    total, last_modified, last_activity, message_total = chat_db.query(
+        func.count(Chatroom.id),
+        func.max(Chatroom.modified_at),
+        func.max(Chatroom.last_activity),
+        func.sum(Chatroom.message_count)
+    ).filter(Chatroom.user_id == user.id).one()
+    
+    etag = make_etag("chatrooms", user.id, skip, limit, total, last_modified, last_activity, message_total)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
     
-    chatrooms = db.query(Chatroom).filter(
+    chatrooms = chat_db.query(Chatroom).filter(
         Chatroom.user_id == user.id
     ).order_by(desc(Chatroom.last_activity)).offset(skip).limit(limit).all()
     
-    total = db.query(Chatroom).filter(Chatroom.user_id == user.id).count()
-    
     return {
         "chatrooms": chatrooms,
         "total": total
@@ -57,14 +172,17 @@ async def get_chatrooms(
 @router.get("/{chatroom_id}", response_model=ChatroomResponse)
 async def get_chatroom(
     chatroom_id: int,
+    request: Request,
+    response: Response,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    chat_db: Session = Depends(get_chat_read_db)
 ):
     """Get specific chatroom with messages"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
-    chatroom = db.query(Chatroom).filter(
+    chatroom = chat_db.query(Chatroom).filter(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == user.id
     ).first()
@@ -75,26 +193,59 @@ async def get_chatroom(
             detail="Chatroom not found"
         )
     
+    # Messages are only loaded (lazily) when the client is out of date
+    etag = chatroom_etag(chatroom)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    
     return chatroom
 
 @router.post("/{chatroom_id}/messages", response_model=MessageResponse)
 async def send_message(
     chatroom_id: int,
     message_data: MessageCreate,
-    background_tasks: BackgroundTasks,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chat_db)
 ):
-    """Send a message to chatroom"""
-    auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    """Send a message to chatroom; retries carrying the same Idempotency-Key are replayed"""
+    idempotency = None
+    user_id = get_token_user_id(request)  # from the JWT alone, so replays never touch the DB
+    if idempotency_key and user_id is not None:
+        idempotency = IdempotentRequest(
+            get_redis(), user_id, f"chatrooms:{chatroom_id}:messages", idempotency_key, message_data.content
+        )
+        replay = await idempotency.begin()
+        if replay is not None:
+            return replay
+    
+    try:
+        # Off the event loop, so duplicates of an in-flight request can wait for it meanwhile
+        message = await run_in_threadpool(_send_message, chatroom_id, message_data, credentials, db, chat_db)
+    except Exception:
+        if idempotency is not None:
+            idempotency.release()
+        raise
+    
+    if idempotency is not None:
+        idempotency.complete(status.HTTP_200_OK, jsonable_encoder(MessageResponse.model_validate(message)))
+    return message
+
+def _send_message(chatroom_id: int, message_data: MessageCreate, credentials, db: Session, chat_db: Session) -> Message:
+    with tracer.start_as_current_span("auth.lookup"):
+        auth_middleware = AuthMiddleware(None, credentials)
+        user = auth_middleware.get_current_user(db)
     
     # Check rate limits
-    rate_limit = RateLimitMiddleware(user)
-    rate_limit.check_daily_limit()
+    with tracer.start_as_current_span("quota.check"):
+        rate_limit = RateLimitMiddleware(user)
+        rate_limit.check_daily_limit()
     
     # Verify chatroom ownership
-    chatroom = db.query(Chatroom).filter(
+    chatroom = chat_db.query(Chatroom).filter(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == user.id
     ).first()
@@ -105,44 +256,105 @@ async def send_message(
             detail="Chatroom not found"
         )
     
-    # Create message
-    message = Message(
-        chatroom_id=chatroom_id,
-        content=message_data.content,
-        is_user_message=True
-    )
+    # Refuse early (429) rather than queue Gemini work that cannot start in time. Stream
+    # workers run elsewhere, so their admission is shared through Redis.
+    dispatcher = None if settings.CHAT_STREAM_ENABLED else get_gemini_dispatcher()
+    admission = get_stream_admission() if settings.CHAT_STREAM_ENABLED else None
+    cost = estimate_tokens(message_data.content, settings.GEMINI_EST_RESPONSE_TOKENS)
+    with tracer.start_as_current_span("scheduler.admit"):
+        try:
+            if dispatcher is not None:
+                job = dispatcher.admit(user.id, get_effective_tier(user).value, cost)
+            else:
+                ticket = admission.admit(user.id, get_effective_tier(user).value, cost)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many messages are waiting for a response. Please retry shortly.",
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
     
-    db.add(message)
-    db.commit()
-    db.refresh(message)
+    try:
+        # Create message
+        with tracer.start_as_current_span("message.insert"):
+            message = Message(
+                chatroom_id=chatroom_id,
+                content=message_data.content,
+                is_user_message=True,
+                # Held by this process until the dispatcher runs it; the sweeper recovers it otherwise
+                lease_owner=lease_owner(),
+                lease_expires_at=pending_lease_expiry()
+            )
+            
+            chat_db.add(message)
+            chat_db.commit()
+            chat_db.refresh(message)
+        
+        with tracer.start_as_current_span("chatroom.counters"):
+            # Update chatroom stats
+            chatroom.message_count += 1
+            chatroom.last_activity = message.created_at
+            
+            # Increment user usage
+            rate_limit.increment_usage()
+            chat_db.commit()
+            db.commit()  # a no-op second commit when chat data shares the primary
+    except Exception:
+        if dispatcher is not None:
+            dispatcher.cancel(job)
+        else:
+            admission.release(ticket)
+        raise
     
-    # Update chatroom stats
-    chatroom.message_count += 1
-    chatroom.last_activity = message.created_at
+    if dispatcher is None:
+        # Answered in order with the chatroom's other messages by the stream workers
+        try:
+            get_chat_stream().publish(
+                chatroom_id,
+                message.id,
+                shard=chat_db.info.get("shard"),
+                trace_headers=inject_trace_context(),
+                enqueued_at=time.time(),
+                ticket=ticket,
+                cost=cost
+            )
+        except Exception as e:
+            # The message is saved; the lease sweeper re-enqueues it once its lease runs out,
+            # by when its admission ticket has lapsed too
+            print(f"Chat stream publish error: {e}")
+        return message
     
-    # Increment user usage
-    rate_limit.increment_usage()
-    db.commit()
+    # Process message with Gemini on the fair scheduler, continuing this trace
+    from ..tasks.gemini_tasks import process_gemini_message
     
-    # Process message with Gemini in background
-    background_tasks.add_task(process_gemini_message, message.id)
+    dispatcher.submit(
+        job,
+        process_gemini_message,
+        message.id,
+        shard=chat_db.info.get("shard"),
+        trace_headers=inject_trace_context(),
+        enqueued_at=time.time()
+    )
     
     return message
 
 @router.get("/{chatroom_id}/messages", response_model=List[MessageResponse])
 async def get_messages(
     chatroom_id: int,
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    chat_db: Session = Depends(get_chat_read_db)
 ):
     """Get messages from chatroom"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
     # Verify chatroom ownership
-    chatroom = db.query(Chatroom).filter(
+    chatroom = chat_db.query(Chatroom).filter(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == user.id
     ).first()
@@ -153,7 +365,12 @@ async def get_messages(
             detail="Chatroom not found"
         )
     
-    messages = db.query(Message).filter(
+    etag = chatroom_etag(chatroom, skip, limit)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    
+    messages = chat_db.query(Message).filter(
         Message.chatroom_id == chatroom_id
     ).order_by(Message.created_at).offset(skip).limit(limit).all()
     
@@ -163,13 +380,14 @@ async def get_messages(
 async def delete_chatroom(
     chatroom_id: int,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chat_db)
 ):
     """Delete chatroom and all messages"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
-    chatroom = db.query(Chatroom).filter(
+    chatroom = chat_db.query(Chatroom).filter(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == user.id
     ).first()
@@ -181,11 +399,11 @@ async def delete_chatroom(
         )
     
     # Delete all messages first
-    db.query(Message).filter(Message.chatroom_id == chatroom_id).delete()
+    chat_db.query(Message).filter(Message.chatroom_id == chatroom_id).delete()
     
     # Delete chatroom
-    db.delete(chatroom)
-    db.commit()
+    chat_db.delete(chatroom)
+    chat_db.commit()
     
     return {"message": "Chatroom deleted successfully"}
 
@@ -194,13 +412,14 @@ async def update_chatroom(
     chatroom_id: int,
     chatroom_data: ChatroomCreate,
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    chat_db: Session = Depends(get_chat_db)
 ):
     """Update chatroom title"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
-    chatroom = db.query(Chatroom).filter(
+    chatroom = chat_db.query(Chatroom).filter(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == user.id
     ).first()
@@ -212,7 +431,7 @@ async def update_chatroom(
         )
     
     chatroom.title = chatroom_data.title
-    db.commit()
-    db.refresh(chatroom)
+    chat_db.commit()
+    chat_db.refresh(chatroom)
     
     return chatroom
\ No newline at end of file
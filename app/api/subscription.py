@@ -1,25 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from datetime import datetime
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..schemas.subscription import SubscriptionResponse, StripeCheckoutRequest, SubscriptionCreate
 from ..models.subscription import Subscription
-from ..models.user import User, SubscriptionTier, SubscriptionStatus
+from ..models.user import SubscriptionStatus
 from ..services.stripe_service import StripeService
+from ..services.stripe_webhook_service import StripeWebhookService
+from ..services.subscription_service import SubscriptionService
 from ..middleware.auth_middleware import AuthMiddleware, security
-import stripe
-from ..config import settings
 
 router = APIRouter(prefix="/subscriptions", tags=["Subscriptions"])
 
 @router.get("/", response_model=SubscriptionResponse)
 async def get_subscription(
     credentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get user's current subscription"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
     
     subscription = db.query(Subscription).filter(
         Subscription.user_id == user.id
@@ -43,8 +43,10 @@ async def create_checkout_session(
     auth_middleware = AuthMiddleware(None, credentials)
     user = auth_middleware.get_current_user()
     
+    # The one Stripe call left on the request path; keep it off the event loop
     stripe_service = StripeService()
-    session = stripe_service.create_checkout_session(
+    session = await run_in_threadpool(
+        stripe_service.create_checkout_session,
         user.id,
         checkout_data.tier,
         checkout_data.success_url,
@@ -70,7 +72,7 @@ async def cancel_subscription(
     
     subscription = db.query(Subscription).filter(
         Subscription.user_id == user.id,
-        Subscription.status == SubscriptionStatus.ACTIVE
+        Subscription.status == SubscriptionStatus.ACTIVE.value
     ).first()
     
     if not subscription:
@@ -79,98 +81,38 @@ async def cancel_subscription(
             detail="No active subscription found"
         )
     
-    # Cancel with Stripe
-    stripe_service = StripeService()
-    if subscription.stripe_subscription_id:
-        stripe_service.cancel_subscription(subscription.stripe_subscription_id)
-    
-    # Update local subscription
-    subscription.status = SubscriptionStatus.CANCELLED
-    user.subscription_status = SubscriptionStatus.CANCELLED
+    # Update local state first; entitlement checks read it directly. The pending cancel
+    # stays on the row until Stripe confirms it, so reconciliation cannot undo it meanwhile.
+    SubscriptionService(db).cancel(subscription)
     db.commit()
     
+    # Stripe is told asynchronously; the webhook confirms it later
+    if subscription.stripe_subscription_id:
+        from ..tasks.stripe_tasks import cancel_stripe_subscription
+
+        cancel_stripe_subscription.delay(subscription.stripe_subscription_id)
+    
     return {"message": "Subscription cancelled successfully"}
 
 @router.post("/webhook")
 async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
-    """Handle Stripe webhooks"""
+    """Record Stripe webhooks in the event ledger and process them asynchronously"""
+    import stripe
+    from ..tasks.stripe_tasks import process_stripe_events
+    
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
     
+    webhook_service = StripeWebhookService(db)
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.stripe_webhook_secret
-        )
+        event, created = webhook_service.record_event(payload, sig_header)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid payload")
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        await handle_successful_payment(session, db)
-    
-    elif event['type'] == 'invoice.payment_succeeded':
-        invoice = event['data']['object']
-        await handle_successful_payment_renewal(invoice, db)
-    
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription = event['data']['object']
-        await handle_subscription_cancelled(subscription, db)
+    # Duplicates are acknowledged without re-processing
+    if created:
+        process_stripe_events.delay(event.ordering_key)
     
     return {"status": "success"}
-
-async def handle_successful_payment(session, db: Session):
-    """Handle successful payment from Stripe"""
-    user_id = int(session['metadata']['user_id'])
-    tier = SubscriptionTier(session['metadata']['tier'])
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return
-    
-    # Create or update subscription
-    subscription = Subscription(
-        user_id=user_id,
-        stripe_subscription_id=session['subscription'],
-        status=SubscriptionStatus.ACTIVE,
-        tier=tier,
-        current_period_start=datetime.utcnow(),
-        current_period_end=datetime.utcnow()  # Will be updated by Stripe
-    )
-    
-    db.add(subscription)
-    
-    # Update user
-    user.subscription_tier = tier
-    user.subscription_status = SubscriptionStatus.ACTIVE
-    
-    db.commit()
-
-async def handle_successful_payment_renewal(invoice, db: Session):
-    """Handle successful payment renewal"""
-    subscription_id = invoice['subscription']
-    
-    subscription = db.query(Subscription).filter(
-        Subscription.stripe_subscription_id == subscription_id
-    ).first()
-    
-    if subscription:
-        subscription.status = SubscriptionStatus.ACTIVE
-        subscription.user.subscription_status = SubscriptionStatus.ACTIVE
-        db.commit()
-
-async def handle_subscription_cancelled(stripe_subscription, db: Session):
-    """Handle subscription cancellation"""
-    subscription_id = stripe_subscription['id']
-    
-    subscription = db.query(Subscription).filter(
-        Subscription.stripe_subscription_id == subscription_id
-    ).first()
-    
-    if subscription:
-        subscription.status = SubscriptionStatus.CANCELLED
-        subscription.user.subscription_status = SubscriptionStatus.CANCELLED
-        subscription.user.subscription_tier = SubscriptionTier.BASIC
-        db.commit()
@@ -1,17 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..schemas.user import UserResponse
 from ..services.auth_service import AuthService
+from ..services.metering_service import MeteringService
 from ..middleware.auth_middleware import AuthMiddleware, security
+from ..utils.etag_utils import make_etag, is_not_modified, not_modified_response
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 @router.get("/profile", response_model=UserResponse)
-async def get_profile(credentials = Depends(security), db: Session = Depends(get_db)):
+async def get_profile(request: Request, response: Response, credentials = Depends(security), db: Session = Depends(get_read_db)):
     """Get current user profile"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
+    
+    etag = make_etag(
+        "profile",
+        user.id,
+        user.modified_at,
+        user.mobile_number,
+        user.daily_usage_count,
+        user.subscription_tier,
+        user.subscription_status
+    )
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+    
     return user
 
 @router.put("/profile", response_model=UserResponse)
@@ -37,14 +54,47 @@ async def update_profile(mobile_number: str, credentials = Depends(security), db
     return user
 
 @router.get("/usage-stats")
-async def get_usage_stats(credentials = Depends(security), db: Session = Depends(get_db)):
-    """Get user usage statistics"""
+async def get_usage_stats(
+    days: int = Query(30, ge=1, le=90),
+    granularity: str = Query("day", pattern="^(day|hour)$"),
+    credentials = Depends(security),
+    db: Session = Depends(get_read_db)
+):
+    """Get user usage statistics, with a per-day (or per-hour) Gemini usage series"""
     auth_middleware = AuthMiddleware(None, credentials)
-    user = auth_middleware.get_current_user()
+    user = auth_middleware.get_current_user(db)
+    
+    # Rollups are bucketed in naive UTC; start on a bucket boundary so the first bucket is whole
+    since = datetime.now(tz=timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    if granularity == "day":
+        since = since.replace(hour=0)
+    rollups = MeteringService(db).usage_series(user.id, granularity, since)
+    
+    series = [
+        {
+            "bucket_start": rollup.bucket_start,
+            "requests": rollup.requests,
+            "errors": rollup.errors,
+            "prompt_tokens": rollup.prompt_tokens,
+            "response_tokens": rollup.response_tokens,
+            "avg_latency_ms": round(rollup.latency_ms_total / rollup.requests, 2) if rollup.requests else 0.0
+        }
+        for rollup in rollups
+    ]
     
     return {
         "daily_usage_count": user.daily_usage_count,
         "subscription_tier": user.subscription_tier,
         "subscription_status": user.subscription_status,
-        "last_usage_reset": user.last_usage_reset
+        "last_usage_reset": user.last_usage_reset,
+        "usage": {
+            "granularity": granularity,
+            "since": since,
+            "totals": {
+                "requests": sum(point["requests"] for point in series),
+                "prompt_tokens": sum(point["prompt_tokens"] for point in series),
+                "response_tokens": sum(point["response_tokens"] for point in series)
+            },
+            "series": series
+        }
     }
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Process-wide external clients, created on first use (or eagerly from the app lifespan)
+
+Nothing here connects or imports heavy SDKs at import time, so importing the app stays
+cheap and free of side effects. Every client shares one pool per process.
+"""
+from typing import Dict, Optional
+from .config import per_worker, settings
+
+_redis_client = None
+_cache_service = None
+_sms_queue = None
+_chat_stream = None
+_gemini_services: Dict[str, object] = {}
+_gemini_dispatcher = None
+_stream_admission = None
+_revocation_store = None
+_token_service = None
+_semantic_cache = None
+
+def get_redis():
+    """Shared Redis client backed by a single bounded connection pool"""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        from .utils.instrumented_redis import InstrumentedRedis
+
+        pool = redis.ConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=per_worker(settings.REDIS_MAX_CONNECTIONS)
+        )
+        _redis_client = InstrumentedRedis(connection_pool=pool)
+    return _redis_client
+
+def get_cache_service():
+    global _cache_service
+    if _cache_service is None:
+        from .services.cache_service import CacheService
+
+        _cache_service = CacheService(get_redis())
+    return _cache_service
+
+def get_sms_queue():
+    global _sms_queue
+    if _sms_queue is None:
+        from .services.sms_service import SMSQueue
+
+        _sms_queue = SMSQueue(get_redis())
+    return _sms_queue
+
+def get_chat_stream():
+    """Partitioned Redis Streams carrying Gemini work in per-chatroom order"""
+    global _chat_stream
+    if _chat_stream is None:
+        from .services.chat_stream import ChatStream
+
+        _chat_stream = ChatStream(get_redis())
+    return _chat_stream
+
+def get_gemini_service(model_name: Optional[str] = None):
+    """Shared GeminiService per model name; google.generativeai is imported on first use"""
+    model_name = model_name or settings.GEMINI_MODEL
+    if model_name not in _gemini_services:
+        from .services.gemini_service import GeminiService
+
+        _gemini_services[model_name] = GeminiService(model_name, get_redis())
+    return _gemini_services[model_name]
+
+def get_gemini_dispatcher():
+    """Process-wide fair scheduler and worker pool in front of Gemini"""
+    global _gemini_dispatcher
+    if _gemini_dispatcher is None:
+        from .services.gemini_scheduler import FairScheduler, GeminiDispatcher, RedisTokenBudget
+
+        scheduler = FairScheduler(
+            settings.SCHEDULER_TIER_WEIGHTS,
+            RedisTokenBudget(get_redis(), settings.GEMINI_TOKENS_PER_MINUTE),
+            max_queue_per_tier=settings.SCHEDULER_MAX_QUEUE_PER_TIER,
+            max_pending_per_user=settings.SCHEDULER_MAX_PENDING_PER_USER,
+            max_wait_seconds=settings.SCHEDULER_MAX_WAIT_SECONDS,
+            workers=settings.SCHEDULER_WORKERS
+        )
+        _gemini_dispatcher = GeminiDispatcher(scheduler, settings.SCHEDULER_WORKERS)
+        _gemini_dispatcher.start()
+    return _gemini_dispatcher
+
+def get_stream_admission():
+    """Redis-shared admission and token budget for the chat stream path"""
+    global _stream_admission
+    if _stream_admission is None:
+        from .services.gemini_scheduler import RedisTokenBudget, StreamAdmission
+
+        _stream_admission = StreamAdmission(
+            get_redis(),
+            RedisTokenBudget(get_redis(), settings.GEMINI_TOKENS_PER_MINUTE),
+            settings.SCHEDULER_TIER_WEIGHTS,
+            max_pending_per_user=settings.SCHEDULER_MAX_PENDING_PER_USER,
+            max_wait_seconds=settings.SCHEDULER_MAX_WAIT_SECONDS,
+            stale_seconds=settings.MESSAGE_PENDING_LEASE_SECONDS
+        )
+    return _stream_admission
+
+def get_semantic_cache():
+    """Process-local semantic response cache, or None when SEMANTIC_CACHE_ENABLED is off"""
+    global _semantic_cache
+    if _semantic_cache is None and settings.SEMANTIC_CACHE_ENABLED:
+        from .services.semantic_cache import SemanticCache, load_embedder
+
+        _semantic_cache = SemanticCache(
+            load_embedder(settings.SEMANTIC_CACHE_EMBEDDER),
+            settings.SEMANTIC_CACHE_MAX_ENTRIES,
+            settings.SEMANTIC_CACHE_THRESHOLD
+        )
+    return _semantic_cache
+
+def get_revocation_store():
+    """Revoked-token view kept in sync by a pub/sub listener thread"""
+    global _revocation_store
+    if _revocation_store is None:
+        from .services.token_service import RevocationStore
+
+        _revocation_store = RevocationStore(get_redis())
+        _revocation_store.start()
+    return _revocation_store
+
+def get_token_service():
+    global _token_service
+    if _token_service is None:
+        from .services.token_service import TokenService
+
+        _token_service = TokenService(get_redis(), get_revocation_store())
+    return _token_service
+
+def init_clients():
+    """Create clients up front so the first request does not pay for it"""
+    get_redis()
+    get_cache_service()
+    get_gemini_service()
+    get_gemini_dispatcher()
+    get_revocation_store()
+
+    from .services.stripe_service import get_stripe_client
+
+    get_stripe_client()
+
+def close_clients():
+    """Release pooled connections on shutdown"""
+    global _redis_client, _cache_service, _sms_queue, _chat_stream, _gemini_dispatcher, _stream_admission, _revocation_store, _token_service, _semantic_cache
+    if _gemini_dispatcher is not None:
+        _gemini_dispatcher.stop()
+    _gemini_dispatcher = None
+    _stream_admission = None
+    if _revocation_store is not None:
+        _revocation_store.stop()
+    _revocation_store = None
+    _token_service = None
+    _semantic_cache = None
+    if _redis_client is not None:
+        _redis_client.connection_pool.disconnect()
+    _redis_client = None
+    _cache_service = None
+    _sms_queue = None
+    _chat_stream = None
+    _gemini_services.clear()
+
+    from .services.stripe_service import close_stripe_client
+
+    close_stripe_client()
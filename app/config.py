@@ -1,19 +1,131 @@
+import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     DATABASE_URL : str
+    DATABASE_REPLICA_URLS : List[str] = []  # JSON list in env, e.g. '["postgresql://replica1/db"]'
+    READ_YOUR_WRITES_SECONDS : int = 5
+    CHAT_SHARD_URLS : Dict[str, str] = {}  # JSON object in env, e.g. '{"chat0": "postgresql://...", "chat1": "..."}'
+    CHAT_SHARD_VNODES : int = 64
     REDIS_URL : str
+    REDIS_MAX_CONNECTIONS : int = 50  # per server: split across pre-fork workers
+    # Per database per server (pool + overflow), split across pre-fork workers. Each worker runs
+    # SCHEDULER_WORKERS dispatcher threads plus its request handlers, each holding a session:
+    # 64 gives 4 workers 16 connections apiece (8 dispatchers + 8 handlers)
+    DB_MAX_CONNECTIONS : int = 64
+    WEB_WORKERS : int = 0  # app.server worker processes; 0 = one per CPU
+    WEB_BIND : str = '0.0.0.0:8000'
+    WEB_GRACEFUL_TIMEOUT : int = 30
+    AUTO_CREATE_SCHEMA : bool = False  # local/dev only; production schema is managed by Alembic
     JWT_SECRET_KEY : str
     JWT_ALGORITHM : str = 'HS256'
     ACCESS_TOKEN_EXPIRE_MINUTES : int = 30
     REFRESH_TOKEN_EXPIRE_DAYS : int = 7
     GEMINI_API_KEY : str
+    GEMINI_MODEL : str = 'gemini-1.5-flash'
+    GEMINI_FALLBACK_MODEL : Optional[str] = None  # e.g. 'gemini-1.5-flash-8b', used while the primary is tripped
+    GEMINI_TIMEOUT_SECONDS : float = 30.0
+    GEMINI_SLOW_CALL_SECONDS : float = 10.0
+    GEMINI_BREAKER_WINDOW_SECONDS : int = 60
+    GEMINI_BREAKER_MIN_CALLS : int = 20
+    GEMINI_BREAKER_ERROR_RATE : float = 0.5
+    GEMINI_BREAKER_SLOW_RATE : float = 0.5
+    GEMINI_BREAKER_RESET_SECONDS : float = 30.0
+    GEMINI_BREAKER_MAX_RESET_SECONDS : float = 300.0
+    USAGE_FLUSH_INTERVAL_SECONDS : int = 10
+    USAGE_FLUSH_BATCH_SIZE : int = 1000
+    GEMINI_TOKENS_PER_MINUTE : int = 1000000  # keep in line with the project's Gemini quota
+    GEMINI_EST_RESPONSE_TOKENS : int = 400
+    SCHEDULER_WORKERS : int = 8
+    SCHEDULER_TIER_WEIGHTS : Dict[str, int] = {"pro": 8, "basic": 1, "free": 1}
+    SCHEDULER_MAX_QUEUE_PER_TIER : int = 1000
+    SCHEDULER_MAX_PENDING_PER_USER : int = 10
+    SCHEDULER_MAX_WAIT_SECONDS : float = 30.0
+    MESSAGE_LEASE_SECONDS : int = 120  # a claimed message; keep above the worst-case Gemini call(s)
+    MESSAGE_PENDING_LEASE_SECONDS : int = 120  # a queued message; keep above SCHEDULER_MAX_WAIT_SECONDS
+    MESSAGE_SWEEP_INTERVAL_SECONDS : int = 30
+    MESSAGE_SWEEP_BATCH_SIZE : int = 500
+    CHAT_STREAM_ENABLED : bool = False  # Gemini work in per-chatroom order via python -m app.tasks.stream_tasks
+    CHAT_STREAM_PARTITIONS : int = 32  # fixed once in use: changing it remaps chatrooms
+    CHAT_STREAM_LEASE_SECONDS : int = 30  # a crashed worker's partitions move after this
+    CHAT_STREAM_HEARTBEAT_SECONDS : float = 5.0
+    CHAT_STREAM_BATCH_SIZE : int = 10
+    CHAT_STREAM_WORKER_THREADS : int = 8  # partitions one worker processes at once
+    SEMANTIC_CACHE_ENABLED : bool = False  # needs numpy
+    SEMANTIC_CACHE_THRESHOLD : float = 0.92  # cosine similarity needed to reuse an answer
+    SEMANTIC_CACHE_MAX_ENTRIES : int = 10000  # per process; least recently used entries are evicted
+    SEMANTIC_CACHE_SCOPE : str = 'user'  # user, or global: answers (and what prompts disclose) shared across tenants
+    SEMANTIC_CACHE_EMBEDDER : Optional[str] = None  # "module:factory"; default is a hashing vectorizer (exact wording only)
     STRIPE_SECRET_KEY : str
     STRIPE_WEBHOOK_SECRET: str
+    STRIPE_PRO_PRICE_ID : str = 'price_1234567890'
+    STRIPE_API_BASE : Optional[str] = None  # e.g. http://localhost:12111 for stripe-mock
+    STRIPE_TIMEOUT_SECONDS : float = 10.0
+    STRIPE_MAX_NETWORK_RETRIES : int = 2
+    STRIPE_RECONCILE_INTERVAL_SECONDS : int = 900
+    STRIPE_EVENT_MAX_ATTEMPTS : int = 8  # then the event is dead-lettered and its subscription moves on
+    STRIPE_EVENT_LOCK_SECONDS : int = 60  # per-subscription drain lock, renewed after every event
+    TRACING_EXPORTER : str = 'none'  # none, console, memory, otlp
+    TRACING_SERVICE_NAME : str = 'gemini-backend'
+    PROFILING_ENABLED : bool = False
+    PROFILING_SAMPLE_RATE : float = 0.0
+    PROFILING_SLOW_THRESHOLD_MS : Optional[float] = None
+    PROFILING_ADMIN_TOKEN : Optional[str] = None
+    PROFILING_OUTPUT_DIR : str = 'profiles'
+    PROFILING_INTERVAL : float = 0.001
+    PROFILING_SLOW_INTERVAL : float = 0.01  # coarser, for the every-request PROFILING_SLOW_THRESHOLD_MS watch
+    IDEMPOTENCY_TTL_SECONDS : int = 86400
+    IDEMPOTENCY_LOCK_SECONDS : int = 30  # in-flight claim; expires if the worker dies mid-request
+    IDEMPOTENCY_WAIT_SECONDS : float = 10.0
+    REVOCATION_BLOOM_CAPACITY : int = 100000  # revoked ids held before the false-positive rate climbs
+    REVOCATION_BLOOM_ERROR_RATE : float = 0.001
+    REVOCATION_REBUILD_SECONDS : int = 3600  # drop expired ids from the filter
     OTP_EXPIRATION_MINUTES : int = 5
+    OTP_MAX_ATTEMPTS : int = 5
+    OTP_LOCKOUT_MINUTES : int = 15
+    SMS_PROVIDER : str = 'console'  # console, fake, twilio
+    SMS_BATCH_SIZE : int = 50
+    SMS_MAX_RETRIES : int = 5
+    SMS_RETRY_BASE_SECONDS : float = 2.0
+    SMS_RETRY_MAX_SECONDS : float = 300.0
+    SMS_FAKE_OUTBOX_PATH : Optional[str] = None
+    # A worker silent this long has its in-flight batch requeued; keep it above a full batch's send time
+    SMS_WORKER_LEASE_SECONDS : int = 300
+    TWILIO_ACCOUNT_SID : Optional[str] = None
+    TWILIO_AUTH_TOKEN : Optional[str] = None
+    TWILIO_FROM_NUMBER : Optional[str] = None
+    LOAD_SHED_ENABLED : bool = True
+    LOAD_SHED_POLL_LAG_MS : float = 200  # event-loop lag at which non-paying users' GETs get 503
+    LOAD_SHED_BASIC_LAG_MS : float = 500  # ... and all their other requests
+    LOAD_SHED_MAX_IN_FLIGHT : Dict[str, int] = {}  # per worker and route class, e.g. '{"poll": 12, "write": 12}'
+    LOAD_SHED_RETRY_AFTER_SECONDS : float = 2
+    LOAD_SHED_SAMPLE_INTERVAL_MS : float = 50
+    LOAD_SHED_LAG_DECAY : float = 0.8  # per sample
+    BATCH_MAX_REQUESTS : int = 20  # sub-requests per POST /batch
+    MESSAGE_IMPORT_BATCH_SIZE : int = 5000  # rows per INSERT executemany / COPY
+    MESSAGE_IMPORT_MAX_MESSAGES : int = 200000  # per request
+    MESSAGE_IMPORT_MAX_LINE_BYTES : int = 1048576
+    MESSAGE_COMPRESSION_MIN_BYTES : int = 512  # shorter message text is stored plain
+    MESSAGE_COMPRESSION_LEVEL : int = 3  # zstd level
+    MESSAGE_COMPRESSION_DICT_PATH : Optional[str] = None  # zstd dictionary from app.tasks.compression_tasks --train-dictionary
+    MESSAGE_COMPRESSION_OLD_DICT_PATHS : List[str] = []  # replaced dictionaries, still needed to read older rows
+    COMPRESSION_MINIMUM_SIZE : int = 500
+    COMPRESSION_LEVEL : int = 6
 
     class Config:
         env_file = 'app/.env'
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+
+def per_worker(total: int) -> int:
+    """This process's share of a server-wide connection budget
+
+    app.server exports WEB_WORKER_PROCESSES before preloading the app; a plain uvicorn
+    process keeps the whole budget. Raises ValueError if the budget cannot give every worker
+    a connection, rather than quietly going over it.
+    """
+    workers = max(1, int(os.environ.get("WEB_WORKER_PROCESSES", "1")))
+    if total < workers:
+        raise ValueError(f"a budget of {total} connections is less than one per worker ({workers} workers)")
+    return total // workers
\ No newline at end of file
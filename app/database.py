@@ -1,15 +1,129 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
-from .config import settings
+from .config import per_worker, settings
+from .utils.metrics import InstrumentedQueuePool, instrument_engine
+from .utils.tracing import trace_engine
+from .utils.jwt_utils import get_token_user_id
+from .utils.request_batch import current_batch
+
+# Every engine this process built, so they can all be reset after a fork and on shutdown
+_engines = []
+
+def build_engine(url: str):
+    """Create an engine with pool-wait, per-request query and tracing instrumentation"""
+    engine_kwargs = {}
+    if not url.startswith("sqlite"):
+        # Keep SQLAlchemy's 1:2 pool/overflow split, within this worker's share of the budget
+        connections = per_worker(settings.DB_MAX_CONNECTIONS)
+        engine_kwargs["poolclass"] = InstrumentedQueuePool
+        engine_kwargs["pool_size"] = max(1, connections // 3)
+        engine_kwargs["max_overflow"] = connections - engine_kwargs["pool_size"]
+    built = trace_engine(instrument_engine(create_engine(url, **engine_kwargs)))
+    _engines.append(built)
+    return built
+
+def dispose_engines(close: bool = True):
+    """Drop pooled connections; close=False (right after a fork) leaves the parent's sockets alone"""
+    for built in _engines:
+        built.dispose(close=close)
+
+engine = build_engine(settings.DATABASE_URL)
+replica_engines = [build_engine(url) for url in settings.DATABASE_REPLICA_URLS]
+_replica_cycle = itertools.cycle(replica_engines) if replica_engines else None
 
-engine = create_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
-def get_db():
+# Remember whether a session wrote anything, so the writer's next reads can stick to the primary
+@event.listens_for(SessionLocal, "after_flush")
+def _flag_flush_write(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _flag_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+# Local fast path in front of the shared Redis marker (same user, same worker). Entries are
+# kept in expiry order, so expired ones are trimmed from the front, and the size is capped.
+_recent_writers: "OrderedDict[int, float]" = OrderedDict()
+_recent_writers_lock = threading.Lock()
+RECENT_WRITERS_MAX = 10000
+
+def _ryw_key(user_id: int) -> str:
+    return f"db:ryw:{user_id}"
+
+def mark_recent_write(user_id: int):
+    """Pin the user's reads to the primary for READ_YOUR_WRITES_SECONDS"""
+    now = time.monotonic()
+    with _recent_writers_lock:
+        _recent_writers[user_id] = now + settings.READ_YOUR_WRITES_SECONDS
+        _recent_writers.move_to_end(user_id)
+        while _recent_writers:
+            oldest, expires = next(iter(_recent_writers.items()))
+            if expires > now and len(_recent_writers) <= RECENT_WRITERS_MAX:
+                break
+            del _recent_writers[oldest]  # evicted early, the Redis marker still answers
+    try:
+        from .clients import get_redis
+
+        get_redis().set(_ryw_key(user_id), 1, ex=settings.READ_YOUR_WRITES_SECONDS)
+    except Exception as e:
+        print(f"Read-your-writes marker error: {e}")
+
+def has_recent_write(user_id: int) -> bool:
+    with _recent_writers_lock:
+        expires = _recent_writers.get(user_id)
+        if expires is not None and expires <= time.monotonic():
+            _recent_writers.pop(user_id, None)
+            expires = None
+    if expires is not None:
+        return True
+    try:
+        from .clients import get_redis
+
+        return bool(get_redis().exists(_ryw_key(user_id)))
+    except Exception:
+        # When in doubt, read from the primary
+        return True
+
+def get_db(request: Request):
+    """Primary session, for writes and anything that must see the latest data"""
+    batch = current_batch()
+    if batch is not None:
+        yield batch.db  # POST /batch owns (and closes) the session
+        return
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        if replica_engines and db.info.get("wrote"):
+            user_id = get_token_user_id(request)
+            if user_id is not None:
+                mark_recent_write(user_id)
+        db.close()
+
+def open_read_session(user_id: Optional[int]) -> Session:
+    """A replica session, or the primary when the user wrote within the stickiness window"""
+    if replica_engines and (user_id is None or not has_recent_write(user_id)):
+        return SessionLocal(bind=next(_replica_cycle))
+    return SessionLocal()
+
+def get_read_db(request: Request):
+    """Replica session for GET handlers, unless the caller wrote within the stickiness window"""
+    batch = current_batch()
+    if batch is not None:
+        yield batch.db
+        return
+    db = open_read_session(get_token_user_id(request))
+    try:
+        yield db
+    finally:
+        db.close()
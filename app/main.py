@@ -1,26 +1,43 @@
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from sqlalchemy.exc import SQLAlchemyError
 from contextlib import asynccontextmanager
-from .database import engine, Base
-from .api import auth, user, chatroom, subscription
+from .database import engine, Base, dispose_engines
+from .api import auth, user, chatroom, subscription, batch
 from .config import settings
+from .middleware.metrics_middleware import MetricsMiddleware
+from .middleware.tracing_middleware import TracingMiddleware
+from .middleware.profiling_middleware import ProfilingMiddleware
+from .middleware.load_shedding_middleware import LoadSheddingMiddleware, loop_monitor
+from .clients import init_clients, close_clients, get_redis
+from .utils.metrics import metrics_response, register_celery_queue_collector
+from .utils.tracing import configure_tracing
 from datetime import datetime, timezone
 
-# Create database tables
-Base.metadata.drop_all(engine)
-
-Base.metadata.create_all(bind=engine)
+# Schema is managed by Alembic migrations (alembic upgrade head); importing the app has no side effects
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting Gemini Backend...")
+    # Runs in each worker after the fork; never reuse connections a preloading parent opened
+    dispose_engines(close=False)
+    configure_tracing()
+    init_clients()
+    register_celery_queue_collector(get_redis())
+    if settings.AUTO_CREATE_SCHEMA:
+        Base.metadata.create_all(bind=engine)
+    if settings.LOAD_SHED_ENABLED:
+        loop_monitor.start()
     yield
     # Shutdown
     print("Shutting down Gemini Backend...")
+    await loop_monitor.stop()
+    close_clients()
+    dispose_engines()
 
 app = FastAPI(
     title="Gemini Backend Clone",
@@ -38,11 +55,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression (Brotli when available, GZip otherwise); tiny bodies are sent as-is
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=4,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        gzip_fallback=True
+    )
+except ImportError:
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        compresslevel=settings.COMPRESSION_LEVEL
+    )
+
+# Request profiling is opt-in; when disabled the middleware is not installed at all
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Rejects before any other work is done, but still shows up in traces and metrics
+if settings.LOAD_SHED_ENABLED:
+    app.add_middleware(LoadSheddingMiddleware)
+
+# Outermost, so latency includes compression and CORS
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(user.router)
 app.include_router(chatroom.router)
 app.include_router(subscription.router)
+app.include_router(batch.router)
 
 # Exception handlers
 @app.exception_handler(RequestValidationError)
@@ -63,10 +109,15 @@ async def database_exception_handler(request: Request, exc: SQLAlchemyError):
 async def root():
     return {"message": "Gemini Backend Clone API", "version": "1.0.0"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(tz=timezone.utc)}
 
 if __name__ == "__main__":
+    # Single process for development; production runs python -m app.server
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
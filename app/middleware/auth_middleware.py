@@ -1,8 +1,13 @@
 from fastapi import Request, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from ..utils.jwt_utils import verify_token
+from ..utils.jwt_utils import verify_access_token
+from ..utils.request_batch import current_batch
 from ..services.auth_service import AuthService
+from ..services.subscription_service import get_effective_tier
+from sqlalchemy.orm import Session
+from typing import Optional
 from ..database import SessionLocal
+from .load_shedding_middleware import tier_directory
 
 security = HTTPBearer()
 
@@ -11,10 +16,13 @@ class AuthMiddleware:
         self.request = request
         self.credentials = credentials
     
-    def get_current_user(self):
-        """Get current user from JWT token"""
+    def get_current_user(self, db: Optional[Session] = None):
+        """Get current user from JWT token, reusing the handler's session when given"""
         token = self.credentials.credentials
-        payload = verify_token(token)
+        batch = current_batch()
+        if batch is not None and batch.user_for(token) is not None:
+            return batch.user_for(token)  # resolved once for the whole batch, on its session
+        payload = verify_access_token(token)
         
         if not payload:
             raise HTTPException(
@@ -29,7 +37,9 @@ class AuthMiddleware:
                 detail="Invalid token payload"
             )
         
-        db = SessionLocal()
+        owns_session = db is None
+        if owns_session:
+            db = SessionLocal()
         try:
             auth_service = AuthService(db)
             user = auth_service.get_user_by_id(user_id)
@@ -38,6 +48,8 @@ class AuthMiddleware:
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="User not found"
                 )
+            tier_directory.remember(user.id, get_effective_tier(user).value)  # for the load shedder
             return user
         finally:
-            db.close()
\ No newline at end of file
+            if owns_session:
+                db.close()
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Shed low-priority requests quickly while the event loop is lagging
+
+Blocking work on the loop (sync ORM and Redis calls, bcrypt, Gemini fallbacks) makes every
+request slow under overload. LoopLagMonitor samples how late a short sleep wakes up, and
+the middleware answers 503 + Retry-After to the cheapest-to-lose traffic once the lag (or a
+route class's in-flight count) crosses a threshold:
+
+    lag >= LOAD_SHED_POLL_LAG_MS     polling GETs (and POST /batch) of non-paying users
+    lag >= LOAD_SHED_BASIC_LAG_MS    every request of non-paying users
+    in-flight >= cap for the class   non-paying users' requests of that class
+
+Auth, health, metrics and Stripe webhooks are never shed, and neither are Pro users. The
+tier comes from an in-process map filled by AuthMiddleware, so it costs no DB lookup;
+users this process has not seen yet are let through.
+"""
+import asyncio
+import json
+import math
+from collections import OrderedDict
+from typing import Dict, Optional
+from ..config import settings
+from ..utils.jwt_utils import get_token_user_id
+from ..utils.metrics import EVENT_LOOP_LAG, LOAD_SHED_IN_FLIGHT, LOAD_SHED_REJECTIONS, LOAD_SHED_THRESHOLDS
+
+EXEMPT = "exempt"
+AUTH = "auth"
+POLL = "poll"
+WRITE = "write"
+PAID_TIERS = {"pro"}
+
+class LoopLagMonitor:
+    """Event-loop lag: how late a sleep of LOAD_SHED_SAMPLE_INTERVAL_MS wakes up
+
+    Rises to a new sample at once and decays by LOAD_SHED_LAG_DECAY per sample, so one
+    stall is acted on immediately and shedding stops shortly after the loop recovers.
+    """
+
+    def __init__(self, interval: Optional[float] = None, decay: Optional[float] = None):
+        self.interval = interval if interval is not None else settings.LOAD_SHED_SAMPLE_INTERVAL_MS / 1000
+        self.decay = decay if decay is not None else settings.LOAD_SHED_LAG_DECAY
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.lag = 0.0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            sample = max(0.0, loop.time() - start - self.interval)
+            self.lag = max(sample, self.lag * self.decay)
+            EVENT_LOOP_LAG.set(self.lag)
+
+class TierDirectory:
+    """Bounded LRU of user_id -> effective tier, kept up to date by AuthMiddleware"""
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._tiers: "OrderedDict[int, str]" = OrderedDict()
+
+    def remember(self, user_id: int, tier: str):
+        self._tiers[user_id] = tier
+        self._tiers.move_to_end(user_id)
+        if len(self._tiers) > self.capacity:
+            self._tiers.popitem(last=False)
+
+    def get(self, user_id: int) -> Optional[str]:
+        return self._tiers.get(user_id)
+
+loop_monitor = LoopLagMonitor()
+tier_directory = TierDirectory()
+
+def route_class(method: str, path: str) -> str:
+    if path in ("/health", "/metrics", "/subscriptions/webhook"):
+        return EXEMPT
+    if path.startswith("/auth/"):
+        return AUTH
+    if path == "/batch":
+        # Mostly launch-time reads, and its sub-requests skip this middleware: shed as a poll
+        return POLL
+    return POLL if method in ("GET", "HEAD") else WRITE
+
+def export_thresholds():
+    LOAD_SHED_THRESHOLDS.labels("poll_lag_seconds").set(settings.LOAD_SHED_POLL_LAG_MS / 1000)
+    LOAD_SHED_THRESHOLDS.labels("basic_lag_seconds").set(settings.LOAD_SHED_BASIC_LAG_MS / 1000)
+    for name, limit in settings.LOAD_SHED_MAX_IN_FLIGHT.items():
+        LOAD_SHED_THRESHOLDS.labels(f"{name}_max_in_flight").set(limit)
+
+class LoadSheddingMiddleware:
+    """ASGI middleware counting in-flight requests per route class and shedding by priority"""
+
+    def __init__(self, app, monitor: LoopLagMonitor = None, tiers: TierDirectory = None):
+        self.app = app
+        self.monitor = monitor or loop_monitor
+        self.tiers = tiers or tier_directory
+        self.in_flight: Dict[str, int] = {POLL: 0, WRITE: 0, AUTH: 0}
+        export_thresholds()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        kind = route_class(scope["method"], scope["path"])
+        if kind == EXEMPT:
+            await self.app(scope, receive, send)
+            return
+
+        reason = self._shed_reason(scope, kind)
+        if reason is not None:
+            LOAD_SHED_REJECTIONS.labels(kind, reason).inc()
+            await self._reject(send)
+            return
+
+        self.in_flight[kind] += 1
+        LOAD_SHED_IN_FLIGHT.labels(kind).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[kind] -= 1
+            LOAD_SHED_IN_FLIGHT.labels(kind).dec()
+
+    def _shed_reason(self, scope, kind: str) -> Optional[str]:
+        if kind == AUTH:
+            return None
+        lag_ms = self.monitor.lag * 1000
+        limit = settings.LOAD_SHED_MAX_IN_FLIGHT.get(kind, 0)
+        if kind == POLL and lag_ms >= settings.LOAD_SHED_POLL_LAG_MS:
+            reason = "poll_lag"
+        elif lag_ms >= settings.LOAD_SHED_BASIC_LAG_MS:
+            reason = "basic_lag"
+        elif limit and self.in_flight[kind] >= limit:
+            reason = "in_flight"
+        else:
+            return None
+        # Only now pay for the token decode, and only non-paying users are turned away
+        return None if self._is_paid(scope) else reason
+
+    def _is_paid(self, scope) -> bool:
+        user_id = get_token_user_id(_HeaderView(scope))
+        if user_id is None:
+            return False  # unauthenticated: the handler would reject it anyway
+        tier = self.tiers.get(user_id)
+        return tier is None or tier in PAID_TIERS
+
+    async def _reject(self, send):
+        retry_after = max(1, math.ceil(settings.LOAD_SHED_RETRY_AFTER_SECONDS))
+        body = json.dumps({"detail": "Server is busy. Please retry shortly."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+class _HeaderView:
+    """Just enough of a Request for get_token_user_id"""
+
+    def __init__(self, scope):
+        self.headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
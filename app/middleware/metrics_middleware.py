@@ -0,0 +1,32 @@
+import time
+from ..utils.metrics import HTTP_REQUEST_LATENCY, DB_QUERIES_PER_REQUEST, start_query_count, finish_query_count
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL statement counts per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = start_query_count()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Templates ("/chatrooms/{chatroom_id}") keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(finish_query_count(token))
@@ -0,0 +1,73 @@
+import os
+import re
+import time
+import random
+import secrets
+import uuid
+from starlette.concurrency import run_in_threadpool
+from ..config import settings
+
+PROFILE_HEADER = b"x-profile-token"
+
+class ProfilingMiddleware:
+    """Opt-in statistical profiling that writes speedscope profiles for sampled or slow requests
+
+    Only installed when PROFILING_ENABLED is set, so it costs nothing otherwise. A request is
+    profiled when it carries X-Profile-Token matching PROFILING_ADMIN_TOKEN, when it falls in
+    the PROFILING_SAMPLE_RATE sample, or always when PROFILING_SLOW_THRESHOLD_MS is set; in
+    the last case only requests slower than the threshold are kept, and they are sampled
+    every PROFILING_SLOW_INTERVAL rather than PROFILING_INTERVAL to keep the overhead low.
+    """
+
+    def __init__(self, app):
+        from pyinstrument import Profiler
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        self.app = app
+        self.profiler_class = Profiler
+        self.renderer_class = SpeedscopeRenderer
+        os.makedirs(settings.PROFILING_OUTPUT_DIR, exist_ok=True)
+
+    def _requested_by_admin(self, scope) -> bool:
+        if not settings.PROFILING_ADMIN_TOKEN:
+            return False
+        for key, value in scope["headers"]:
+            if key == PROFILE_HEADER:
+                return secrets.compare_digest(value, settings.PROFILING_ADMIN_TOKEN.encode())
+        return False
+
+    def _write_profile(self, path: str, profiler):
+        with open(path, "x") as output:  # never replace another request's profile
+            output.write(profiler.output(renderer=self.renderer_class()))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        forced = self._requested_by_admin(scope) or random.random() < settings.PROFILING_SAMPLE_RATE
+        threshold_ms = settings.PROFILING_SLOW_THRESHOLD_MS
+        if not forced and threshold_ms is None:
+            await self.app(scope, receive, send)
+            return
+
+        interval = settings.PROFILING_INTERVAL if forced else settings.PROFILING_SLOW_INTERVAL
+        profiler = self.profiler_class(interval=interval, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if forced or elapsed_ms >= threshold_ms:
+                route = getattr(scope.get("route"), "path", scope["path"])
+                slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+                # Concurrent slow requests share the millisecond and route: the uuid keeps them apart
+                filename = (f"{int(time.time() * 1000)}-{scope['method']}-{slug}-{int(elapsed_ms)}ms-"
+                            f"{uuid.uuid4().hex[:12]}.speedscope.json")
+                path = os.path.join(settings.PROFILING_OUTPUT_DIR, filename)
+                try:
+                    await run_in_threadpool(self._write_profile, path, profiler)
+                except Exception as e:
+                    print(f"Profile write error: {e}")
@@ -1,10 +1,10 @@
 from fastapi import Request, HTTPException, status
-from ..services.cache_service import CacheService
+from ..clients import get_cache_service
 from ..models.user import User, SubscriptionTier
+from ..services.subscription_service import get_effective_tier
+from ..utils.metrics import RATE_LIMIT_REJECTIONS
 from datetime import datetime, timezone
 
-cache_service = CacheService()
-
 class RateLimitMiddleware:
     def __init__(self, user: User):
         self.user = user
@@ -18,8 +18,9 @@ class RateLimitMiddleware:
             self.user.last_usage_reset = now
         
         # Check limits based on subscription tier
-        if self.user.subscription_tier == SubscriptionTier.BASIC:
+        if get_effective_tier(self.user) == SubscriptionTier.BASIC:
             if self.user.daily_usage_count >= 5:
+                RATE_LIMIT_REJECTIONS.labels("daily_messages").inc()
                 raise HTTPException(
                     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                     detail="Daily message limit exceeded. Upgrade to Pro for unlimited messages."
@@ -35,9 +36,11 @@ class RateLimitMiddleware:
     
     def check_rate_limit(self, key: str, limit: int, window: int):
         """Generic rate limiting function"""
+        cache_service = get_cache_service()
         current_requests = cache_service.get(key) or 0
         
         if current_requests >= limit:
+            RATE_LIMIT_REJECTIONS.labels(key.split(":", 1)[0]).inc()
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Rate limit exceeded"
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, JSON, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from app.database import Base
+from .types import CompressedText
 
 class Chatroom(Base):
     __tablename__ = 'chatrooms'
@@ -10,9 +11,9 @@ class Chatroom(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     title = Column(String, nullable=False)
     message_count = Column(Integer, default=0)
-    last_activity = Column(DateTime, default=datetime.now(tz=timezone.utc))
-    created_at = Column(DateTime, default=datetime.now(tz=timezone.utc))
-    modified_at = Column(DateTime, default=datetime.now(tz=timezone.utc), onupdate=datetime.now(tz=timezone.utc))
+    last_activity = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+    modified_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc), onupdate=lambda: datetime.now(tz=timezone.utc))
 
     user = relationship('User', back_populates='chatrooms')
     messages = relationship('Message', back_populates='chatroom', cascade='all, delete-orphan')
@@ -22,10 +23,19 @@ class Message(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     chatroom_id = Column(Integer, ForeignKey('chatrooms.id'))
-    content = Column(Text, nullable=False)
+    content = Column(CompressedText, nullable=False)
     is_user_message = Column(Boolean, default=True)
-    gemini_response = Column(Text, nullable=True)
+    gemini_response = Column(CompressedText, nullable=True)
     processing_status = Column(String, default='Pending..')
-    created_at = Column(DateTime, default=datetime.now(tz=timezone.utc))
+    processing_latency = Column(JSON, nullable=True)  # queue_wait_ms, model_ms, persistence_ms
+    response_source = Column(String, nullable=True)  # gemini, semantic_cache or import
+    cache_similarity = Column(Float, nullable=True)  # for semantic_cache answers
+    lease_owner = Column(String, nullable=True)  # process that queued it, or the claim processing it
+    lease_expires_at = Column(DateTime, nullable=True)  # after this the sweeper re-enqueues it
+    created_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
 
-    chatroom = relationship('Chatroom', back_populates='messages')
\ No newline at end of file
+    chatroom = relationship('Chatroom', back_populates='messages')
+
+    __table_args__ = (
+        Index('ix_messages_lease', 'processing_status', 'lease_expires_at'),
+    )
\ No newline at end of file
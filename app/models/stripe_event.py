@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from datetime import datetime, timezone
+from app.database import Base
+
+class StripeEvent(Base):
+    __tablename__ = 'stripe_events'
+
+    id = Column(String, primary_key=True)  # Stripe event id (evt_...)
+    type = Column(String, nullable=False)
+    ordering_key = Column(String, nullable=False)  # Stripe subscription id, or the event id
+    stripe_created = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, default='pending')  # pending, processed, failed, dead
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+    processed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_stripe_events_ordering', 'ordering_key', 'status', 'stripe_created'),
+    )
@@ -13,6 +13,7 @@ class Subscription(Base):
     tier = Column(String, default="basic")
     current_period_start = Column(DateTime, nullable=True)
     current_period_end = Column(DateTime, nullable=True)
+    cancel_requested_at = Column(DateTime, nullable=True)  # cancelled locally, Stripe not yet confirmed
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
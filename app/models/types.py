@@ -0,0 +1,153 @@
+import threading
+import zlib
+from typing import Optional
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from ..config import settings
+
+# Compressed values start with NUL, a format version and a codec. Plain text that itself
+# starts with NUL is framed the same way (CODEC_RAW), so only framed values start with NUL
+HEADER_MARK = b"\x00"
+FORMAT_VERSION = 1
+CODEC_RAW = 0
+CODEC_ZSTD = 1
+CODEC_ZSTD_DICT = 2  # written before dictionary ids were stored; the zstd frame names it
+CODEC_ZLIB = 3
+CODEC_ZSTD_DICT_ID = 4  # followed by the dictionary id (4 bytes, big-endian)
+
+_local = threading.local()  # zstd (de)compressor objects must not be shared across threads
+_dictionaries = None  # id -> dictionary, for every configured dictionary
+_dictionary = None  # the one new values are compressed with
+_generation = 0  # bumped by reset_codecs so every thread rebuilds its codecs
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def _load_dictionaries():
+    """MESSAGE_COMPRESSION_DICT_PATH (compresses) and MESSAGE_COMPRESSION_OLD_DICT_PATHS (read only)"""
+    global _dictionaries, _dictionary
+    if _dictionaries is None:
+        zstandard = _zstd()
+        dictionaries, current = {}, None
+        paths = [settings.MESSAGE_COMPRESSION_DICT_PATH] + list(settings.MESSAGE_COMPRESSION_OLD_DICT_PATHS)
+        for index, path in enumerate(paths):
+            if not path:
+                continue
+            with open(path, "rb") as f:
+                dictionary = zstandard.ZstdCompressionDict(f.read())
+            dictionaries[dictionary.dict_id()] = dictionary
+            if index == 0:
+                current = dictionary
+        _dictionaries, _dictionary = dictionaries, current
+    return _dictionary, _dictionaries
+
+def _thread_codecs():
+    if getattr(_local, "generation", None) != _generation:
+        _local.__dict__.clear()
+        _local.generation = _generation
+    return _local
+
+def _compressor(zstandard):
+    _thread_codecs()
+    if getattr(_local, "compressor", None) is None:
+        dictionary, _ = _load_dictionaries()
+        _local.compressor = zstandard.ZstdCompressor(level=settings.MESSAGE_COMPRESSION_LEVEL, dict_data=dictionary)
+        if dictionary is not None:
+            _local.header = (HEADER_MARK + bytes((FORMAT_VERSION, CODEC_ZSTD_DICT_ID))
+                             + dictionary.dict_id().to_bytes(4, "big"))
+        else:
+            _local.header = HEADER_MARK + bytes((FORMAT_VERSION, CODEC_ZSTD))
+    return _local.compressor, _local.header
+
+def _decompressor(zstandard, dict_id: Optional[int]):
+    """Decompressor for plain zstd (dict_id None) or for the dictionary with that id"""
+    attribute = f"decompressor_{dict_id}"
+    _thread_codecs()
+    if getattr(_local, attribute, None) is None:
+        dictionary = None
+        if dict_id is not None:
+            dictionary = _load_dictionaries()[1].get(dict_id)
+            if dictionary is None:
+                raise ValueError(f"value was compressed with zstd dictionary {dict_id}; list its file in "
+                                 "MESSAGE_COMPRESSION_DICT_PATH or MESSAGE_COMPRESSION_OLD_DICT_PATHS")
+        setattr(_local, attribute, zstandard.ZstdDecompressor(dict_data=dictionary))
+    return getattr(_local, attribute)
+
+def reset_codecs():
+    """Forget cached (de)compressors and dictionary, e.g. after changing compression settings"""
+    global _dictionaries, _dictionary, _generation
+    _dictionaries = _dictionary = None
+    _generation += 1
+
+def plain_text(text: str) -> bytes:
+    """Uncompressed stored form: UTF-8, framed only if the text starts with NUL"""
+    raw = text.encode("utf-8")
+    return HEADER_MARK + bytes((FORMAT_VERSION, CODEC_RAW)) + raw if raw.startswith(HEADER_MARK) else raw
+
+def compress_text(text: str) -> bytes:
+    """Stored form of text: plain below the threshold or when compression does not pay"""
+    raw = text.encode("utf-8")
+    if len(raw) < settings.MESSAGE_COMPRESSION_MIN_BYTES:
+        return plain_text(text)
+    zstandard = _zstd()
+    if zstandard is not None:
+        compressor, header = _compressor(zstandard)
+        stored = header + compressor.compress(raw)
+    else:
+        stored = HEADER_MARK + bytes((FORMAT_VERSION, CODEC_ZLIB)) + zlib.compress(raw, 6)
+    return stored if len(stored) < len(raw) else plain_text(text)
+
+def decompress_text(stored) -> str:
+    if isinstance(stored, str):
+        return stored  # column not converted to binary yet
+    stored = bytes(stored)
+    if not stored.startswith(HEADER_MARK):
+        return stored.decode("utf-8")
+    version, codec = stored[1], stored[2]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unknown compressed text format {version}")
+    payload = stored[3:]
+    if codec == CODEC_RAW:
+        return payload.decode("utf-8")
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    zstandard = _zstd()
+    if zstandard is None:
+        raise ValueError("value is zstd-compressed; install zstandard to read it")
+    dict_id = None
+    if codec == CODEC_ZSTD_DICT_ID:
+        dict_id, payload = int.from_bytes(payload[:4], "big"), payload[4:]
+    elif codec == CODEC_ZSTD_DICT:
+        # ZstdCompressor writes the dictionary id into the frame; fall back to the current one
+        dict_id = zstandard.get_frame_parameters(payload).dict_id
+        if not dict_id:
+            current, _ = _load_dictionaries()
+            if current is None:
+                raise ValueError("value was compressed with a dictionary; set MESSAGE_COMPRESSION_DICT_PATH")
+            dict_id = current.dict_id()
+    elif codec != CODEC_ZSTD:
+        raise ValueError(f"unknown compression codec {codec}")
+    return _decompressor(zstandard, dict_id).decompress(payload).decode("utf-8")
+
+def is_compressed(stored) -> bool:
+    """Framed, i.e. compressed, or plain text that starts with NUL"""
+    return isinstance(stored, (bytes, memoryview)) and bytes(stored[:1]) == HEADER_MARK
+
+class CompressedText(TypeDecorator):
+    """Text column stored as bytes, zstd-compressed (zlib without zstandard) once it is large
+
+    Short values stay plain UTF-8, which is also what rows written before the column was
+    converted look like, so old and new rows read the same way.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect) -> Optional[bytes]:
+        return None if value is None else compress_text(value)
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        return None if value is None else decompress_text(value)
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Index
+from datetime import datetime, timezone
+from app.database import Base
+
+class UsageEvent(Base):
+    """One Gemini call; append-only, written in batches by the metering flush task"""
+    __tablename__ = 'usage_events'
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    event_id = Column(String(32), nullable=False, unique=True)  # dedupes replayed flushes
+    user_id = Column(Integer, nullable=False)
+    message_id = Column(Integer, nullable=True)
+    model = Column(String, nullable=True)
+    outcome = Column(String, nullable=False)  # ok, error
+    prompt_tokens = Column(Integer, default=0)
+    response_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float, default=0.0)
+    occurred_at = Column(DateTime, nullable=False)  # naive UTC
+    hour_start = Column(DateTime, nullable=False)  # occurred_at truncated to the hour
+    recorded_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+
+    __table_args__ = (
+        Index('ix_usage_events_user_hour', 'user_id', 'hour_start'),
+    )
+
+class UsageRollup(Base):
+    """Pre-aggregated usage per user and hour/day bucket, recomputed from usage_events"""
+    __tablename__ = 'usage_rollups'
+
+    user_id = Column(Integer, primary_key=True)
+    granularity = Column(String(8), primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)  # naive UTC
+    requests = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    response_tokens = Column(BigInteger, nullable=False, default=0)
+    latency_ms_total = Column(Float, nullable=False, default=0.0)
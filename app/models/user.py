@@ -7,6 +7,7 @@ from app.database import Base
 class SubscriptionTier(enum.Enum):
     BASIC = 'basic'
     FREE = 'free'
+    PRO = 'pro'
 
 class SubscriptionStatus(enum.Enum):
     ACTIVE = "active"
@@ -22,9 +23,9 @@ class User(Base):
     subscription_tier = Column(Enum(SubscriptionTier), default=SubscriptionTier.BASIC)
     subscription_status = Column(Enum(SubscriptionStatus), default=SubscriptionStatus.INACTIVE)
     daily_usage_count = Column(Integer, default=0)
-    last_usage_reset = Column(DateTime, default=datetime.now(tz=timezone.utc))
-    created_at = Column(DateTime, default=datetime.now(tz=timezone.utc))
-    modified_at = Column(DateTime, default=datetime.now(tz=timezone.utc), onupdate=datetime.now(tz=timezone.utc))
+    last_usage_reset = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc))
+    modified_at = Column(DateTime, default=lambda: datetime.now(tz=timezone.utc), onupdate=lambda: datetime.now(tz=timezone.utc))
 
     chatrooms = relationship('Chatroom', back_populates='user', cascade='all, delete-orphan')
     subscriptions = relationship('Subscription', back_populates='user')
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Online resharding of chat data
+
+    python -m app.reshard --init-shard chat2     # create chat tables on a new shard
+    python -m app.reshard --pin-existing         # pin every user to the shard holding their data
+    python -m app.reshard --move 42 chat1        # move one user's rooms and messages
+    python -m app.reshard --rebalance            # move every pinned user the ring places elsewhere
+
+A user is copied in batches while they keep chatting, then writes are frozen briefly
+(get_chat_db answers 503 + Retry-After). Write requests that resolved the old shard before
+the freeze are waited for, then a catch-up pass runs, the directory is flipped to the new
+shard and the old rows are deleted in batches.
+"""
+import argparse
+import time
+from typing import Iterable, Set
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from .sharding import (
+    SHARD_DIRECTORY_KEY, MIGRATING_PREFIX, _redis, active_writers, create_shard_schema, id_allocator,
+    lookup_shard, open_chat_session, ring, shard_sessions
+)
+from .models.chatroom import Chatroom, Message
+
+IN_FLIGHT_STATUSES = ("Pending..", "processing")
+
+def _row_values(row) -> dict:
+    return {column.key: getattr(row, column.key) for column in row.__table__.columns}
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _copy(target_db, rows: Iterable) -> int:
+    """Upsert rows into target_db: one INSERT ... ON CONFLICT per table, or merge() per row elsewhere"""
+    by_model = {}
+    for row in rows:
+        by_model.setdefault(type(row), []).append(_row_values(row))
+    insert = _UPSERT_DIALECTS.get(target_db.get_bind().dialect.name)
+    copied = 0
+    for model, values in by_model.items():
+        if insert is None:
+            for row_values in values:
+                target_db.merge(model(**row_values))
+        else:
+            table = model.__table__
+            statement = insert(table)
+            target_db.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={column.name: statement.excluded[column.name] for column in table.columns if not column.primary_key}
+            ), values)
+        copied += len(values)
+    target_db.commit()
+    return copied
+
+def _room_ids(db, user_id: int) -> Set[int]:
+    return {room_id for room_id, in db.query(Chatroom.id).filter(Chatroom.user_id == user_id)}
+
+def _copy_user(source_db, target_db, user_id: int, batch_size: int, after_message_id: int = 0) -> int:
+    """Copy rooms, then messages newer than after_message_id; returns the last message id copied"""
+    _copy(target_db, source_db.query(Chatroom).filter(Chatroom.user_id == user_id))
+
+    room_ids = _room_ids(source_db, user_id)
+    last_id = after_message_id
+    while room_ids:
+        batch = source_db.query(Message).filter(
+            Message.chatroom_id.in_(room_ids),
+            Message.id > last_id
+        ).order_by(Message.id).limit(batch_size).all()
+        if not batch:
+            break
+        _copy(target_db, batch)
+        last_id = batch[-1].id
+        source_db.expunge_all()
+    return last_id
+
+def _delete_user(db, user_id: int, batch_size: int, room_ids: Set[int] = None):
+    """Delete a user's chat rows in batches (or only the given rooms)"""
+    room_ids = _room_ids(db, user_id) if room_ids is None else room_ids
+    while room_ids:
+        message_ids = [message_id for message_id, in db.query(Message.id).filter(
+            Message.chatroom_id.in_(room_ids)
+        ).limit(batch_size)]
+        if not message_ids:
+            break
+        db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+        db.commit()
+    if room_ids:
+        db.query(Chatroom).filter(Chatroom.id.in_(room_ids)).delete(synchronize_session=False)
+        db.commit()
+
+def _wait_for_writers(user_id: int, timeout: float) -> bool:
+    """Let write requests that resolved the old shard before the freeze commit there first"""
+    deadline = time.monotonic() + timeout
+    while active_writers(user_id) > 0:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def _wait_for_in_flight(db, user_id: int, timeout: float) -> bool:
+    """Let Gemini tasks already holding the old shard finish before the flip"""
+    deadline = time.monotonic() + timeout
+    while True:
+        in_flight = db.query(func.count(Message.id)).join(Chatroom).filter(
+            Chatroom.user_id == user_id,
+            Message.processing_status.in_(IN_FLIGHT_STATUSES)
+        ).scalar()
+        if not in_flight:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        db.rollback()  # end the snapshot so the next poll sees committed updates
+        time.sleep(0.5)
+
+def migrate_user(user_id: int, target: str, batch_size: int = 500, wait_seconds: float = 30.0) -> bool:
+    """Move one user's chat data to target; returns False if the move was aborted"""
+    source, migrating_to, _ = lookup_shard(user_id)
+    if migrating_to is not None:
+        raise RuntimeError(f"user {user_id} is already migrating to {migrating_to}")
+    if source == target:
+        return True
+
+    redis_client = _redis()
+    source_db = open_chat_session(source)
+    target_db = open_chat_session(target)
+    try:
+        # Bulk copy while the user keeps writing to the source
+        last_id = _copy_user(source_db, target_db, user_id, batch_size)
+
+        # Freeze writes, then copy whatever changed since the first pass
+        redis_client.hset(SHARD_DIRECTORY_KEY, str(user_id), f"{MIGRATING_PREFIX}{source}:{target}")
+        deadline = time.monotonic() + wait_seconds
+        drained = _wait_for_writers(user_id, wait_seconds)
+        source_db.rollback()
+        if not drained or not _wait_for_in_flight(source_db, user_id, max(0.0, deadline - time.monotonic())):
+            redis_client.hset(SHARD_DIRECTORY_KEY, str(user_id), source)
+            _delete_user(target_db, user_id, batch_size)
+            waiting_for = "write requests" if not drained else "messages"
+            print(f"user {user_id}: {waiting_for} still processing after {wait_seconds}s, move aborted")
+            return False
+
+        # Gemini responses written during the first pass update existing rows, so re-copy
+        # messages the target still has in flight; newer messages follow from last_id
+        stale_ids = [message_id for message_id, in target_db.query(Message.id).join(Chatroom).filter(
+            Chatroom.user_id == user_id,
+            Message.processing_status.in_(IN_FLIGHT_STATUSES)
+        )]
+        if stale_ids:
+            _copy(target_db, source_db.query(Message).filter(Message.id.in_(stale_ids)))
+        source_db.expunge_all()
+        _copy_user(source_db, target_db, user_id, batch_size, after_message_id=last_id)
+
+        # Rooms deleted on the source during the first pass
+        removed = _room_ids(target_db, user_id) - _room_ids(source_db, user_id)
+        _delete_user(target_db, user_id, batch_size, room_ids=removed)
+
+        redis_client.hset(SHARD_DIRECTORY_KEY, str(user_id), target)
+        _delete_user(source_db, user_id, batch_size)
+        print(f"user {user_id}: moved {source} -> {target}")
+        return True
+    finally:
+        source_db.close()
+        target_db.close()
+
+def pin_existing():
+    """Pin users to where their rows are and seed the id allocator above existing ids"""
+    redis_client = _redis()
+    for shard in sorted(shard_sessions):
+        db = open_chat_session(shard)
+        try:
+            user_ids = [user_id for user_id, in db.query(Chatroom.user_id).distinct()]
+            for user_id in user_ids:
+                redis_client.hsetnx(SHARD_DIRECTORY_KEY, str(user_id), shard)
+            id_allocator.seed("chatrooms", db.query(func.max(Chatroom.id)).scalar() or 0)
+            id_allocator.seed("messages", db.query(func.max(Message.id)).scalar() or 0)
+            print(f"{shard}: pinned {len(user_ids)} users")
+        finally:
+            db.close()
+
+def rebalance(batch_size: int = 500, wait_seconds: float = 30.0):
+    """Move every pinned user whose ring placement changed (e.g. after adding a shard)"""
+    for user_id, placement in _redis().hgetall(SHARD_DIRECTORY_KEY).items():
+        user_id = int(user_id)
+        placement = placement.decode() if isinstance(placement, bytes) else placement
+        if placement.startswith(MIGRATING_PREFIX):
+            continue
+        target = ring.get(user_id)
+        if target != placement:
+            migrate_user(user_id, target, batch_size, wait_seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Move chat data between shards")
+    parser.add_argument("--init-shard", metavar="SHARD", help="create chat tables on a shard")
+    parser.add_argument("--pin-existing", action="store_true", help="pin users to their current shard")
+    parser.add_argument("--move", nargs=2, metavar=("USER_ID", "SHARD"), help="move one user")
+    parser.add_argument("--rebalance", action="store_true", help="move users to their ring placement")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--wait-seconds", type=float, default=30.0)
+    args = parser.parse_args()
+
+    if ring is None:
+        parser.error("CHAT_SHARD_URLS is not configured")
+    if args.init_shard:
+        create_shard_schema(args.init_shard)
+    if args.pin_existing:
+        pin_existing()
+    if args.move:
+        migrate_user(int(args.move[0]), args.move[1], args.batch_size, args.wait_seconds)
+    if args.rebalance:
+        rebalance(args.batch_size, args.wait_seconds)
+
+if __name__ == "__main__":
+    main()
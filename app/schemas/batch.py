@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
+
+class BatchOperation(BaseModel):
+    method: Literal["GET", "POST", "PUT", "DELETE"] = "GET"
+    path: str = Field(..., pattern="^/", max_length=2000)  # may carry a query string
+    body: Optional[Any] = None  # sent as JSON
+    headers: Dict[str, str] = {}  # e.g. If-None-Match, Idempotency-Key; Authorization is the batch's own
+    id: Optional[str] = None  # echoed back, to match results to operations
+
+class BatchRequest(BaseModel):
+    requests: List[BatchOperation] = Field(..., min_length=1)
+
+class BatchResult(BaseModel):
+    id: Optional[str] = None
+    status: int
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResult]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class MessageBase(BaseModel):
     content: str = Field(..., min_length=1, max_length=1000)
@@ -8,6 +8,17 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     pass
 
+class ImportedMessage(BaseModel):
+    """One line of a bulk import (NDJSON): a prompt and, usually, the answer it got"""
+    content: str = Field(..., min_length=1)
+    gemini_response: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class MessageImportResponse(BaseModel):
+    chatroom_id: int
+    imported: int
+    message_count: int
+
 class MessageResponse(BaseModel):
     id: int
     content: str
@@ -15,6 +26,9 @@ class MessageResponse(BaseModel):
     created_at: datetime
     gemini_response: Optional[str] = None
     processing_status: str
+    processing_latency: Optional[Dict[str, float]] = None
+    response_source: Optional[str] = None
+    cache_similarity: Optional[float] = None
     
     class Config:
         from_attributes = True
@@ -0,0 +1,105 @@
+"""Pre-fork production server: one master, N uvicorn worker processes
+
+    python -m app.server                      # WEB_WORKERS (default: one per CPU)
+    python -m app.server --workers 4 --bind 0.0.0.0:8000
+
+The master imports the app once before forking (preload), so workers share its memory
+copy-on-write, and each worker runs the app lifespan to open its own pools and threads.
+DB and Redis pools are sized per worker (settings.per_worker) so the server stays within
+DB_MAX_CONNECTIONS / REDIS_MAX_CONNECTIONS however many workers run.
+
+Signals go to the master: HUP replaces the workers gracefully, TERM drains in-flight
+requests for up to WEB_GRACEFUL_TIMEOUT seconds. Because the app is preloaded, HUP'd
+workers fork from the master's copy and keep its code *and* settings. To deploy new code
+or settings without downtime send USR2 (starts a new master alongside), then TERM the old
+master once the new one is serving. Both masters share PROMETHEUS_MULTIPROC_DIR meanwhile;
+it is only emptied by a master that finds no other one using it.
+"""
+import argparse
+import fcntl
+import os
+import tempfile
+from gunicorn.app.base import BaseApplication
+from .config import per_worker, settings
+
+def _worker_exited(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+class PreforkServer(BaseApplication):
+    def __init__(self, options: dict, load_app=None):
+        self.options = options
+        self.load_app = load_app
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if self.load_app is not None:
+            return self.load_app()
+        from .main import app
+
+        return app
+
+def server_options(workers: int, bind: str) -> dict:
+    return {
+        "bind": bind,
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "graceful_timeout": settings.WEB_GRACEFUL_TIMEOUT,
+        "child_exit": _worker_exited,
+    }
+
+METRICS_LOCK_FILE = ".masters.lock"
+_metrics_lock = None  # held shared for the master's lifetime (and its workers')
+
+def _claim_metrics_dir(path: str):
+    """Take a shared lock on the metrics dir, emptying it first if no other master holds one"""
+    global _metrics_lock
+    os.makedirs(path, exist_ok=True)
+    lock_file = open(os.path.join(path, METRICS_LOCK_FILE), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        pass  # another master (e.g. the old one during a USR2 upgrade) is still writing here
+    else:
+        # Stale files from a previous run would be summed into this one
+        for name in os.listdir(path):
+            if name != METRICS_LOCK_FILE:
+                os.remove(os.path.join(path, name))
+    fcntl.flock(lock_file, fcntl.LOCK_SH)
+    _metrics_lock = lock_file
+
+def prepare_environment(workers: int):
+    """Must run before the app (or prometheus_client) is imported"""
+    os.environ["WEB_WORKER_PROCESSES"] = str(workers)
+    # Fail here, in the master, instead of in every worker after the fork
+    for name in ("DB_MAX_CONNECTIONS", "REDIS_MAX_CONNECTIONS"):
+        try:
+            per_worker(getattr(settings, name))
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}; raise it or run fewer workers") from None
+    path = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "gemini-backend-metrics"))
+    _claim_metrics_dir(path)
+
+def run(workers: int, bind: str, load_app=None):
+    prepare_environment(workers)
+    PreforkServer(server_options(workers, bind), load_app).run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked worker processes")
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--bind", default=settings.WEB_BIND)
+    args = parser.parse_args()
+    try:
+        prepare_environment(args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    PreforkServer(server_options(args.workers, args.bind)).run()
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,7 @@ class AuthService:
         """Generate and send OTP"""
         otp = generate_otp()
         store_otp(mobile_number, otp, settings.OTP_EXPIRATION_MINUTES)
-        return send_otp_sms(mobile_number, otp)
+        return send_otp_sms(mobile_number, otp, settings.OTP_EXPIRATION_MINUTES)
     
     def verify_otp_code(self, mobile_number: str, otp: str) -> bool:
         """Verify OTP code"""
@@ -1,11 +1,13 @@
-import redis
 import json
 from typing import Any, Optional
-from ..config import settings
 
 class CacheService:
-    def __init__(self):
-        self.redis_client = redis.from_url(settings.REDIS_URL)
+    def __init__(self, redis_client=None):
+        if redis_client is None:
+            from ..clients import get_redis
+
+            redis_client = get_redis()
+        self.redis_client = redis_client
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
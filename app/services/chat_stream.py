@@ -0,0 +1,177 @@
+"""Per-chatroom ordered Gemini work on partitioned Redis Streams
+
+A chatroom hashes to one of CHAT_STREAM_PARTITIONS streams, all read through one consumer
+group. Each partition is leased to exactly one worker at a time, which handles its entries
+one after another: replies in a chatroom land in the order its messages were sent, while
+different partitions run in parallel.
+
+Workers heartbeat into a sorted set, and every worker derives the same owner for each
+partition from the live set (rendezvous hashing), so a worker joining or leaving moves only
+its share of partitions. A partition changes hands once its lease is released (rebalance)
+or expires (crash); the new owner first claims the old owner's pending entries with
+XAUTOCLAIM and processes them ahead of new ones. A message the crashed worker was in the
+middle of stays leased to it for MESSAGE_LEASE_SECONDS, longer than the partition lease,
+so the new owner pauses the partition until then rather than skip ahead of it.
+"""
+import hashlib
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from redis.exceptions import ResponseError
+from ..config import settings
+
+STREAM_PREFIX = "chat:stream:"
+LEASE_PREFIX = "chat:stream:lease:"
+WORKERS_KEY = "chat:stream:workers"
+GROUP = "gemini"
+
+# Extend or drop a partition lease only while we still hold it
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class ChatStream:
+    """Partitioned streams, their consumer group, worker membership and partition leases"""
+
+    def __init__(self, redis_client, partitions: Optional[int] = None, lease_seconds: Optional[int] = None):
+        self.redis_client = redis_client
+        self.partitions = partitions or settings.CHAT_STREAM_PARTITIONS
+        self.lease_seconds = lease_seconds or settings.CHAT_STREAM_LEASE_SECONDS
+        self._renew = redis_client.register_script(RENEW_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._groups_ready = False
+
+    def partition_for(self, chatroom_id: int) -> int:
+        return _hash(str(chatroom_id)) % self.partitions
+
+    def stream_key(self, partition: int) -> str:
+        return f"{STREAM_PREFIX}{partition}"
+
+    def ensure_groups(self):
+        if self._groups_ready:
+            return
+        for partition in range(self.partitions):
+            try:
+                self.redis_client.xgroup_create(self.stream_key(partition), GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._groups_ready = True
+
+    def publish(self, chatroom_id: int, message_id: int, shard: Optional[str] = None,
+                trace_headers: Optional[dict] = None, enqueued_at: Optional[float] = None,
+                ticket: Optional[str] = None, cost: Optional[int] = None) -> str:
+        """Append a message to its chatroom's partition; returns the entry id
+
+        ticket is the message's StreamAdmission ticket and cost its estimated tokens.
+        """
+        fields = {
+            "message_id": message_id,
+            "chatroom_id": chatroom_id,
+            "shard": shard or "",
+            "trace": json.dumps(trace_headers or {}),
+            "enqueued_at": enqueued_at or time.time(),
+            "ticket": ticket or "",
+            "cost": cost or "",
+        }
+        return self.redis_client.xadd(self.stream_key(self.partition_for(chatroom_id)), fields)
+
+    # Membership
+
+    def heartbeat(self, worker_id: str) -> List[str]:
+        """Announce worker_id for one lease period; returns the live workers"""
+        now = time.time()
+        pipe = self.redis_client.pipeline()
+        pipe.zadd(WORKERS_KEY, {worker_id: now + self.lease_seconds})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now)
+        pipe.zrange(WORKERS_KEY, 0, -1)
+        live = pipe.execute()[-1]
+        return sorted(worker.decode() if isinstance(worker, bytes) else worker for worker in live)
+
+    def leave(self, worker_id: str):
+        self.redis_client.zrem(WORKERS_KEY, worker_id)
+
+    def assignment(self, workers: Iterable[str]) -> Dict[int, str]:
+        """Target owner of every partition: the live worker with the highest hash for it"""
+        workers = list(workers)
+        if not workers:
+            return {}
+        return {
+            partition: max(workers, key=lambda worker: _hash(f"{worker}#{partition}"))
+            for partition in range(self.partitions)
+        }
+
+    # Partition leases
+
+    def acquire(self, partition: int, worker_id: str) -> bool:
+        return bool(self.redis_client.set(f"{LEASE_PREFIX}{partition}", worker_id, nx=True, ex=self.lease_seconds))
+
+    def renew(self, partition: int, worker_id: str) -> bool:
+        return bool(self._renew(keys=[f"{LEASE_PREFIX}{partition}"], args=[worker_id, self.lease_seconds]))
+
+    def release(self, partition: int, worker_id: str) -> bool:
+        return bool(self._release(keys=[f"{LEASE_PREFIX}{partition}"], args=[worker_id]))
+
+    # Entries
+
+    def claim_pending(self, partition: int, worker_id: str, batch_size: int = 100) -> int:
+        """Move every entry another consumer read but never acked to worker_id (XAUTOCLAIM)"""
+        claimed = 0
+        cursor = "0-0"
+        while True:
+            cursor, entries, _ = self.redis_client.xautoclaim(
+                self.stream_key(partition), GROUP, worker_id, 0, cursor, count=batch_size
+            )
+            claimed += len(entries)
+            if cursor in (b"0-0", "0-0"):
+                return claimed
+
+    def read(self, partitions: Iterable[int], worker_id: str, pending: bool = False,
+             count: int = 10, block_ms: Optional[int] = None) -> Dict[int, List[Tuple[str, dict]]]:
+        """Entries per partition: worker_id's unacked ones (pending=True) or new ones"""
+        streams = {self.stream_key(partition): "0" if pending else ">" for partition in partitions}
+        if not streams:
+            return {}
+        response = self.redis_client.xreadgroup(GROUP, worker_id, streams, count=count, block=block_ms)
+        batches = {}
+        for key, entries in response or []:
+            key = key.decode() if isinstance(key, bytes) else key
+            # Pending reads list entries deleted since as (id, None); those only need an ack
+            batches[int(key[len(STREAM_PREFIX):])] = [
+                (entry_id, _decode(fields) if fields else None) for entry_id, fields in entries
+            ]
+        return batches
+
+    def ack(self, partition: int, entry_id):
+        """Done with an entry: acknowledge it and drop it from the stream"""
+        pipe = self.redis_client.pipeline()
+        pipe.xack(self.stream_key(partition), GROUP, entry_id)
+        pipe.xdel(self.stream_key(partition), entry_id)
+        pipe.execute()
+
+def _decode(fields: dict) -> dict:
+    decoded = {
+        (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+        for key, value in fields.items()
+    }
+    return {
+        "message_id": int(decoded["message_id"]),
+        "chatroom_id": int(decoded["chatroom_id"]),
+        "shard": decoded.get("shard") or None,
+        "trace_headers": json.loads(decoded.get("trace") or "{}"),
+        "enqueued_at": float(decoded["enqueued_at"]) if decoded.get("enqueued_at") else None,
+        "ticket": decoded.get("ticket") or None,
+        "cost": int(decoded["cost"]) if decoded.get("cost") else None,
+    }
@@ -0,0 +1,482 @@
+"""Tier-weighted fair scheduling of Gemini work
+
+FairScheduler is the pure policy (no threads, no I/O, injectable clock) so it can be driven
+by a simulation; GeminiDispatcher runs it with a pool of worker threads in the API process.
+
+The queue lives in process memory, unlike the Celery queue it replaced: jobs queued in a
+process that restarts or crashes are lost from it. Their messages stay 'Pending..' and are
+only picked up again by the recover_expired_leases sweep once MESSAGE_PENDING_LEASE_SECONDS
+pass, behind anything sent since.
+
+With CHAT_STREAM_ENABLED the work is answered by stream workers in other processes instead,
+so StreamAdmission applies the same per-user and token-budget limits through Redis, and the
+workers draw from the same RedisTokenBudget.
+"""
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+from ..utils.metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_REJECTIONS, SCHEDULER_WAIT
+from .gemini_service import GeminiUnavailable
+
+class AdmissionRejected(Exception):
+    """Raised when work is refused up front instead of queueing without bound"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBudgetExhausted(Exception):
+    """The shared tokens-per-minute budget is spent; retry once the window rolls"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gemini token budget spent, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+@dataclass
+class Job:
+    user_id: int
+    tier: str
+    cost: int  # estimated tokens
+    enqueued_at: float = 0.0
+    started_at: Optional[float] = None
+    payload: Any = field(default=None, repr=False)
+
+def estimate_tokens(prompt: str, response_tokens: int) -> int:
+    """Rough token estimate (about 4 characters per token) plus the expected reply"""
+    return len(prompt) // 4 + 1 + response_tokens
+
+class TokenBudget:
+    """Tokens-per-minute budget over fixed one-minute windows (in-process)"""
+
+    def __init__(self, tokens_per_minute: int, clock: Callable[[], float] = time.time):
+        self.tokens_per_minute = tokens_per_minute
+        self.clock = clock
+        self._window = None
+        self._used = 0
+
+    def _roll(self):
+        window = int(self.clock() // 60)
+        if window != self._window:
+            self._window = window
+            self._used = 0
+
+    def try_consume(self, tokens: int) -> bool:
+        self._roll()
+        # A single job larger than the whole budget still runs, alone, in a fresh window
+        if self._used and self._used + tokens > self.tokens_per_minute:
+            return False
+        self._used += tokens
+        return True
+
+    def retry_after(self) -> float:
+        return 60 - self.clock() % 60
+
+class RedisTokenBudget(TokenBudget):
+    """Tokens-per-minute budget shared by every process through Redis"""
+
+    CONSUME_SCRIPT = """
+    local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local tokens = tonumber(ARGV[1])
+    if used > 0 and used + tokens > tonumber(ARGV[2]) then
+        return 0
+    end
+    redis.call('INCRBY', KEYS[1], tokens)
+    redis.call('EXPIRE', KEYS[1], 120)
+    return 1
+    """
+
+    def __init__(self, redis_client, tokens_per_minute: int, clock: Callable[[], float] = time.time):
+        super().__init__(tokens_per_minute, clock)
+        self.redis = redis_client
+        self._consume = None
+
+    def try_consume(self, tokens: int) -> bool:
+        if self._consume is None:
+            self._consume = self.redis.register_script(self.CONSUME_SCRIPT)
+        key = f"gemini:tpm:{int(self.clock() // 60)}"
+        try:
+            return bool(self._consume(keys=[key], args=[tokens, self.tokens_per_minute]))
+        except Exception as e:
+            # Redis trouble should not stall every worker; fall back to the local window
+            print(f"Token budget error: {e}")
+            return super().try_consume(tokens)
+
+RATE_WINDOW_SECONDS = 30.0
+# Admit only while the estimate leaves this much of max_wait_seconds spare: job times vary,
+# and an estimate right at the bound would put half the admitted jobs over it
+ADMIT_WAIT_FRACTION = 0.8
+
+class FairScheduler:
+    """Deficit round robin across tiers, round robin across users within a tier
+
+    Each visit gives a tier weight * quantum tokens of credit, so with weights pro=8 and
+    basic=1 Pro work gets eight times the Gemini throughput of Basic work when both are
+    backlogged, and any tier can use idle capacity. Inside a tier every user with queued
+    work is served in turn, so one user cannot monopolize the workers.
+
+    Admission refuses a job whose expected queue wait exceeds max_wait_seconds. The wait is
+    estimated from the queue as it is now (the jobs round robin would serve first) and the
+    measured throughput of the workers (workers / recent mean job time, times the tier's
+    weighted share), not from how long earlier jobs happened to wait.
+    """
+
+    def __init__(
+        self,
+        weights: Dict[str, int],
+        budget: TokenBudget,
+        max_queue_per_tier: int = 1000,
+        max_pending_per_user: int = 10,
+        max_wait_seconds: float = 30.0,
+        workers: int = 8,
+        quantum: int = 1000,
+        default_tier: str = "basic",
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError("tier weights must be positive")
+        self.weights = weights
+        self.budget = budget
+        self.max_queue_per_tier = max_queue_per_tier
+        self.max_pending_per_user = max_pending_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self.workers = workers
+        self.quantum = quantum
+        self.default_tier = default_tier
+        self.clock = clock
+
+        self.order = sorted(weights, key=lambda tier: -weights[tier])
+        self.queues: Dict[str, "OrderedDict[int, Deque[Job]]"] = {tier: OrderedDict() for tier in self.order}
+        self.queued_jobs: Dict[str, int] = {tier: 0 for tier in self.order}
+        self.deficits: Dict[str, float] = {tier: 0.0 for tier in self.order}
+        # Over the last RATE_WINDOW_SECONDS: dispatch times per tier, (finish time, job seconds)
+        self.dispatched: Dict[str, Deque[float]] = {tier: deque() for tier in self.order}
+        self.finished: Deque = deque()
+        self._first_dispatch: Optional[float] = None
+        self.pending: Dict[int, int] = {}
+        self.queued_tokens = 0
+        self._index = 0
+        self._credited = False
+
+    def admit(self, user_id: int, tier: str, cost: int) -> Job:
+        """Reserve a slot for a job, or raise AdmissionRejected"""
+        tier = tier if tier in self.weights else self.default_tier
+        if self.pending.get(user_id, 0) >= self.max_pending_per_user:
+            raise AdmissionRejected("user_pending", 5.0)
+        if self.queued_jobs[tier] >= self.max_queue_per_tier:
+            raise AdmissionRejected("tier_queue_full", 5.0)
+        # Workers are the bottleneck: how long the work ahead of this job takes to drain
+        expected_wait = self.expected_wait(user_id, tier)
+        allowed_wait = self.max_wait_seconds * ADMIT_WAIT_FRACTION
+        if expected_wait > allowed_wait:
+            raise AdmissionRejected("queue_wait", expected_wait - allowed_wait)
+        # The token budget is the bottleneck: queued tokens take this long to fit in the quota
+        expected_wait = (self.queued_tokens + cost) / self.budget.tokens_per_minute * 60
+        if expected_wait > self.max_wait_seconds:
+            raise AdmissionRejected("token_budget", expected_wait - self.max_wait_seconds)
+
+        self.pending[user_id] = self.pending.get(user_id, 0) + 1
+        self.queued_tokens += cost
+        return Job(user_id=user_id, tier=tier, cost=cost)
+
+    def _window(self) -> float:
+        """Length of the measurement window so far (shorter right after startup)"""
+        return min(RATE_WINDOW_SECONDS, max(1.0, self.clock() - self._first_dispatch))
+
+    def dispatch_rate(self, tier: str) -> float:
+        """Jobs per second the tier got over the last RATE_WINDOW_SECONDS"""
+        times = self.dispatched[tier]
+        while times and times[0] < self.clock() - RATE_WINDOW_SECONDS:
+            times.popleft()
+        return len(times) / self._window() if times else 0.0
+
+    def service_seconds(self) -> Optional[float]:
+        """Mean dispatch-to-complete time of recent jobs, None when none finished lately"""
+        while self.finished and self.finished[0][0] < self.clock() - RATE_WINDOW_SECONDS:
+            self.finished.popleft()
+        if not self.finished:
+            return None
+        return sum(elapsed for _, elapsed in self.finished) / len(self.finished)
+
+    def expected_wait(self, user_id: int, tier: str) -> float:
+        """Seconds a new job of user_id would queue at the current throughput (0 before any job finished)"""
+        service_seconds = self.service_seconds()
+        if not service_seconds:
+            return 0.0
+        users = self.queues[tier]
+        # Round robin serves one job per queued user per round, and the new job goes out in
+        # round `rounds`. Users who run dry are replaced by new arrivals, which join the
+        # rotation ahead of it, so count a full round of the others for each round
+        rounds = len(users.get(user_id, ())) + 1
+        ahead = rounds - 1 + rounds * (len(users) - (user_id in users))
+        if not ahead:
+            return 0.0
+        # The tier gets what the other tiers leave over, and at least its weighted share
+        capacity = self.workers / service_seconds
+        others = sum(self.dispatch_rate(name) for name in self.order if name != tier)
+        # Their arrivals are bursty: allow for three standard deviations (Poisson) above the window
+        others += 3 * (others / self._window()) ** 0.5 if others else 0.0
+        share = self.weights[tier] / sum(self.weights.values())
+        return (ahead + 1) / max(capacity - others, capacity * share)  # +1: a worker has to free up first
+
+    def enqueue(self, job: Job):
+        job.enqueued_at = self.clock()
+        self.queues[job.tier].setdefault(job.user_id, deque()).append(job)
+        self.queued_jobs[job.tier] += 1
+
+    def requeue(self, job: Job):
+        """Put a dispatched job back in line, keeping its admission slot"""
+        self.queued_tokens += job.cost
+        self.enqueue(job)
+
+    def cancel(self, job: Job):
+        """Give back an admitted job's slot when it will never be enqueued"""
+        self.queued_tokens -= job.cost
+        self._release(job)
+
+    def complete(self, job: Job):
+        if job.started_at is not None:
+            self.finished.append((self.clock(), self.clock() - job.started_at))
+        self._release(job)
+
+    def _release(self, job: Job):
+        remaining = self.pending.get(job.user_id, 0) - 1
+        if remaining > 0:
+            self.pending[job.user_id] = remaining
+        else:
+            self.pending.pop(job.user_id, None)
+
+    def _advance(self):
+        self._index = (self._index + 1) % len(self.order)
+        self._credited = False
+
+    def next_job(self) -> Optional[Job]:
+        """Pop the next job to run, or None if nothing is queued or the budget is spent"""
+        if not any(self.queued_jobs.values()):
+            return None
+        while True:
+            tier = self.order[self._index]
+            users = self.queues[tier]
+            if not users:
+                self.deficits[tier] = 0.0  # idle tiers do not bank credit
+                self._advance()
+                continue
+            if not self._credited:
+                self.deficits[tier] += self.weights[tier] * self.quantum
+                self._credited = True
+
+            user_id, jobs = next(iter(users.items()))
+            job = jobs[0]
+            if self.deficits[tier] < job.cost:
+                self._advance()
+                continue
+            if not self.budget.try_consume(job.cost):
+                return None
+
+            jobs.popleft()
+            if jobs:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            self.deficits[tier] -= job.cost
+            self.queued_jobs[tier] -= 1
+            self.queued_tokens -= job.cost
+            job.started_at = self.clock()
+            if self._first_dispatch is None:
+                self._first_dispatch = job.started_at
+            self.dispatched[tier].append(job.started_at)
+            return job
+
+class GeminiDispatcher:
+    """Runs scheduled Gemini jobs on a fixed pool of worker threads"""
+
+    def __init__(self, scheduler: FairScheduler, workers: int = 8):
+        self.scheduler = scheduler
+        self.workers = workers
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"gemini-dispatch-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def admit(self, user_id: int, tier: str, cost: int) -> Job:
+        with self._condition:
+            try:
+                return self.scheduler.admit(user_id, tier, cost)
+            except AdmissionRejected as e:
+                SCHEDULER_REJECTIONS.labels(tier, e.reason).inc()
+                raise
+
+    def submit(self, job: Job, func: Callable, *args, **kwargs):
+        job.payload = (func, args, kwargs)
+        with self._condition:
+            self.scheduler.enqueue(job)
+            SCHEDULER_QUEUE_DEPTH.labels(job.tier).set(self.scheduler.queued_jobs[job.tier])
+            self._condition.notify()
+
+    def cancel(self, job: Job):
+        with self._condition:
+            self.scheduler.cancel(job)
+
+    def _next(self) -> Optional[Job]:
+        with self._condition:
+            while True:
+                job = self.scheduler.next_job()
+                if job is not None:
+                    SCHEDULER_QUEUE_DEPTH.labels(job.tier).set(self.scheduler.queued_jobs[job.tier])
+                    return job
+                if self._stopping and not any(self.scheduler.queued_jobs.values()):
+                    return None
+                # Woken by submit; otherwise re-check when the token window may have rolled
+                self._condition.wait(timeout=min(1.0, self.scheduler.budget.retry_after()))
+
+    def _run(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            SCHEDULER_WAIT.labels(job.tier).observe(self.scheduler.clock() - job.enqueued_at)
+            func, args, kwargs = job.payload
+            try:
+                func(*args, **kwargs)
+            except GeminiUnavailable as e:
+                # The job keeps its admission slot, so users cannot pile up work during an outage
+                self._requeue_later(job, e.retry_after)
+                continue
+            except Exception as e:
+                print(f"Gemini dispatch error: {e}")
+            with self._condition:
+                self.scheduler.complete(job)
+
+    def _requeue_later(self, job: Job, delay: float):
+        def requeue():
+            with self._condition:
+                self.scheduler.requeue(job)
+                self._condition.notify()
+
+        timer = threading.Timer(delay + random.uniform(0, 1), requeue)
+        timer.daemon = True
+        timer.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop accepting work and let workers drain the queue"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+class StreamAdmission:
+    """Admission for chat stream work, shared by every API process through Redis
+
+    Each admitted message holds a ticket until a stream worker finishes it. A user may hold
+    max_pending_per_user tickets, and the tokens of all tickets must fit the budget within
+    max_wait_seconds; a tier only gets its weight's share of that (relative to the highest
+    weight), so when Gemini is backed up Basic work is refused before Pro work. The stream
+    itself stays first in, first out per partition, to keep each chatroom in order.
+    Tickets whose messages are never finished (a crashed worker, a lost publish) lapse after
+    stale_seconds.
+    """
+
+    TICKETS_KEY = "gemini:stream:tickets"  # ticket -> admitted at
+    TOKENS_KEY = "gemini:stream:queued_tokens"
+
+    # Tickets are "<uuid>:<user_id>:<cost>", so lapsed ones can be subtracted here
+    ADMIT_SCRIPT = """
+    local lapsed = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[4])
+    for _, ticket in ipairs(lapsed) do
+        redis.call('DECRBY', KEYS[2], tonumber(string.match(ticket, ':(%d+)$')))
+        redis.call('ZREM', KEYS[1], ticket)
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[4])
+    if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[5]) then
+        return {-1, 0}
+    end
+    local queued = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if queued + tonumber(ARGV[2]) > tonumber(ARGV[6]) then
+        return {0, queued}
+    end
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+    redis.call('EXPIRE', KEYS[3], ARGV[7])
+    redis.call('INCRBY', KEYS[2], ARGV[2])
+    return {1, queued}
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+        redis.call('DECRBY', KEYS[2], ARGV[2])
+    end
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    return 1
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        budget: TokenBudget,
+        weights: Dict[str, int],
+        max_pending_per_user: int = 10,
+        max_wait_seconds: float = 30.0,
+        stale_seconds: float = 120.0,
+        default_tier: str = "basic",
+        clock: Callable[[], float] = time.time
+    ):
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError("tier weights must be positive")
+        self.redis = redis_client
+        self.budget = budget
+        self.weights = weights
+        self.max_pending_per_user = max_pending_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self.stale_seconds = stale_seconds
+        self.default_tier = default_tier
+        self.clock = clock
+        self._admit = None
+        self._release = None
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"gemini:stream:tickets:{user_id}"
+
+    def token_limit(self, tier: str) -> int:
+        """Queued tokens at which the tier's messages are refused"""
+        share = self.weights[tier] / max(self.weights.values())
+        return int(self.budget.tokens_per_minute * self.max_wait_seconds / 60 * share)
+
+    def admit(self, user_id: int, tier: str, cost: int) -> str:
+        """Take a ticket for a message, or raise AdmissionRejected"""
+        tier = tier if tier in self.weights else self.default_tier
+        if self._admit is None:
+            self._admit = self.redis.register_script(self.ADMIT_SCRIPT)
+        ticket = f"{uuid.uuid4().hex}:{user_id}:{cost}"
+        now = self.clock()
+        limit = self.token_limit(tier)
+        admitted, queued = self._admit(
+            keys=[self.TICKETS_KEY, self.TOKENS_KEY, self._user_key(user_id)],
+            args=[ticket, cost, now, now - self.stale_seconds, self.max_pending_per_user, limit,
+                  int(self.stale_seconds)]
+        )
+        if admitted == 1:
+            return ticket
+        if admitted == -1:
+            SCHEDULER_REJECTIONS.labels(tier, "user_pending").inc()
+            raise AdmissionRejected("user_pending", 5.0)
+        SCHEDULER_REJECTIONS.labels(tier, "token_budget").inc()
+        raise AdmissionRejected("token_budget", (queued + cost - limit) / self.budget.tokens_per_minute * 60)
+
+    def release(self, ticket: str):
+        """Give the ticket back once its message is answered (or will never be)"""
+        if self._release is None:
+            self._release = self.redis.register_script(self.RELEASE_SCRIPT)
+        _, user_id, cost = ticket.rsplit(":", 2)
+        self._release(keys=[self.TICKETS_KEY, self.TOKENS_KEY, self._user_key(int(user_id))], args=[ticket, cost])
@@ -1,27 +1,107 @@
-import google.generativeai as genai
+import time
+from dataclasses import dataclass
 from typing import Optional
 from ..config import settings
+from ..utils.metrics import GEMINI_REQUEST_LATENCY, GEMINI_TOKENS, GEMINI_ERRORS
+from ..utils.tracing import tracer
+from ..utils.circuit_breaker import CircuitOpenError, RedisCircuitBreaker
+
+@dataclass
+class GeminiResult:
+    text: str
+    model: str
+    prompt_tokens: int
+    response_tokens: int
+    latency_ms: float
+
+class GeminiUnavailable(Exception):
+    """Every configured model's circuit is open; the work should be retried later"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Gemini unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
 
 class GeminiService:
-    def __init__(self):
+    def __init__(self, model_name: Optional[str] = None, redis_client=None):
+        import google.generativeai as genai
+
+        if redis_client is None:
+            from ..clients import get_redis
+
+            redis_client = get_redis()
         genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    async def generate_response(self, prompt: str) -> Optional[str]:
-        """Generate response from Gemini API"""
+        self.model_name = model_name or settings.GEMINI_MODEL
+        self.model = genai.GenerativeModel(self.model_name)
+        self.breaker = RedisCircuitBreaker(
+            f"gemini:{self.model_name}",
+            redis_client,
+            window_seconds=settings.GEMINI_BREAKER_WINDOW_SECONDS,
+            min_calls=settings.GEMINI_BREAKER_MIN_CALLS,
+            error_rate_threshold=settings.GEMINI_BREAKER_ERROR_RATE,
+            slow_call_seconds=settings.GEMINI_SLOW_CALL_SECONDS,
+            slow_rate_threshold=settings.GEMINI_BREAKER_SLOW_RATE,
+            reset_timeout=settings.GEMINI_BREAKER_RESET_SECONDS,
+            max_reset_timeout=settings.GEMINI_BREAKER_MAX_RESET_SECONDS
+        )
+
+    def _generate(self, prompt: str):
+        """Call the model, recording latency, token usage and errors"""
+        with tracer.start_as_current_span("gemini.generate_content") as span:
+            span.set_attribute("gemini.model", self.model_name)
+            start = time.perf_counter()
+            try:
+                response = self.breaker.call(
+                    self.model.generate_content,
+                    prompt,
+                    request_options={"timeout": settings.GEMINI_TIMEOUT_SECONDS}
+                )
+            except CircuitOpenError:
+                span.set_attribute("gemini.circuit_open", True)
+                raise
+            except Exception:
+                GEMINI_ERRORS.labels(self.model_name).inc()
+                GEMINI_REQUEST_LATENCY.labels(self.model_name, "error").observe(time.perf_counter() - start)
+                raise
+            GEMINI_REQUEST_LATENCY.labels(self.model_name, "ok").observe(time.perf_counter() - start)
+
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                GEMINI_TOKENS.labels(self.model_name, "prompt").inc(usage.prompt_token_count or 0)
+                GEMINI_TOKENS.labels(self.model_name, "response").inc(usage.candidates_token_count or 0)
+                span.set_attribute("gemini.prompt_tokens", usage.prompt_token_count or 0)
+                span.set_attribute("gemini.response_tokens", usage.candidates_token_count or 0)
+            return response
+
+    def generate(self, prompt: str) -> GeminiResult:
+        """Generate a response with its token usage and latency; raises on failure"""
+        start = time.perf_counter()
+        response = self._generate(prompt)
+        usage = getattr(response, "usage_metadata", None)
+        return GeminiResult(
+            text=response.text,
+            model=self.model_name,
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            response_tokens=(usage.candidates_token_count or 0) if usage else 0,
+            latency_ms=round((time.perf_counter() - start) * 1000, 2)
+        )
+
+    def generate_response(self, prompt: str) -> Optional[str]:
+        """Generate response from Gemini API; raises CircuitOpenError while the model is tripped"""
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._generate(prompt).text
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"Gemini API error: {e}")
             return None
-    
-    async def generate_chat_response(self, message: str, context: str = "") -> Optional[str]:
+
+    def generate_chat_response(self, message: str, context: str = "") -> Optional[str]:
         """Generate chat response with context"""
         try:
             full_prompt = f"Context: {context}\n\nUser: {message}\n\nAssistant:"
-            response = self.model.generate_content(full_prompt)
-            return response.text
+            return self._generate(full_prompt).text
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"Gemini chat error: {e}")
-            return None
\ No newline at end of file
+            return None
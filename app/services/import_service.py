@@ -0,0 +1,210 @@
+"""Bulk import of conversation history into a chatroom
+
+Messages arrive as NDJSON. While the body streams in, lines are only counted and buffered;
+each batch of MESSAGE_IMPORT_BATCH_SIZE is validated off the event loop and kept (in a
+temp file past SPOOL_MEMORY_BYTES). No transaction is open while the client uploads: once
+the whole body is in and valid, the batches are written in one transaction, so an import
+is all or nothing. Postgres gets COPY and other databases one executemany INSERT per batch.
+Imported messages are stored as already answered: they are not sent to Gemini and do not
+count against the daily quota.
+"""
+import csv
+import io
+import pickle
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..models.chatroom import Chatroom, Message
+from ..models.types import compress_text
+from ..schemas.chatroom import ImportedMessage
+from ..sharding import id_allocator, sharding_enabled
+from ..utils.metrics import MESSAGES_IMPORTED
+
+COPY_COLUMNS = (
+    "id", "chatroom_id", "content", "is_user_message", "gemini_response",
+    "processing_status", "response_source", "created_at"
+)
+
+class ImportLineError(ValueError):
+    """A line that cannot be imported; line is 1-based"""
+
+    def __init__(self, line: int, detail: str):
+        super().__init__(f"line {line}: {detail}")
+        self.line = line
+        self.detail = detail
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[bytes]:
+    """Split a streamed body into lines without holding more than one partial line"""
+    pending = b""
+    line_number = 0
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line
+        if len(pending) > max_line_bytes:
+            raise ImportLineError(line_number + 1, f"line is longer than {max_line_bytes} bytes")
+    if pending:
+        yield pending
+
+class MessageImporter:
+    """Validates buffered lines in batches, spools them, and writes them all to one chatroom"""
+
+    SPOOL_MEMORY_BYTES = 64 * 1024 * 1024  # of NDJSON; later batches are pickled to a temp file
+
+    def __init__(self, chat_db: Session, batch_size: Optional[int] = None):
+        self.chat_db = chat_db
+        self.batch_size = batch_size or settings.MESSAGE_IMPORT_BATCH_SIZE
+        self.imported = 0
+        self.latest: Optional[datetime] = None
+        self._lines: List[Tuple[int, bytes]] = []  # (line number, raw line) not validated yet
+        self._line_number = 0
+        self._messages = 0
+        self._buffered_bytes = 0
+        self._batches: List[List[tuple]] = []  # validated, kept in memory
+        self._spooled = 0  # validated batches pickled to _spool after those
+        self._spool = None
+        # Messages without a timestamp keep their file order: a microsecond apart from now
+        self._started = datetime.now(tz=timezone.utc)
+        bind = chat_db.get_bind()
+        self._copy = bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+    @property
+    def full(self) -> bool:
+        return len(self._lines) >= self.batch_size
+
+    def add_line(self, line: bytes):
+        """Buffer one NDJSON line (cheap enough for the event loop); blank lines are skipped"""
+        self._line_number += 1
+        if not line.strip():
+            return
+        if self._messages >= settings.MESSAGE_IMPORT_MAX_MESSAGES:
+            raise ImportLineError(self._line_number, f"more than {settings.MESSAGE_IMPORT_MAX_MESSAGES} messages")
+        self._messages += 1
+        self._lines.append((self._line_number, line))
+
+    def validate(self):
+        """Validate the buffered lines and spool them as one batch of rows (blocking)"""
+        if not self._lines:
+            return
+        lines, self._lines = self._lines, []
+        rows = [self._row(line_number, line) for line_number, line in lines]
+        self._buffered_bytes += sum(len(line) for _, line in lines)
+        if self._buffered_bytes <= self.SPOOL_MEMORY_BYTES:
+            self._batches.append(rows)
+            return
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile()
+        pickle.dump(rows, self._spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spooled += 1
+
+    def _row(self, line_number: int, line: bytes) -> tuple:
+        try:
+            record = ImportedMessage.model_validate_json(line)
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            raise ImportLineError(line_number, f"{location}: {error['msg']}" if location else error["msg"])
+
+        created_at = record.created_at
+        if created_at is None:
+            created_at = self._started + timedelta(microseconds=line_number)
+        elif created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        else:
+            created_at = created_at.astimezone(timezone.utc)
+        if self.latest is None or created_at > self.latest:
+            self.latest = created_at
+
+        answered = bool(record.gemini_response)
+        # A tuple, not a dict: held until the end, and the garbage collector skips these
+        return (
+            record.content,
+            record.gemini_response if answered else None,
+            "completed" if answered else "imported",
+            "import" if answered else None,
+            created_at,
+        )
+
+    def _write(self, chatroom: Chatroom, batch: List[tuple]):
+        """Insert one batch (uncommitted)"""
+        rows = [
+            {"chatroom_id": chatroom.id, "content": content, "is_user_message": True, "gemini_response": response,
+             "processing_status": status, "response_source": source, "created_at": created_at}
+            for content, response, status, source, created_at in batch
+        ]
+        if sharding_enabled():
+            # Ids for the whole batch in one Redis round trip instead of the per-row listener
+            for row, message_id in zip(rows, id_allocator.reserve(Message.__tablename__, len(rows))):
+                row["id"] = message_id
+        if self._copy:
+            self._copy_rows(rows)
+        else:
+            self.chat_db.execute(insert(Message.__table__), rows)
+        self.imported += len(rows)
+
+    def _copy_rows(self, rows: List[dict]):
+        columns = [column for column in COPY_COLUMNS if column in rows[0]]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([self._copy_value(column, row[column]) for column in columns])
+        buffer.seek(0)
+        cursor = self.chat_db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {Message.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _copy_value(column: str, value):
+        # csv writes None as an empty unquoted field, which COPY reads as NULL
+        if value is None:
+            return None
+        if column in ("content", "gemini_response"):
+            return "\\x" + compress_text(value).hex()  # CompressedText's bytes, as bytea hex
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=None).isoformat()
+        return value
+
+    def finish(self, chatroom: Chatroom) -> int:
+        """Write every spooled batch, set the chatroom counters once and commit (blocking)
+
+        Returns the number imported. Everything happens in one transaction, which is only
+        opened now that the whole body has been received and validated.
+        """
+        self.validate()
+        try:
+            batches, self._batches = self._batches, []
+            for rows in batches:
+                self._write(chatroom, rows)
+            if self._spool is not None:
+                self._spool.seek(0)
+                for _ in range(self._spooled):
+                    self._write(chatroom, pickle.load(self._spool))
+            if self.imported:
+                chatroom.message_count = (chatroom.message_count or 0) + self.imported
+                last_activity = chatroom.last_activity
+                if last_activity is not None and last_activity.tzinfo is None:
+                    last_activity = last_activity.replace(tzinfo=timezone.utc)
+                if last_activity is None or self.latest > last_activity:
+                    chatroom.last_activity = self.latest
+            self.chat_db.commit()
+        finally:
+            self.close()
+        MESSAGES_IMPORTED.inc(self.imported)
+        return self.imported
+
+    def close(self):
+        self._batches = []
+        if self._spool is not None:
+            self._spool.close()
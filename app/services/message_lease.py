@@ -0,0 +1,136 @@
+"""Leases on messages awaiting a Gemini response
+
+A message is always held by someone: the process that queued it (Pending..) or the worker
+processing it (processing), until lease_expires_at. Taking a message is one conditional
+UPDATE, so of two workers handed the same message only one calls Gemini. The sweeper takes
+over messages whose holder died (a crashed worker, or an API restart dropping its queue)
+and re-enqueues them, which makes processing at-least-once.
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..models.chatroom import Message
+
+PENDING = "Pending.."
+PROCESSING = "processing"
+messages = Message.__table__
+
+class MessageLeased(Exception):
+    """The message is still being processed under another owner's lease"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Message leased for another {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+def lease_owner() -> str:
+    """This process; computed per call because pre-fork workers change pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def claim_owner() -> str:
+    """A fresh owner for one claim: threads of one process never share a lease"""
+    return f"{lease_owner()}:{uuid.uuid4().hex}"
+
+def _now() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+def pending_lease_expiry() -> datetime:
+    return _now() + timedelta(seconds=settings.MESSAGE_PENDING_LEASE_SECONDS)
+
+def _expired(now: datetime):
+    # Rows from before leases existed have none; they count as expired once old enough
+    return or_(
+        messages.c.lease_expires_at < now,
+        and_(
+            messages.c.lease_expires_at.is_(None),
+            messages.c.created_at < now - timedelta(seconds=settings.MESSAGE_PENDING_LEASE_SECONDS)
+        )
+    )
+
+def _locked_ids(condition, limit: Optional[int] = None):
+    """Matching ids, skipping rows another transaction holds (FOR UPDATE SKIP LOCKED on Postgres)"""
+    query = select(messages.c.id).where(condition).order_by(messages.c.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.with_for_update(skip_locked=True).scalar_subquery()
+
+def claim_message(db: Session, message_id: int, owner: str) -> bool:
+    """Take a queued (or abandoned) message for processing; False if it is done or held elsewhere"""
+    now = _now()
+    claimable = and_(
+        messages.c.id == message_id,
+        or_(
+            messages.c.processing_status == PENDING,
+            and_(messages.c.processing_status == PROCESSING, _expired(now))
+        )
+    )
+    result = db.execute(
+        update(messages)
+        .where(messages.c.id.in_(_locked_ids(claimable)), claimable)
+        .values(
+            processing_status=PROCESSING,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=settings.MESSAGE_LEASE_SECONDS)
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def lease_remaining(db: Session, message_id: int) -> Optional[float]:
+    """Seconds left on a live processing lease, or None when nobody is processing the message"""
+    row = db.execute(
+        select(messages.c.processing_status, messages.c.lease_expires_at).where(messages.c.id == message_id)
+    ).first()
+    if row is None or row.processing_status != PROCESSING or row.lease_expires_at is None:
+        return None
+    expires = row.lease_expires_at
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)  # stored as naive UTC
+    remaining = (expires - _now()).total_seconds()
+    return remaining if remaining > 0 else None
+
+def finish_message(db: Session, message_id: int, owner: str, **values) -> bool:
+    """Write the outcome and release the lease, if still held; the caller commits"""
+    result = db.execute(
+        update(messages)
+        .where(messages.c.id == message_id, messages.c.lease_owner == owner)
+        .values(lease_owner=None, lease_expires_at=None, **values)
+    )
+    return result.rowcount == 1
+
+def defer_message(db: Session, message_id: int, owner: str, seconds: float) -> bool:
+    """Back to the queue, still held by owner, who will retry within seconds; commits"""
+    result = db.execute(
+        update(messages)
+        .where(messages.c.id == message_id, messages.c.lease_owner == owner)
+        .values(
+            processing_status=PENDING,
+            lease_expires_at=_now() + timedelta(seconds=seconds + settings.MESSAGE_PENDING_LEASE_SECONDS)
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def take_over_expired(db: Session, owner: str, batch_size: int) -> List[Tuple[int, int]]:
+    """One bulk UPDATE moving up to batch_size expired leases to owner, as queued; commits
+
+    Returns (message id, chatroom id) pairs in id order.
+    """
+    now = _now()
+    stuck = and_(messages.c.processing_status.in_((PENDING, PROCESSING)), _expired(now))
+    rows = db.execute(
+        update(messages)
+        .where(messages.c.id.in_(_locked_ids(stuck, batch_size)), stuck)
+        .values(
+            processing_status=PENDING,
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=settings.MESSAGE_PENDING_LEASE_SECONDS)
+        )
+        .returning(messages.c.id, messages.c.chatroom_id)
+    ).all()
+    db.commit()
+    return sorted((message_id, chatroom_id) for message_id, chatroom_id in rows)
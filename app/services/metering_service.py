@@ -0,0 +1,173 @@
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import case, delete, func, insert, literal, select, tuple_
+from sqlalchemy.orm import Session
+from ..models.usage import UsageEvent, UsageRollup
+
+USAGE_BUFFER_KEY = "usage:events"
+ROLLUP_CHUNK = 500
+
+def _naive_utc(moment: datetime) -> datetime:
+    # Buckets are naive UTC so they compare the same on every database; naive input is
+    # already UTC (astimezone would read it as the server's local time)
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _hour_start(moment: datetime) -> datetime:
+    return _naive_utc(moment).replace(minute=0, second=0, microsecond=0)
+
+def _chunks(items: list, size: int = ROLLUP_CHUNK):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+def record_usage_event(user_id: int, message_id: Optional[int], result, latency_ms: float, redis_client=None):
+    """Append one Gemini call to the Redis buffer; the flush task writes it to the database"""
+    if redis_client is None:
+        from ..clients import get_redis
+
+        redis_client = get_redis()
+    event = {
+        "event_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "message_id": message_id,
+        "model": result.model if result else None,
+        "outcome": "ok" if result else "error",
+        "prompt_tokens": result.prompt_tokens if result else 0,
+        "response_tokens": result.response_tokens if result else 0,
+        "latency_ms": result.latency_ms if result else latency_ms,
+        "occurred_at": time.time()
+    }
+    try:
+        redis_client.rpush(USAGE_BUFFER_KEY, json.dumps(event))
+    except Exception as e:
+        print(f"Usage event error: {e}")
+
+class MeteringService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def flush(self, redis_client, batch_size: int = 1000) -> int:
+        """Move one batch from the Redis buffer into usage_events and refresh touched rollups
+
+        Safe to re-run after a crash: events already inserted are skipped by event_id, and the
+        batch is only trimmed from Redis after the database commit.
+        """
+        raw_events = redis_client.lrange(USAGE_BUFFER_KEY, 0, batch_size - 1)
+        if not raw_events:
+            return 0
+        events = [json.loads(raw) for raw in raw_events]
+
+        existing = {
+            event_id for event_id, in self.db.query(UsageEvent.event_id).filter(
+                UsageEvent.event_id.in_([event["event_id"] for event in events])
+            )
+        }
+        rows = []
+        for event in events:
+            if event["event_id"] in existing:
+                continue
+            occurred_at = datetime.fromtimestamp(event.pop("occurred_at"), tz=timezone.utc)
+            event["occurred_at"] = occurred_at.replace(tzinfo=None)
+            event["hour_start"] = _hour_start(occurred_at)
+            rows.append(event)
+        if rows:
+            self.db.execute(insert(UsageEvent), rows)
+            self.refresh_rollups({(row["user_id"], row["hour_start"]) for row in rows})
+        self.db.commit()
+        redis_client.ltrim(USAGE_BUFFER_KEY, len(raw_events), -1)
+        return len(rows)
+
+    def refresh_rollups(self, hour_keys: Set[Tuple[int, datetime]]):
+        """Recompute the given (user_id, hour) buckets and their days from the events
+
+        Buckets are rebuilt from source rows (delete + insert-select) rather than incremented,
+        so running this twice, or over a range that was already rolled up, changes nothing.
+        """
+        hour_keys = sorted(hour_keys)
+        for chunk in _chunks(hour_keys):
+            self.db.execute(delete(UsageRollup).where(
+                UsageRollup.granularity == 'hour',
+                tuple_(UsageRollup.user_id, UsageRollup.bucket_start).in_(chunk)
+            ))
+            self.db.execute(insert(UsageRollup).from_select(
+                self._rollup_columns(),
+                select(
+                    UsageEvent.user_id,
+                    literal('hour'),
+                    UsageEvent.hour_start,
+                    func.count(),
+                    func.sum(case((UsageEvent.outcome != 'ok', 1), else_=0)),
+                    func.coalesce(func.sum(UsageEvent.prompt_tokens), 0),
+                    func.coalesce(func.sum(UsageEvent.response_tokens), 0),
+                    func.coalesce(func.sum(UsageEvent.latency_ms), 0.0)
+                ).where(
+                    tuple_(UsageEvent.user_id, UsageEvent.hour_start).in_(chunk)
+                ).group_by(UsageEvent.user_id, UsageEvent.hour_start)
+            ))
+
+        # Days are summed from the (just refreshed) hourly rollups, not from raw events
+        day_keys = sorted({(user_id, hour.replace(hour=0)) for user_id, hour in hour_keys})
+        for chunk in _chunks(day_keys):
+            self.db.execute(delete(UsageRollup).where(
+                UsageRollup.granularity == 'day',
+                tuple_(UsageRollup.user_id, UsageRollup.bucket_start).in_(chunk)
+            ))
+            hourly = UsageRollup.__table__.alias('hourly')
+            for user_id, day in chunk:
+                self.db.execute(insert(UsageRollup).from_select(
+                    self._rollup_columns(),
+                    select(
+                        hourly.c.user_id,
+                        literal('day'),
+                        literal(day, UsageRollup.bucket_start.type),
+                        func.sum(hourly.c.requests),
+                        func.sum(hourly.c.errors),
+                        func.sum(hourly.c.prompt_tokens),
+                        func.sum(hourly.c.response_tokens),
+                        func.sum(hourly.c.latency_ms_total)
+                    ).where(
+                        hourly.c.user_id == user_id,
+                        hourly.c.granularity == 'hour',
+                        hourly.c.bucket_start >= day,
+                        hourly.c.bucket_start < day + timedelta(days=1)
+                    ).group_by(hourly.c.user_id)
+                ))
+
+    @staticmethod
+    def _rollup_columns() -> List[str]:
+        return ['user_id', 'granularity', 'bucket_start', 'requests', 'errors',
+                'prompt_tokens', 'response_tokens', 'latency_ms_total']
+
+    def backfill(self, since: datetime, until: Optional[datetime] = None, user_id: Optional[int] = None,
+                 on_progress: Optional[Callable[[], None]] = None) -> int:
+        """Rebuild rollups for every bucket with events in [since, until); returns buckets refreshed
+
+        Naive datetimes are taken as UTC. Commits every ROLLUP_CHUNK buckets and then runs
+        on_progress, e.g. to renew the caller's lock.
+        """
+        query = self.db.query(UsageEvent.user_id, UsageEvent.hour_start).filter(
+            UsageEvent.hour_start >= _hour_start(since)
+        )
+        if until is not None:
+            query = query.filter(UsageEvent.hour_start < _naive_utc(until))
+        if user_id is not None:
+            query = query.filter(UsageEvent.user_id == user_id)
+        hour_keys = sorted(tuple(row) for row in query.distinct())
+        for chunk in _chunks(hour_keys):
+            self.refresh_rollups(set(chunk))
+            self.db.commit()
+            if on_progress:
+                on_progress()
+        return len(hour_keys)
+
+    def usage_series(self, user_id: int, granularity: str, since: datetime) -> Iterable[UsageRollup]:
+        """One range scan on the rollup primary key"""
+        return self.db.query(UsageRollup).filter(
+            UsageRollup.user_id == user_id,
+            UsageRollup.granularity == granularity,
+            UsageRollup.bucket_start >= since
+        ).order_by(UsageRollup.bucket_start).all()
@@ -0,0 +1,154 @@
+"""Semantic response cache: answer paraphrases of recent prompts without calling Gemini
+
+Prompts are embedded locally and kept in a fixed-size in-process NumPy index; a new
+prompt whose cosine similarity to a cached one reaches SEMANTIC_CACHE_THRESHOLD gets the
+cached answer. The index lives in each process that runs Gemini work and is not shared.
+
+Entries are private to each user unless SEMANTIC_CACHE_SCOPE is 'global', in which case one
+user's answer (and whatever their prompt disclosed) can be served to any other user.
+"""
+import importlib
+import re
+import threading
+import zlib
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+from ..config import settings
+from ..utils.metrics import SEMANTIC_CACHE_ENTRIES, SEMANTIC_CACHE_LOOKUPS
+
+_WORD = re.compile(r"\w+")
+
+class HashingEmbedder:
+    """Deterministic bag-of-features embedding; no model, no network
+
+    Words, word bigrams and in-word character trigrams are hashed (crc32, stable across
+    processes) into dim signed buckets and L2-normalized, so cosine similarity is a dot
+    product. It cannot tell "is it safe" from "is it not safe" by similarity alone, so
+    exact_match makes the cache also require the same words in the same order (case and
+    punctuation aside).
+    """
+    exact_match = True
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(_WORD.findall(text.lower()))
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        features = list(words)
+        features += [f"{first} {second}" for first, second in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [padded[index:index + 3] for index in range(len(padded) - 2)]
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode())
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+class VectorIndex:
+    """Fixed-capacity matrix of unit vectors with batched cosine search and LRU eviction"""
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.scopes = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.values: List[Optional[str]] = [None] * capacity
+        self.size = 0
+        self._tick = 0
+
+    def search(self, queries: np.ndarray, scope: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best (slot, similarity) per query row among entries of the scope; slot -1 if none"""
+        if not self.size:
+            return np.full(len(queries), -1), np.zeros(len(queries), dtype=np.float32)
+        scores = queries @ self.vectors[:self.size].T  # (queries, entries), one matrix product
+        scores[:, self.scopes[:self.size] != scope] = -np.inf
+        slots = scores.argmax(axis=1)
+        best = scores[np.arange(len(queries)), slots]
+        slots = np.where(np.isfinite(best), slots, -1)
+        return slots, np.where(np.isfinite(best), best, 0.0)
+
+    def touch(self, slot: int):
+        self._tick += 1
+        self.last_used[slot] = self._tick
+
+    def put(self, vector: np.ndarray, scope: int, value: str, slot: Optional[int] = None) -> int:
+        """Store at slot (overwrite), the next free slot, or the least recently used one"""
+        if slot is None:
+            if self.size < len(self.values):
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(self.last_used.argmin())
+        self.vectors[slot] = vector
+        self.scopes[slot] = scope
+        self.values[slot] = value
+        self.touch(slot)
+        return slot
+
+def load_embedder(path: Optional[str]):
+    """SEMANTIC_CACHE_EMBEDDER is "module:factory", returning an object with dim and embed()"""
+    if not path:
+        return HashingEmbedder()
+    module_name, _, attribute = path.partition(":")
+    factory: Callable = getattr(importlib.import_module(module_name), attribute)
+    return factory()
+
+class SemanticCache:
+    # Above this similarity a new answer replaces the cached one instead of adding a near-duplicate
+    DUPLICATE_SIMILARITY = 0.99
+
+    def __init__(self, embedder, capacity: int, threshold: float):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.index = VectorIndex(embedder.dim, capacity)
+        # Normalized prompt per slot, for embedders that only allow exact matches
+        self.exact_match = getattr(embedder, "exact_match", False)
+        self.keys: List[Optional[str]] = [None] * capacity
+        self._lock = threading.Lock()
+
+    def _key(self, prompt: str) -> Optional[str]:
+        return self.embedder.normalize(prompt) if self.exact_match else None
+
+    @staticmethod
+    def scope_for(user_id: int) -> int:
+        """Index partition for a user's prompts: shared by everyone, or private per user"""
+        return user_id if settings.SEMANTIC_CACHE_SCOPE == "user" else 0
+
+    def lookup(self, prompt: str, scope: int = 0) -> Optional[Tuple[str, float]]:
+        """(cached answer, similarity) for a close enough earlier prompt, else None"""
+        return self.lookup_many([prompt], scope)[0]
+
+    def lookup_many(self, prompts: Sequence[str], scope: int = 0) -> List[Optional[Tuple[str, float]]]:
+        queries = self.embedder.embed(prompts)
+        with self._lock:
+            slots, similarities = self.index.search(queries, scope)
+            results = []
+            for prompt, slot, similarity in zip(prompts, slots, similarities):
+                if slot < 0 or similarity < self.threshold or self.keys[slot] != self._key(prompt):
+                    results.append(None)
+                    continue
+                self.index.touch(int(slot))
+                results.append((self.index.values[slot], round(float(similarity), 4)))
+        for result in results:
+            SEMANTIC_CACHE_LOOKUPS.labels("hit" if result else "miss").inc()
+        return results
+
+    def store(self, prompt: str, answer: str, scope: int = 0):
+        vector = self.embedder.embed([prompt])
+        key = self._key(prompt)
+        with self._lock:
+            slots, similarities = self.index.search(vector, scope)
+            duplicate = slots[0] >= 0 and similarities[0] >= self.DUPLICATE_SIMILARITY and self.keys[slots[0]] == key
+            slot = self.index.put(vector[0], scope, answer, int(slots[0]) if duplicate else None)
+            self.keys[slot] = key
+            SEMANTIC_CACHE_ENTRIES.set(self.index.size)
@@ -0,0 +1,217 @@
+import json
+import time
+import uuid
+from typing import List, Optional, Tuple
+from ..config import settings
+
+SMS_QUEUE_KEY = "sms:outbound"
+SMS_RETRY_KEY = "sms:retry"
+SMS_DEAD_LETTER_KEY = "sms:dead"
+SMS_PROCESSING_PREFIX = "sms:processing:"
+SMS_HEARTBEAT_PREFIX = "sms:worker:"
+SMS_WORKERS_KEY = "sms:workers"
+
+# Move retries whose due time has passed back onto the outbound list
+PROMOTE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, payload in ipairs(due) do
+    redis.call('ZREM', KEYS[1], payload)
+    redis.call('LPUSH', KEYS[2], payload)
+end
+return #due
+"""
+
+# Move up to ARGV[1] more messages from the outbound list to a worker's processing list
+MOVE_BATCH_SCRIPT = """
+local moved = {}
+for _ = 1, tonumber(ARGV[1]) do
+    local payload = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+    if not payload then
+        break
+    end
+    moved[#moved + 1] = payload
+end
+return moved
+"""
+
+# Put everything a worker was holding back at the sending end of the outbound list, oldest first
+REQUEUE_SCRIPT = """
+local moved = 0
+while redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT') do
+    moved = moved + 1
+end
+return moved
+"""
+
+class SMSProvider:
+    """Interface for outbound SMS providers"""
+
+    def send_batch(self, messages: List[dict]) -> List[bool]:
+        """Send a batch of messages, returning a success flag per message"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any pooled connections"""
+        pass
+
+class ConsoleSMSProvider(SMSProvider):
+    """Development provider that prints messages to stdout"""
+
+    def send_batch(self, messages: List[dict]) -> List[bool]:
+        for message in messages:
+            print(f"Sending SMS to {message['to']}: {message['body']}")
+        return [True] * len(messages)
+
+class FakeSMSProvider(SMSProvider):
+    """In-memory provider for tests, optionally mirroring to an NDJSON outbox file"""
+
+    def __init__(self, outbox_path: Optional[str] = None, fail_numbers: Optional[set] = None):
+        self.outbox_path = outbox_path
+        self.fail_numbers = fail_numbers or set()
+        self.sent: List[dict] = []
+
+    def send_batch(self, messages: List[dict]) -> List[bool]:
+        results = []
+        delivered = []
+        for message in messages:
+            ok = message["to"] not in self.fail_numbers
+            results.append(ok)
+            if ok:
+                delivered.append(message)
+        self.sent.extend(delivered)
+        if self.outbox_path and delivered:
+            with open(self.outbox_path, "a") as outbox:
+                for message in delivered:
+                    outbox.write(json.dumps(message) + "\n")
+        return results
+
+class TwilioSMSProvider(SMSProvider):
+    """Twilio REST provider sharing one keep-alive HTTP client across batches"""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, timeout: float = 5.0):
+        import httpx
+
+        self.from_number = from_number
+        self.url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.client = httpx.Client(
+            auth=(account_sid, auth_token),
+            timeout=timeout,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+        )
+
+    def send_batch(self, messages: List[dict]) -> List[bool]:
+        results = []
+        for message in messages:
+            try:
+                response = self.client.post(self.url, data={
+                    "To": message["to"],
+                    "From": self.from_number,
+                    "Body": message["body"]
+                })
+                results.append(response.status_code < 400)
+            except Exception as e:
+                print(f"Twilio send error: {e}")
+                results.append(False)
+        return results
+
+    def close(self):
+        self.client.close()
+
+def get_sms_provider() -> SMSProvider:
+    """Build the provider selected by SMS_PROVIDER"""
+    if settings.SMS_PROVIDER == "twilio":
+        return TwilioSMSProvider(
+            settings.TWILIO_ACCOUNT_SID,
+            settings.TWILIO_AUTH_TOKEN,
+            settings.TWILIO_FROM_NUMBER
+        )
+    if settings.SMS_PROVIDER == "fake":
+        return FakeSMSProvider(settings.SMS_FAKE_OUTBOX_PATH)
+    return ConsoleSMSProvider()
+
+class SMSQueue:
+    """Redis-backed outbound SMS queue with delayed retries
+
+    A worker moves the messages it takes into its own processing list and removes each one
+    only once it is sent, parked for a retry or dead-lettered, so a crash mid-batch loses
+    nothing: once the worker's heartbeat lapses, recover_orphans puts its messages back.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._promote_due = redis_client.register_script(PROMOTE_DUE_SCRIPT)
+        self._move_batch = redis_client.register_script(MOVE_BATCH_SCRIPT)
+        self._requeue = redis_client.register_script(REQUEUE_SCRIPT)
+
+    def enqueue(self, to: str, body: str, expires_at: Optional[float] = None) -> str:
+        """Queue a message for delivery and return its id; it is not sent after expires_at"""
+        message_id = uuid.uuid4().hex
+        payload = {"id": message_id, "to": to, "body": body, "attempts": 0, "expires_at": expires_at}
+        self.redis_client.lpush(SMS_QUEUE_KEY, json.dumps(payload))
+        return message_id
+
+    def pop_batch(self, worker_id: str, max_size: int, timeout: int = 1) -> List[Tuple[bytes, dict]]:
+        """Block for the first message, then take up to max_size without waiting
+
+        Returns (payload, message) pairs; hand the payload back to ack, schedule_retry or
+        dead_letter to drop the message from the worker's processing list.
+        """
+        processing_key = f"{SMS_PROCESSING_PREFIX}{worker_id}"
+        first = self.redis_client.blmove(SMS_QUEUE_KEY, processing_key, timeout, "RIGHT", "LEFT")
+        if not first:
+            return []
+        payloads = [first]
+        if max_size > 1:
+            payloads.extend(self._move_batch(keys=[SMS_QUEUE_KEY, processing_key], args=[max_size - 1]))
+        return [(payload, json.loads(payload)) for payload in payloads]
+
+    def _settle(self, worker_id: str, payload: bytes):
+        """Pipeline dropping payload from the worker's processing list; the caller adds to it"""
+        pipe = self.redis_client.pipeline()
+        pipe.lrem(f"{SMS_PROCESSING_PREFIX}{worker_id}", 1, payload)
+        return pipe
+
+    def ack(self, worker_id: str, payload: bytes):
+        """Done with a sent message"""
+        self._settle(worker_id, payload).execute()
+
+    def schedule_retry(self, worker_id: str, payload: bytes, message: dict, delay_seconds: float):
+        """Park a message in the retry set until its backoff expires"""
+        pipe = self._settle(worker_id, payload)
+        pipe.zadd(SMS_RETRY_KEY, {json.dumps(message): time.time() + delay_seconds})
+        pipe.execute()
+
+    def dead_letter(self, worker_id: str, payload: bytes, message: dict):
+        """Keep undeliverable messages for inspection"""
+        pipe = self._settle(worker_id, payload)
+        pipe.lpush(SMS_DEAD_LETTER_KEY, json.dumps(message))
+        pipe.execute()
+
+    def promote_due_retries(self, limit: int = 500) -> int:
+        """Move due retries back onto the outbound queue"""
+        return self._promote_due(keys=[SMS_RETRY_KEY, SMS_QUEUE_KEY], args=[time.time(), limit])
+
+    def heartbeat(self, worker_id: str, ttl_seconds: int):
+        """Mark worker_id alive for ttl_seconds"""
+        pipe = self.redis_client.pipeline()
+        pipe.sadd(SMS_WORKERS_KEY, worker_id)
+        pipe.set(f"{SMS_HEARTBEAT_PREFIX}{worker_id}", 1, ex=ttl_seconds)
+        pipe.execute()
+
+    def leave(self, worker_id: str) -> int:
+        """Hand back anything still held and stop being tracked; returns the messages requeued"""
+        requeued = self._requeue(keys=[f"{SMS_PROCESSING_PREFIX}{worker_id}", SMS_QUEUE_KEY])
+        pipe = self.redis_client.pipeline()
+        pipe.delete(f"{SMS_HEARTBEAT_PREFIX}{worker_id}")
+        pipe.srem(SMS_WORKERS_KEY, worker_id)
+        pipe.execute()
+        return requeued
+
+    def recover_orphans(self) -> int:
+        """Requeue the messages of workers whose heartbeat lapsed; returns how many"""
+        recovered = 0
+        for worker_id in self.redis_client.smembers(SMS_WORKERS_KEY):
+            worker_id = worker_id.decode() if isinstance(worker_id, bytes) else worker_id
+            if not self.redis_client.exists(f"{SMS_HEARTBEAT_PREFIX}{worker_id}"):
+                recovered += self.leave(worker_id)
+        return recovered
@@ -1,50 +1,91 @@
-import stripe
-from typing import Optional
+from typing import Iterator
 from ..config import settings
 from ..models.user import SubscriptionTier
+from ..utils.circuit_breaker import CircuitBreaker
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+_stripe_client = None
+_stripe_http_client = None
+stripe_breaker = CircuitBreaker("stripe", failure_threshold=5, reset_timeout=30.0)
+
+def get_stripe_client():
+    """Shared Stripe client with a pooled HTTP session and bounded timeouts"""
+    global _stripe_client, _stripe_http_client
+    if _stripe_client is None:
+        import stripe
+
+        _stripe_http_client = stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT_SECONDS)
+        base_addresses = {"api": settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+        _stripe_client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            http_client=_stripe_http_client,
+            max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+            base_addresses=base_addresses
+        )
+    return _stripe_client
+
+def close_stripe_client():
+    global _stripe_client, _stripe_http_client
+    if _stripe_http_client is not None:
+        _stripe_http_client.close()
+    _stripe_client = None
+    _stripe_http_client = None
 
 class StripeService:
     def __init__(self):
+        self.client = get_stripe_client()
         self.price_mapping = {
-            SubscriptionTier.PRO: "price_1234567890"
+            SubscriptionTier.PRO: settings.STRIPE_PRO_PRICE_ID
         }
-    
+
     def create_checkout_session(self, user_id: int, tier: SubscriptionTier, success_url: str, cancel_url: str):
         """Create Stripe checkout session"""
+        metadata = {
+            'user_id': user_id,
+            'tier': tier.value
+        }
         try:
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price': self.price_mapping[tier],
-                    'quantity': 1,
-                }],
-                mode='subscription',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata={
-                    'user_id': user_id,
-                    'tier': tier.value
+            return stripe_breaker.call(
+                self.client.checkout.sessions.create,
+                params={
+                    'payment_method_types': ['card'],
+                    'line_items': [{
+                        'price': self.price_mapping[tier],
+                        'quantity': 1,
+                    }],
+                    'mode': 'subscription',
+                    'success_url': success_url,
+                    'cancel_url': cancel_url,
+                    'metadata': metadata,
+                    # Copied onto the subscription so reconciliation can map it back to the user
+                    'subscription_data': {'metadata': metadata}
                 }
             )
-            return session
         except Exception as e:
             print(f"Stripe checkout error: {e}")
             return None
-    
+
     def get_subscription(self, subscription_id: str):
         """Get subscription details from Stripe"""
         try:
-            return stripe.Subscription.retrieve(subscription_id)
+            return stripe_breaker.call(self.client.subscriptions.retrieve, subscription_id)
         except Exception as e:
             print(f"Stripe subscription error: {e}")
             return None
-    
+
     def cancel_subscription(self, subscription_id: str):
-        """Cancel subscription"""
-        try:
-            return stripe.Subscription.delete(subscription_id)
-        except Exception as e:
-            print(f"Stripe cancel error: {e}")
-            return None
\ No newline at end of file
+        """Cancel subscription, raising on failure so callers can retry"""
+        return stripe_breaker.call(self.client.subscriptions.cancel, subscription_id)
+
+    def iter_subscriptions(self, page_size: int = 100) -> Iterator[dict]:
+        """Page through every subscription on the account, as plain dicts like webhook payloads"""
+        starting_after = None
+        while True:
+            params = {'limit': page_size, 'status': 'all'}
+            if starting_after:
+                params['starting_after'] = starting_after
+            page = stripe_breaker.call(self.client.subscriptions.list, params=params)
+            for subscription in page.data:
+                yield subscription.to_dict()
+            if not page.has_more or not page.data:
+                return
+            starting_after = page.data[-1].id
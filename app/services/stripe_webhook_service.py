@@ -0,0 +1,137 @@
+import json
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from ..models.stripe_event import StripeEvent
+from ..models.subscription import Subscription
+from ..models.user import User, SubscriptionTier, SubscriptionStatus
+from .subscription_service import SubscriptionService
+from ..config import settings
+
+def get_ordering_key(event: dict) -> str:
+    """Events for the same Stripe subscription are applied in order; others stand alone"""
+    obj = event['data']['object']
+    if event['type'].startswith('customer.subscription.'):
+        return obj['id']
+    return obj.get('subscription') or event['id']
+
+class StripeWebhookService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record_event(self, payload: bytes, sig_header: Optional[str]) -> Tuple[StripeEvent, bool]:
+        """Verify and persist a raw webhook event; returns (event, newly_recorded)"""
+        import stripe
+
+        event = stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+
+        ledger_entry = StripeEvent(
+            id=event['id'],
+            type=event['type'],
+            ordering_key=get_ordering_key(event),
+            stripe_created=event['created'],
+            payload=payload.decode('utf-8')
+        )
+        self.db.add(ledger_entry)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # Stripe retry of an event we already hold
+            self.db.rollback()
+            return self.db.get(StripeEvent, event['id']), False
+        return ledger_entry, True
+
+    def process_pending(self, ordering_key: str, on_progress: Optional[Callable[[], None]] = None) -> int:
+        """Apply pending events for one ordering key, oldest first, stopping at the first failure
+
+        An event that has failed STRIPE_EVENT_MAX_ATTEMPTS times is dead-lettered (status
+        'dead', kept for inspection) so the events behind it are not blocked forever.
+        on_progress runs after each event, e.g. to renew the caller's lock.
+        """
+        processed = 0
+        while True:
+            ledger_entry = self.db.query(StripeEvent).filter(
+                StripeEvent.ordering_key == ordering_key,
+                StripeEvent.status.in_(('pending', 'failed'))
+            ).order_by(StripeEvent.stripe_created, StripeEvent.received_at).first()
+            if not ledger_entry:
+                return processed
+
+            attempts = (ledger_entry.attempts or 0) + 1
+            ledger_entry.attempts = attempts
+            try:
+                self.apply_event(json.loads(ledger_entry.payload))
+            except Exception as e:
+                self.db.rollback()
+                ledger_entry.attempts = attempts  # the rollback discarded the bump
+                ledger_entry.last_error = str(e)
+                if attempts < settings.STRIPE_EVENT_MAX_ATTEMPTS:
+                    ledger_entry.status = 'failed'
+                    self.db.commit()
+                    raise
+                print(f"Stripe event {ledger_entry.id} dead-lettered after {attempts} attempts: {e}")
+                ledger_entry.status = 'dead'
+            else:
+                ledger_entry.status = 'processed'
+                ledger_entry.last_error = None
+                ledger_entry.processed_at = datetime.now(tz=timezone.utc)
+                processed += 1
+            self.db.commit()
+            if on_progress:
+                on_progress()
+
+    def apply_event(self, event: dict):
+        """Dispatch a Stripe event to its idempotent handler"""
+        obj = event['data']['object']
+        if event['type'] == 'checkout.session.completed':
+            self.handle_successful_payment(obj)
+        elif event['type'] == 'invoice.payment_succeeded':
+            self.handle_successful_payment_renewal(obj)
+        elif event['type'] in (
+            'customer.subscription.created',
+            'customer.subscription.updated',
+            'customer.subscription.deleted'
+        ):
+            SubscriptionService(self.db).apply_stripe_subscription(obj)
+
+    def handle_successful_payment(self, session: dict):
+        """Upsert the subscription created by a completed checkout"""
+        user_id = int(session['metadata']['user_id'])
+        tier = SubscriptionTier(session['metadata']['tier'])
+
+        user = self.db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return
+
+        subscription = self.db.query(Subscription).filter(
+            Subscription.stripe_subscription_id == session['subscription']
+        ).first()
+        if not subscription:
+            subscription = Subscription(
+                user_id=user_id,
+                stripe_subscription_id=session['subscription'],
+                status=SubscriptionStatus.ACTIVE.value,
+                tier=tier.value,
+                # Until the subscription events bring the real period, order it by the checkout
+                current_period_start=(
+                    datetime.fromtimestamp(session['created'], tz=timezone.utc) if session.get('created') else None
+                )
+            )
+            self.db.add(subscription)
+        # An existing row already has its state from the customer.subscription.* events
+
+        SubscriptionService(self.db).sync_user_entitlement(user)
+
+    def handle_successful_payment_renewal(self, invoice: dict):
+        """Mark the subscription active after a renewal payment"""
+        subscription = self.db.query(Subscription).filter(
+            Subscription.stripe_subscription_id == invoice['subscription']
+        ).first()
+        if not subscription:
+            return
+
+        # A late invoice never revives a subscription that has since been canceled
+        if subscription.status != SubscriptionStatus.CANCELLED.value:
+            subscription.status = SubscriptionStatus.ACTIVE.value
+        SubscriptionService(self.db).sync_user_entitlement(subscription.user)
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy.orm import Session
+from ..models.subscription import Subscription
+from ..models.user import User, SubscriptionTier, SubscriptionStatus
+
+# Stripe subscription statuses mapped onto our local entitlement states
+STRIPE_STATUS_MAPPING = {
+    'active': SubscriptionStatus.ACTIVE,
+    'trialing': SubscriptionStatus.ACTIVE,
+    'past_due': SubscriptionStatus.ACTIVE,  # Stripe is still retrying payment
+    'canceled': SubscriptionStatus.CANCELLED,
+    'unpaid': SubscriptionStatus.CANCELLED,
+    'incomplete_expired': SubscriptionStatus.CANCELLED,
+}
+
+def get_effective_tier(user: User) -> SubscriptionTier:
+    """Entitlement answered from the locally materialized user row, never from Stripe"""
+    if user.subscription_status == SubscriptionStatus.ACTIVE:
+        return user.subscription_tier
+    return SubscriptionTier.BASIC
+
+def _from_timestamp(value) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value else None
+
+class SubscriptionService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def sync_user_entitlement(self, user: User):
+        """Copy the user's current subscription onto the user row used for entitlement checks
+
+        The current subscription is the most recent active one, or failing that the most
+        recent one. Applying an older, canceled subscription (reconciliation lists them
+        all, and webhooks arrive late) therefore never downgrades a user who has an
+        active one.
+        """
+        self.db.flush()
+        subscriptions = self.db.query(Subscription).filter(Subscription.user_id == user.id).order_by(
+            Subscription.current_period_start.desc().nulls_last(),
+            Subscription.created_at.desc(),
+            Subscription.id.desc()
+        ).all()
+        active = [s for s in subscriptions if s.status == SubscriptionStatus.ACTIVE.value]
+        current = (active or subscriptions or [None])[0]
+        if current is None:
+            return
+        user.subscription_status = SubscriptionStatus(current.status)
+        user.subscription_tier = (
+            SubscriptionTier(current.tier) if user.subscription_status == SubscriptionStatus.ACTIVE
+            else SubscriptionTier.BASIC
+        )
+
+    def cancel(self, subscription: Subscription):
+        """Cancel locally right away and record that Stripe still has to be told"""
+        subscription.status = SubscriptionStatus.CANCELLED.value
+        if subscription.stripe_subscription_id:
+            subscription.cancel_requested_at = datetime.now(tz=timezone.utc)
+        user = self.db.query(User).filter(User.id == subscription.user_id).first()
+        if user:
+            self.sync_user_entitlement(user)
+
+    def apply_stripe_subscription(self, stripe_subscription) -> Optional[Subscription]:
+        """Idempotently upsert local state from a Stripe subscription object"""
+        subscription = self.db.query(Subscription).filter(
+            Subscription.stripe_subscription_id == stripe_subscription['id']
+        ).first()
+
+        metadata = stripe_subscription.get('metadata') or {}
+        if not subscription:
+            if 'user_id' not in metadata:
+                return None
+            subscription = Subscription(
+                user_id=int(metadata['user_id']),
+                stripe_subscription_id=stripe_subscription['id']
+            )
+            self.db.add(subscription)
+
+        status = STRIPE_STATUS_MAPPING.get(stripe_subscription['status'], SubscriptionStatus.INACTIVE)
+        if subscription.cancel_requested_at is not None:
+            if status == SubscriptionStatus.ACTIVE:
+                # Cancelled here but Stripe has not caught up yet: stay cancelled locally
+                # and leave the pending cancel for cancel_stripe_subscription to finish
+                status = SubscriptionStatus.CANCELLED
+            else:
+                subscription.cancel_requested_at = None
+        tier = SubscriptionTier(metadata.get('tier') or subscription.tier or SubscriptionTier.BASIC.value)
+
+        subscription.status = status.value
+        subscription.tier = tier.value
+        subscription.current_period_start = _from_timestamp(stripe_subscription.get('current_period_start'))
+        subscription.current_period_end = _from_timestamp(stripe_subscription.get('current_period_end'))
+
+        user = self.db.query(User).filter(User.id == subscription.user_id).first()
+        if user:
+            self.sync_user_entitlement(user)
+        return subscription
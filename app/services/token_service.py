@@ -0,0 +1,229 @@
+"""Refresh-token rotation and token revocation
+
+Every refresh token belongs to a family started at login; Redis holds the family's one
+current jti, and presenting any older one is treated as theft and revokes the family.
+
+Revocation is checked on every authenticated request, so the answer normally comes from
+process memory: per-user token versions (bumped by password reset or logout everywhere)
+and a bloom filter of revoked jtis/families, kept in sync across processes via pub/sub.
+Only a bloom hit, or a process that has not synced yet, asks Redis.
+"""
+import json
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+from fastapi import HTTPException, status
+from ..config import settings
+from ..utils.bloom_filter import BloomFilter
+from ..utils.jwt_utils import REFRESH_TOKEN_LIFETIME, create_access_token, create_refresh_token
+from ..utils.metrics import TOKEN_REFRESH_REUSE, TOKEN_REVOCATION_CHECKS
+
+REVOKED_IDS_KEY = "auth:revoked"  # sorted set of revoked ids scored by expiry, for rebuilding filters
+TOKEN_VERSIONS_KEY = "auth:token_versions"  # user_id -> minimum valid token version
+REVOCATION_CHANNEL = "auth:revocations"
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+class RevocationStore:
+    """Process-local view of revoked tokens, backed by Redis and updated through pub/sub"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._bloom = BloomFilter(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
+        self._versions: Dict[int, int] = {}
+        self._synced = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, name="token-revocations", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                # Subscribe first, then snapshot, so nothing published in between is missed
+                self._load_snapshot()
+                rebuild_at = time.monotonic() + settings.REVOCATION_REBUILD_SECONDS
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._apply(json.loads(message["data"]))
+                    if time.monotonic() >= rebuild_at:
+                        self._load_snapshot()
+                        rebuild_at = time.monotonic() + settings.REVOCATION_REBUILD_SECONDS
+            except Exception as e:
+                # Messages may have been missed; check Redis directly until resynced
+                self._synced.clear()
+                print(f"Token revocation sync error: {e}")
+                self._stopping.wait(1.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _load_snapshot(self):
+        now = time.time()
+        self.redis.zremrangebyscore(REVOKED_IDS_KEY, "-inf", now)
+        revoked_ids = self.redis.zrangebyscore(REVOKED_IDS_KEY, now, "+inf")
+        bloom = BloomFilter(
+            max(settings.REVOCATION_BLOOM_CAPACITY, 2 * len(revoked_ids)),
+            settings.REVOCATION_BLOOM_ERROR_RATE
+        )
+        for token_id in revoked_ids:
+            bloom.add(_text(token_id))
+        versions = {int(user_id): int(version) for user_id, version in self.redis.hgetall(TOKEN_VERSIONS_KEY).items()}
+        self._bloom = bloom
+        self._versions = versions
+        self._synced.set()
+
+    def _apply(self, event: dict):
+        if "revoked" in event:
+            self._bloom.add(event["revoked"])
+        if "user_id" in event:
+            user_id = int(event["user_id"])
+            self._versions[user_id] = max(self._versions.get(user_id, 0), int(event["version"]))
+
+    def stored_version(self, user_id: int) -> int:
+        """The version in Redis, which a bump in another process may not have synced here yet"""
+        return int(self.redis.hget(TOKEN_VERSIONS_KEY, user_id) or 0)
+
+    def is_revoked(self, payload: dict) -> bool:
+        token_ids = [token_id for token_id in (payload.get("jti"), payload.get("fam")) if token_id]
+        if not self._synced.is_set():
+            TOKEN_REVOCATION_CHECKS.labels("unsynced").inc()
+            return self._is_revoked_in_redis(payload, token_ids)
+
+        if payload.get("ver", 0) < self._versions.get(payload.get("user_id"), 0):
+            TOKEN_REVOCATION_CHECKS.labels("revoked").inc()
+            return True
+        suspects = [token_id for token_id in token_ids if token_id in self._bloom]
+        if not suspects:
+            TOKEN_REVOCATION_CHECKS.labels("clear").inc()
+            return False
+        try:
+            revoked = bool(self.redis.exists(*(f"{REVOKED_IDS_KEY}:{token_id}" for token_id in suspects)))
+        except Exception as e:
+            print(f"Token revocation check error: {e}")
+            revoked = True  # a bloom hit we cannot confirm is more likely revoked than not
+        TOKEN_REVOCATION_CHECKS.labels("revoked" if revoked else "false_positive").inc()
+        return revoked
+
+    def _is_revoked_in_redis(self, payload: dict, token_ids) -> bool:
+        try:
+            if payload.get("ver", 0) < int(self.redis.hget(TOKEN_VERSIONS_KEY, payload.get("user_id")) or 0):
+                return True
+            return bool(token_ids) and bool(self.redis.exists(*(f"{REVOKED_IDS_KEY}:{token_id}" for token_id in token_ids)))
+        except Exception as e:
+            # Only reached before the first sync; a Redis outage should not log everyone out
+            print(f"Token revocation check error: {e}")
+            return False
+
+    def revoke(self, token_id: str, expires_at: float):
+        """Revoke a jti or a whole refresh family until expires_at (epoch seconds)"""
+        ttl = max(1, int(expires_at - time.time()) + 1)
+        pipe = self.redis.pipeline()
+        pipe.zadd(REVOKED_IDS_KEY, {token_id: expires_at})
+        pipe.set(f"{REVOKED_IDS_KEY}:{token_id}", 1, ex=ttl)
+        pipe.publish(REVOCATION_CHANNEL, json.dumps({"revoked": token_id}))
+        pipe.execute()
+        self._apply({"revoked": token_id})
+
+    def bump_version(self, user_id: int) -> int:
+        """Invalidate every token issued to the user so far"""
+        version = self.redis.hincrby(TOKEN_VERSIONS_KEY, user_id, 1)
+        event = {"user_id": user_id, "version": version}
+        self.redis.publish(REVOCATION_CHANNEL, json.dumps(event))
+        self._apply(event)
+        return version
+
+class TokenService:
+    ROTATE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if not current then
+        return -1
+    end
+    if current ~= ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+    """
+
+    def __init__(self, redis_client, revocations: RevocationStore):
+        self.redis = redis_client
+        self.revocations = revocations
+        self._rotate = None
+
+    @staticmethod
+    def _family_key(family: str) -> str:
+        return f"auth:refresh_family:{family}"
+
+    def _issue(self, user_id: int, family: str, refresh_jti: str) -> dict:
+        # From Redis, not the local copy: a token stamped with a version this process has not
+        # caught up on yet would be revoked by every process that has
+        claims = {"user_id": user_id, "ver": self.revocations.stored_version(user_id), "fam": family}
+        return {
+            "access_token": create_access_token(data=claims),
+            "refresh_token": create_refresh_token(data={**claims, "jti": refresh_jti}),
+            "token_type": "bearer",
+            "expires_in": 3600
+        }
+
+    def issue_tokens(self, user_id: int) -> dict:
+        """Start a new refresh family (one per login)"""
+        family, refresh_jti = uuid.uuid4().hex, uuid.uuid4().hex
+        self.redis.set(self._family_key(family), refresh_jti, ex=int(REFRESH_TOKEN_LIFETIME.total_seconds()))
+        return self._issue(user_id, family, refresh_jti)
+
+    def rotate(self, payload: dict) -> dict:
+        """Exchange a current refresh token for a new pair; replaying an old one kills the family"""
+        family, refresh_jti, user_id = payload.get("fam"), payload.get("jti"), payload.get("user_id")
+        if not family or not refresh_jti:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token predates rotation; please log in again"
+            )
+        if self.revocations.is_revoked(payload):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revoked")
+
+        if self._rotate is None:
+            self._rotate = self.redis.register_script(self.ROTATE_SCRIPT)
+        new_jti = uuid.uuid4().hex
+        result = self._rotate(
+            keys=[self._family_key(family)],
+            args=[refresh_jti, new_jti, int(REFRESH_TOKEN_LIFETIME.total_seconds())]
+        )
+        if result == 1:
+            return self._issue(user_id, family, new_jti)
+        if result == 0:
+            # Someone is holding a stale copy: revoke the family so neither party keeps access
+            TOKEN_REFRESH_REUSE.inc()
+            self.revocations.revoke(family, time.time() + REFRESH_TOKEN_LIFETIME.total_seconds())
+            print(f"Refresh token reuse detected for user {user_id}; family {family} revoked")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revoked")
+
+    def logout(self, payload: dict, all_devices: bool = False):
+        """Revoke the presented access token and its refresh family, or every token of the user"""
+        if payload.get("jti"):
+            self.revocations.revoke(payload["jti"], payload.get("exp", time.time() + 3600))
+        family = payload.get("fam")
+        if family:
+            self.redis.delete(self._family_key(family))
+            self.revocations.revoke(family, time.time() + REFRESH_TOKEN_LIFETIME.total_seconds())
+        if all_devices:
+            self.revocations.bump_version(payload["user_id"])
@@ -0,0 +1,204 @@
+"""Optional horizontal sharding of chat data (chatrooms, messages) by user_id
+
+Users and subscriptions stay in the primary database. When CHAT_SHARD_URLS is empty the
+chat dependencies simply hand back the primary/replica session, so nothing changes.
+"""
+import bisect
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import MetaData, event
+from sqlalchemy.orm import Session, sessionmaker
+from .config import settings
+from .database import build_engine, get_db, get_read_db, SessionLocal
+from .models.chatroom import Chatroom, Message
+from .utils.jwt_utils import get_token_user_id
+from .utils.request_batch import current_batch
+
+SHARD_DIRECTORY_KEY = "chat:shard_directory"
+MIGRATING_PREFIX = "migrating:"
+WRITERS_PREFIX = "chat:writers:"
+WRITERS_TTL_SECONDS = 300  # a crashed request's count lapses; well beyond any request's lifetime
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, nodes: List[str], vnodes: int = 64):
+        self.ring: List[Tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(vnodes)
+        )
+        self._points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def get(self, key) -> str:
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self.ring)
+        return self.ring[index][1]
+
+shard_engines = {name: build_engine(url) for name, url in settings.CHAT_SHARD_URLS.items()}
+shard_sessions = {
+    name: sessionmaker(bind=shard_engine, autocommit=False, autoflush=False)
+    for name, shard_engine in shard_engines.items()
+}
+ring = HashRing(sorted(shard_engines), settings.CHAT_SHARD_VNODES) if shard_engines else None
+
+def sharding_enabled() -> bool:
+    return ring is not None
+
+def _redis():
+    from .clients import get_redis
+
+    return get_redis()
+
+def lookup_shard(user_id: int) -> Tuple[str, Optional[str], bool]:
+    """(shard to read from, target shard if mid-migration, whether the directory pins the user)"""
+    placement = _redis().hget(SHARD_DIRECTORY_KEY, str(user_id))
+    if placement is None:
+        return ring.get(user_id), None, False
+    placement = placement.decode() if isinstance(placement, bytes) else placement
+    if placement.startswith(MIGRATING_PREFIX):
+        source, target = placement[len(MIGRATING_PREFIX):].split(":", 1)
+        return source, target, True
+    return placement, None, True
+
+def _begin_write(user_id: int):
+    pipe = _redis().pipeline()
+    pipe.incr(f"{WRITERS_PREFIX}{user_id}")
+    pipe.expire(f"{WRITERS_PREFIX}{user_id}", WRITERS_TTL_SECONDS)
+    pipe.execute()
+
+def _end_write(user_id: int):
+    _redis().decr(f"{WRITERS_PREFIX}{user_id}")
+
+def active_writers(user_id: int) -> int:
+    """Write requests that resolved the user's shard and have not finished yet"""
+    return int(_redis().get(f"{WRITERS_PREFIX}{user_id}") or 0)
+
+def pin_user(user_id: int, shard: str):
+    """Record where a user's chat data lives; later ring changes no longer move it implicitly"""
+    _redis().hsetnx(SHARD_DIRECTORY_KEY, str(user_id), shard)
+
+def open_chat_session(shard: Optional[str]) -> Session:
+    """Session for a named shard, or the primary when unsharded"""
+    if shard is None:
+        return SessionLocal()
+    session = shard_sessions[shard]()
+    session.info["shard"] = shard
+    return session
+
+def get_chat_db(request: Request, db: Session = Depends(get_db)):
+    """Chat session for write handlers; the primary session itself when unsharded"""
+    if not sharding_enabled():
+        yield db
+        return
+
+    user_id = get_token_user_id(request)
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    # Counted before the lookup: a move that sets its flag after this waits for us to finish,
+    # and one that set it before is seen by the lookup
+    _begin_write(user_id)
+    try:
+        shard, migrating_to, pinned = lookup_shard(user_id)
+        if migrating_to is not None:
+            # Writes are frozen for the few seconds it takes to flip the user to the new shard
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Chat data is being migrated. Please retry shortly.",
+                headers={"Retry-After": "2"}
+            )
+        if not pinned:
+            pin_user(user_id, shard)
+
+        batch = current_batch()
+        if batch is not None:
+            yield batch.chat_session(shard, open_chat_session)
+            return
+        chat_db = open_chat_session(shard)
+        try:
+            yield chat_db
+        finally:
+            chat_db.close()
+    finally:
+        _end_write(user_id)
+
+def get_chat_read_db(request: Request, db: Session = Depends(get_read_db)):
+    """Chat session for GET handlers; the (replica-routed) read session when unsharded"""
+    if not sharding_enabled():
+        yield db
+        return
+
+    user_id = get_token_user_id(request)
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    shard, _, _ = lookup_shard(user_id)
+
+    batch = current_batch()
+    if batch is not None:
+        yield batch.chat_session(shard, open_chat_session)
+        return
+    chat_db = open_chat_session(shard)
+    try:
+        yield chat_db
+    finally:
+        chat_db.close()
+
+class IdAllocator:
+    """Globally unique chat ids across shards, reserved from Redis in blocks"""
+
+    def __init__(self, block_size: int = 1000):
+        self.block_size = block_size
+        self._blocks: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, table: str) -> int:
+        with self._lock:
+            block = self._blocks.get(table)
+            if not block or block[0] > block[1]:
+                high = _redis().incrby(f"chat:ids:{table}", self.block_size)
+                block = [high - self.block_size + 1, high]
+                self._blocks[table] = block
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def reserve(self, table: str, count: int) -> range:
+        """A contiguous run of count ids in one round trip, for bulk inserts"""
+        high = _redis().incrby(f"chat:ids:{table}", count)
+        return range(high - count + 1, high + 1)
+
+    def seed(self, table: str, minimum: int):
+        """Make sure future ids start above ids that already exist"""
+        key = f"chat:ids:{table}"
+        current = int(_redis().get(key) or 0)
+        if current < minimum:
+            _redis().incrby(key, minimum - current)
+
+id_allocator = IdAllocator()
+
+def _assign_chat_id(mapper, connection, target):
+    if target.id is None:
+        target.id = id_allocator.next_id(mapper.local_table.name)
+
+if sharding_enabled():
+    # Per-shard autoincrement would collide when users move between shards
+    event.listen(Chatroom, "before_insert", _assign_chat_id)
+    event.listen(Message, "before_insert", _assign_chat_id)
+
+def create_shard_schema(shard: str):
+    """Create chat tables on a shard, without the foreign key to the global users table"""
+    metadata = MetaData()
+    for table in (Chatroom.__table__, Message.__table__):
+        shard_table = table.to_metadata(metadata)
+        for constraint in list(shard_table.foreign_key_constraints):
+            if any(element.target_fullname.startswith("users.") for element in constraint.elements):
+                shard_table.constraints.discard(constraint)
+                for element in constraint.elements:
+                    shard_table.foreign_keys.discard(element)
+                    element.parent.foreign_keys.discard(element)
+    metadata.create_all(shard_engines[shard])
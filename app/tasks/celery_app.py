@@ -0,0 +1,34 @@
+from celery import Celery
+from celery.signals import worker_process_init
+from ..config import settings
+from ..utils.tracing import configure_tracing
+
+celery_app = Celery(
+    'gemini_tasks',
+    broker=settings.REDIS_URL,
+    include=['app.tasks.gemini_tasks', 'app.tasks.stripe_tasks', 'app.tasks.metering_tasks',
+             'app.tasks.compression_tasks']
+)
+
+celery_app.conf.beat_schedule = {
+    'sweep-pending-stripe-events': {
+        'task': 'app.tasks.stripe_tasks.sweep_pending_stripe_events',
+        'schedule': 60.0,
+    },
+    'reconcile-subscriptions': {
+        'task': 'app.tasks.stripe_tasks.reconcile_subscriptions',
+        'schedule': float(settings.STRIPE_RECONCILE_INTERVAL_SECONDS),
+    },
+    'recover-expired-message-leases': {
+        'task': 'app.tasks.gemini_tasks.recover_expired_leases',
+        'schedule': float(settings.MESSAGE_SWEEP_INTERVAL_SECONDS),
+    },
+    'flush-usage-events': {
+        'task': 'app.tasks.metering_tasks.flush_usage_events',
+        'schedule': float(settings.USAGE_FLUSH_INTERVAL_SECONDS),
+    },
+}
+
+@worker_process_init.connect
+def init_worker_tracing(**kwargs):
+    configure_tracing()
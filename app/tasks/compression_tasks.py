@@ -0,0 +1,163 @@
+"""Compress existing message text in batches (after migration 0004), or undo it
+
+    python -m app.tasks.compression_tasks                      # primary (or every shard)
+    python -m app.tasks.compression_tasks --shard chat1 --batch-size 2000
+    python -m app.tasks.compression_tasks --decompress         # before downgrading 0004
+    python -m app.tasks.compression_tasks --train-dictionary message-2.dict   # a new file
+
+Rows are walked in id order and only rewritten when their stored form changes. A row is
+only rewritten if its processing_status is unchanged since it was read, so a reply that
+lands meanwhile is never overwritten. Safe to stop and re-run at any point.
+"""
+import argparse
+import os
+from typing import Optional, Tuple
+from sqlalchemy import LargeBinary, bindparam, select, type_coerce, update
+from sqlalchemy.types import NullType
+from ..config import settings
+from ..models.chatroom import Message
+from ..models.types import compress_text, decompress_text, is_compressed, plain_text, reset_codecs
+from ..sharding import open_chat_session, shard_sessions
+from ..utils.metrics import track_task_runtime
+from .celery_app import celery_app
+
+SETTLED_STATUSES = ("completed", "failed", "imported")
+messages = Message.__table__
+
+def _stored(value, decompress: bool):
+    """New stored form for a raw column value, or None when it is already right"""
+    if value is None:
+        return None
+    text = decompress_text(value)
+    stored = plain_text(text) if decompress else compress_text(text)
+    current = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    return None if stored == current else stored
+
+def rewrite_batch(db, after_id: int, batch_size: int, decompress: bool = False) -> Tuple[Optional[int], int]:
+    """Process one batch after after_id; returns (last id seen or None when done, rows rewritten)"""
+    # NullType reads the stored value as-is, bypassing CompressedText
+    rows = db.execute(
+        select(
+            messages.c.id,
+            messages.c.processing_status,
+            type_coerce(messages.c.content, NullType()),
+            type_coerce(messages.c.gemini_response, NullType())
+        ).where(
+            messages.c.id > after_id,
+            messages.c.processing_status.in_(SETTLED_STATUSES)
+        ).order_by(messages.c.id).limit(batch_size)
+    ).all()
+    if not rows:
+        return None, 0
+
+    updates = []
+    for message_id, status, content, response in rows:
+        if not decompress and not (_needs_work(content) or _needs_work(response)):
+            continue
+        new_content, new_response = _stored(content, decompress), _stored(response, decompress)
+        if new_content is None and new_response is None:
+            continue
+        updates.append({
+            "row_id": message_id,
+            "row_status": status,
+            "content": new_content if new_content is not None else _raw(content),
+            "gemini_response": new_response if new_response is not None else _raw(response),
+        })
+    if updates:
+        db.execute(
+            update(messages).where(
+                messages.c.id == bindparam("row_id"),
+                messages.c.processing_status == bindparam("row_status")
+            ).values(
+                content=bindparam("content", type_=LargeBinary),
+                gemini_response=bindparam("gemini_response", type_=LargeBinary)
+            ).execution_options(synchronize_session=False),
+            updates
+        )
+    db.commit()
+    return rows[-1][0], len(updates)
+
+def _needs_work(value) -> bool:
+    # Cheap pre-check: only plain values over the threshold can shrink
+    if value is None or is_compressed(value):
+        return False
+    size = len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+    return size >= settings.MESSAGE_COMPRESSION_MIN_BYTES
+
+def _raw(value):
+    if value is None:
+        return None
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+def rewrite_messages(shard: Optional[str] = None, batch_size: int = 1000, decompress: bool = False,
+                     after_id: int = 0, max_batches: Optional[int] = None) -> Tuple[Optional[int], int]:
+    """Run batches until done (or max_batches); returns (resume id or None when done, rows rewritten)"""
+    db = open_chat_session(shard)
+    rewritten = batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            after_id, count = rewrite_batch(db, after_id, batch_size, decompress)
+            rewritten += count
+            batches += 1
+            if after_id is None:
+                break
+    finally:
+        db.close()
+    return after_id, rewritten
+
+@celery_app.task
+@track_task_runtime
+def compress_messages(shard: Optional[str] = None, after_id: int = 0, batch_size: int = 1000, max_batches: int = 50):
+    """Background backfill: a bounded slice per run, re-enqueued until every row is visited"""
+    resume_id, rewritten = rewrite_messages(shard, batch_size, after_id=after_id, max_batches=max_batches)
+    print(f"Compressed {rewritten} messages on {shard or 'primary'} after id {after_id}")
+    if resume_id is not None:
+        compress_messages.delay(shard, resume_id, batch_size, max_batches)
+
+def train_dictionary(path: str, samples: int = 5000, size: int = 112640):
+    """Train a zstd dictionary on recent replies and write it to a new file at path
+
+    Never overwrites a file: rows compressed with a dictionary can only be read with it. Point
+    MESSAGE_COMPRESSION_DICT_PATH at the new file and move the old one to
+    MESSAGE_COMPRESSION_OLD_DICT_PATHS.
+    """
+    import zstandard
+
+    in_use = [settings.MESSAGE_COMPRESSION_DICT_PATH, *settings.MESSAGE_COMPRESSION_OLD_DICT_PATHS]
+    if any(other and os.path.realpath(other) == os.path.realpath(path) for other in in_use):
+        raise ValueError(f"{path} is a dictionary in use; train into a new file")
+    if os.path.exists(path):
+        raise ValueError(f"{path} already exists; train into a new file")
+
+    db = open_chat_session(None)
+    try:
+        texts = [text for text, in db.query(Message.gemini_response).filter(
+            Message.gemini_response.isnot(None)
+        ).order_by(Message.id.desc()).limit(samples)]
+    finally:
+        db.close()
+    dictionary = zstandard.train_dictionary(size, [text.encode("utf-8") for text in texts])
+    with open(path, "xb") as f:
+        f.write(dictionary.as_bytes())
+    print(f"Wrote dictionary {dictionary.dict_id()} ({len(dictionary.as_bytes())} bytes, trained on "
+          f"{len(texts)} replies) to {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress or decompress stored message text")
+    parser.add_argument("--shard", action="append", help="default: every shard, or the primary when unsharded")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--decompress", action="store_true", help="store every value as plain UTF-8")
+    parser.add_argument("--train-dictionary", metavar="PATH")
+    parser.add_argument("--samples", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.train_dictionary:
+        try:
+            train_dictionary(args.train_dictionary, args.samples)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        reset_codecs()
+        for shard in args.shard or sorted(shard_sessions) or [None]:
+            _, rewritten = rewrite_messages(shard, args.batch_size, args.decompress)
+            print(f"{shard or 'primary'}: rewrote {rewritten} messages")
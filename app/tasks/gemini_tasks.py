@@ -1,40 +1,162 @@
-from celery import Celery
+import time
+from datetime import datetime, timezone
+from typing import Optional
 from sqlalchemy.orm import Session
-from ..database import SessionLocal
-from ..services.gemini_service import GeminiService
-from ..models.chatroom import Message
+from ..sharding import open_chat_session, shard_sessions
+from ..clients import get_chat_stream, get_gemini_service, get_semantic_cache
 from ..config import settings
+from ..models.chatroom import Message
+from ..services.gemini_service import GeminiResult, GeminiUnavailable
+from ..services.message_lease import (
+    MessageLeased, claim_message, claim_owner, defer_message, finish_message, lease_owner, lease_remaining,
+    take_over_expired
+)
+from ..services.metering_service import record_usage_event
+from ..utils.circuit_breaker import CircuitOpenError
+from ..utils.metrics import MESSAGE_LEASES_RECOVERED, track_task_runtime
+from ..utils.tracing import tracer, extract_trace_context
+from .celery_app import celery_app
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def generate_with_fallback(prompt: str) -> Optional[GeminiResult]:
+    """Ask the primary model, then GEMINI_FALLBACK_MODEL
+
+    Returns None when the models answered with errors, and raises GeminiUnavailable when no
+    model answered and at least one circuit was open, so the work is retried instead of failed.
+    """
+    model_names = [settings.GEMINI_MODEL]
+    if settings.GEMINI_FALLBACK_MODEL:
+        model_names.append(settings.GEMINI_FALLBACK_MODEL)
+
+    retry_after = None
+    for model_name in model_names:
+        gemini_service = get_gemini_service(model_name)
+        try:
+            result = gemini_service.generate(prompt)
+        except CircuitOpenError:
+            delay = gemini_service.breaker.retry_after()
+            retry_after = delay if retry_after is None else min(retry_after, delay)
+            continue
+        except Exception as e:
+            print(f"Gemini API error ({model_name}): {e}")
+            continue
+        if result.text:
+            return result
+    if retry_after is not None:
+        raise GeminiUnavailable(retry_after)
+    return None
+
+@celery_app.task(autoretry_for=(GeminiUnavailable,), retry_backoff=30, retry_backoff_max=300, max_retries=None)
+@track_task_runtime
+def process_gemini_message(message_id: int, shard: Optional[str] = None, trace_headers: Optional[dict] = None,
+                           enqueued_at: Optional[float] = None, wait_for_lease: bool = False):
+    """Process message with Gemini API
+
+    With wait_for_lease, a message still leased to another worker raises MessageLeased
+    instead of being skipped, so an ordered caller can hold everything behind it.
+    """
+    # trace_headers carries the caller's traceparent so this hop joins the request's trace
+    with tracer.start_as_current_span(
+        "process_gemini_message",
+        context=extract_trace_context(trace_headers)
+    ) as task_span:
+        task_span.set_attribute("message.id", message_id)
+        queue_wait_ms = round((time.time() - enqueued_at) * 1000, 2) if enqueued_at else None
+
+        db: Session = open_chat_session(shard)
+        owner = claim_owner()
+        claimed = False
+        try:
+            # One conditional UPDATE: a message handed out twice is still answered once
+            persistence_start = time.perf_counter()
+            with tracer.start_as_current_span("message.claim"):
+                claimed = claim_message(db, message_id, owner)
+            if not claimed:
+                remaining = lease_remaining(db, message_id) if wait_for_lease else None
+                if remaining is not None:
+                    raise MessageLeased(remaining)
+                return  # done already, or leased by a live worker
+            with tracer.start_as_current_span("message.load"):
+                message = db.query(Message).filter(Message.id == message_id).first()
+            persistence_ms = _elapsed_ms(persistence_start)
+
+            # Paraphrases of earlier prompts are answered from the semantic cache
+            model_start = time.perf_counter()
+            semantic_cache = get_semantic_cache()  # None unless SEMANTIC_CACHE_ENABLED
+            scope = semantic_cache.scope_for(message.chatroom.user_id) if semantic_cache else 0
+            cached = semantic_cache.lookup(message.content, scope) if semantic_cache else None
+            result = None
+            if cached is None:
+                # Get Gemini response
+                try:
+                    result = generate_with_fallback(message.content)
+                except GeminiUnavailable as e:
+                    # Fail fast while Gemini is down, but keep the message (and its lease) for a later attempt
+                    defer_message(db, message_id, owner, e.retry_after)
+                    raise
+                record_usage_event(message.chatroom.user_id, message.id, result, _elapsed_ms(model_start))
+                if result and semantic_cache:
+                    semantic_cache.store(message.content, result.text, scope)
+            model_ms = _elapsed_ms(model_start)
+
+            persistence_start = time.perf_counter()
+            with tracer.start_as_current_span("message.persist"):
+                if cached is not None:
+                    outcome = {"gemini_response": cached[0], "cache_similarity": cached[1],
+                               "response_source": "semantic_cache", "processing_status": "completed"}
+                elif result:
+                    outcome = {"gemini_response": result.text, "response_source": "gemini",
+                               "processing_status": "completed"}
+                else:
+                    outcome = {"processing_status": "failed"}
+                outcome["processing_latency"] = {
+                    "queue_wait_ms": queue_wait_ms,
+                    "model_ms": model_ms,
+                    "persistence_ms": round(persistence_ms + _elapsed_ms(persistence_start), 2)
+                }
+                if not finish_message(db, message_id, owner, **outcome):
+                    # Our lease expired and the sweeper handed the message to someone else
+                    print(f"Gemini task lost the lease on message {message_id}")
+                    db.rollback()
+                    return
+
+                # Bump the chatroom version so conditional GETs see the new response
+                message.chatroom.modified_at = datetime.now(tz=timezone.utc)
+                db.commit()
+            task_span.set_attribute("message.status", outcome["processing_status"])
 
-celery_app = Celery('gemini_tasks', broker=settings.REDIS_URL)
+        except (GeminiUnavailable, MessageLeased):
+            raise
+        except Exception as e:
+            print(f"Gemini task error: {e}")
+            if claimed:
+                db.rollback()
+                finish_message(db, message_id, owner, processing_status="failed")
+                db.commit()
+        finally:
+            db.close()
 
 @celery_app.task
-def process_gemini_message(message_id: int):
-    """Process message with Gemini API"""
-    db: Session = SessionLocal()
-    try:
-        message = db.query(Message).filter(Message.id == message_id).first()
-        if not message:
-            return
-        
-        # Update status to processing
-        message.processing_status = "processing"
-        db.commit()
-        
-        # Get Gemini response
-        gemini_service = GeminiService()
-        response = gemini_service.generate_response(message.content)
-        
-        if response:
-            message.gemini_response = response
-            message.processing_status = "completed"
-        else:
-            message.processing_status = "failed"
-        
-        db.commit()
-        
-    except Exception as e:
-        print(f"Gemini task error: {e}")
-        message.processing_status = "failed"
-        db.commit()
-    finally:
-        db.close()
\ No newline at end of file
+@track_task_runtime
+def recover_expired_leases(batch_size: Optional[int] = None, max_batches: int = 20):
+    """Re-enqueue messages whose worker or queue died; runs from beat on every shard"""
+    batch_size = batch_size or settings.MESSAGE_SWEEP_BATCH_SIZE
+    owner = f"sweeper:{lease_owner()}"
+    for shard in sorted(shard_sessions) or [None]:
+        db = open_chat_session(shard)
+        try:
+            for _ in range(max_batches):
+                recovered = take_over_expired(db, owner, batch_size)
+                for message_id, chatroom_id in recovered:
+                    if settings.CHAT_STREAM_ENABLED:
+                        # Behind the chatroom's newer messages, but still one at a time
+                        get_chat_stream().publish(chatroom_id, message_id, shard=shard, enqueued_at=time.time())
+                    else:
+                        process_gemini_message.delay(message_id, shard=shard, enqueued_at=time.time())
+                MESSAGE_LEASES_RECOVERED.inc(len(recovered))
+                if len(recovered) < batch_size:
+                    break
+        finally:
+            db.close()
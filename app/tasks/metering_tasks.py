@@ -0,0 +1,57 @@
+import argparse
+from datetime import datetime
+from redis.exceptions import LockError
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import SessionLocal
+from ..clients import get_redis
+from ..services.metering_service import MeteringService
+from ..utils.metrics import track_task_runtime
+from .celery_app import celery_app
+
+FLUSH_LOCK_KEY = "usage:flush:lock"
+FLUSH_LOCK_SECONDS = 120
+
+@celery_app.task
+@track_task_runtime
+def flush_usage_events(max_batches: int = 20):
+    """Write buffered usage events in batches and refresh the rollups they touch"""
+    redis_client = get_redis()
+    # One flusher at a time keeps LRANGE/LTRIM pairs from interleaving
+    lock = redis_client.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_SECONDS)
+    if not lock.acquire(blocking=False):
+        return
+    db: Session = SessionLocal()
+    try:
+        service = MeteringService(db)
+        for _ in range(max_batches):
+            if not service.flush(redis_client, settings.USAGE_FLUSH_BATCH_SIZE):
+                break
+    finally:
+        db.close()
+        lock.release()
+
+def backfill(since: datetime, until: datetime = None, user_id: int = None) -> int:
+    """Rebuild rollups from usage_events for a time range (naive datetimes are UTC)"""
+    # Holds the flusher's lock, so a flush cannot rewrite the same rollups halfway through;
+    # renewed after every chunk, so a long backfill keeps it
+    lock = get_redis().lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_SECONDS)
+    if not lock.acquire(blocking=True, blocking_timeout=FLUSH_LOCK_SECONDS):
+        raise RuntimeError("usage flush lock is busy; try again later")
+    db: Session = SessionLocal()
+    try:
+        return MeteringService(db).backfill(since, until, user_id, on_progress=lock.reacquire)
+    finally:
+        db.close()
+        try:
+            lock.release()
+        except LockError:
+            pass  # expired (and maybe taken) already; nothing of ours to release
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage rollups from usage_events")
+    parser.add_argument("--since", required=True, type=datetime.fromisoformat, help="UTC, e.g. 2026-01-01")
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+    print(f"Refreshed {backfill(args.since, args.until, args.user_id)} hourly buckets")
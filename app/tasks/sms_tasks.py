@@ -0,0 +1,86 @@
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Optional
+from ..config import settings
+from ..clients import get_sms_queue
+from ..services.sms_service import SMSQueue, SMSProvider, get_sms_provider
+
+def _expired(message: dict, at: float) -> bool:
+    return bool(message.get("expires_at")) and message["expires_at"] <= at
+
+class SMSWorker:
+    """Drains the outbound SMS queue in batches over a single provider connection"""
+
+    def __init__(self, queue: SMSQueue, provider: SMSProvider, worker_id: Optional[str] = None):
+        self.queue = queue
+        self.provider = provider
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.running = False
+
+    def backoff_seconds(self, attempts: int) -> float:
+        """Exponential backoff with jitter"""
+        delay = settings.SMS_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        return min(delay, settings.SMS_RETRY_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
+    def run_once(self, timeout: int = 1) -> int:
+        """Send one batch, returning the number of messages handled"""
+        self.queue.heartbeat(self.worker_id, settings.SMS_WORKER_LEASE_SECONDS)
+        self.queue.recover_orphans()
+        self.queue.promote_due_retries()
+        batch = self.queue.pop_batch(self.worker_id, settings.SMS_BATCH_SIZE, timeout=timeout)
+        if not batch:
+            return 0
+
+        now = time.time()
+        for payload, message in batch:
+            if _expired(message, now):
+                self.queue.dead_letter(self.worker_id, payload, message)  # e.g. an OTP nobody can use any more
+        sending = [(payload, message) for payload, message in batch if not _expired(message, now)]
+        if not sending:
+            return len(batch)
+
+        messages = [message for _, message in sending]
+        try:
+            results = self.provider.send_batch(messages)
+        except Exception as e:
+            print(f"SMS batch error: {e}")
+            results = [False] * len(messages)
+        if len(results) != len(messages):
+            # No answer for the rest of the batch: retry those rather than lose them
+            print(f"SMS provider returned {len(results)} results for {len(messages)} messages")
+            results = list(results[:len(messages)]) + [False] * (len(messages) - len(results))
+
+        for (payload, message), delivered in zip(sending, results):
+            if delivered:
+                self.queue.ack(self.worker_id, payload)
+                continue
+            message["attempts"] += 1
+            delay = self.backoff_seconds(message["attempts"])
+            if message["attempts"] >= settings.SMS_MAX_RETRIES or _expired(message, time.time() + delay):
+                self.queue.dead_letter(self.worker_id, payload, message)
+            else:
+                self.queue.schedule_retry(self.worker_id, payload, message, delay)
+        return len(batch)
+
+    def run(self):
+        """Process batches until stopped"""
+        self.running = True
+        try:
+            while self.running:
+                self.run_once()
+        finally:
+            self.queue.leave(self.worker_id)
+            self.provider.close()
+
+    def stop(self):
+        self.running = False
+
+def run_worker(provider: Optional[SMSProvider] = None):
+    """Start a blocking SMS worker"""
+    SMSWorker(get_sms_queue(), provider or get_sms_provider()).run()
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,205 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set
+from ..config import settings
+from ..clients import get_chat_stream, get_stream_admission
+from ..services.chat_stream import ChatStream
+from ..services.gemini_scheduler import TokenBudgetExhausted
+from ..services.gemini_service import GeminiUnavailable
+from ..services.message_lease import MessageLeased
+from ..utils.metrics import CHAT_STREAM_ENTRIES, CHAT_STREAM_PARTITIONS_OWNED, CHAT_STREAM_RECLAIMED
+
+# The entry stays in its partition, holding up the ones after it, and keeps its ticket
+DEFERRALS = (GeminiUnavailable, MessageLeased, TokenBudgetExhausted)
+
+def process_entry(entry: dict):
+    """Default handler: answer the message, as the in-process dispatcher would
+
+    Draws from the same tokens-per-minute budget as the dispatcher, and gives back the
+    message's admission ticket once it is answered (or failed).
+    """
+    from .gemini_tasks import process_gemini_message
+
+    admission = get_stream_admission()
+    # Re-published by the lease sweeper without an estimate: charge a typical message
+    if not admission.budget.try_consume(entry["cost"] or settings.GEMINI_EST_RESPONSE_TOKENS):
+        raise TokenBudgetExhausted(admission.budget.retry_after())
+    try:
+        process_gemini_message(
+            entry["message_id"],
+            shard=entry["shard"],
+            trace_headers=entry["trace_headers"],
+            enqueued_at=entry["enqueued_at"],
+            # An earlier owner of the partition (possibly dead) still holds it: wait, don't skip
+            wait_for_lease=True
+        )
+    except DEFERRALS:
+        raise  # still queued
+    except Exception:
+        if entry["ticket"]:
+            admission.release(entry["ticket"])
+        raise
+    if entry["ticket"]:
+        admission.release(entry["ticket"])
+
+class ChatStreamWorker:
+    """Owns its share of the chat stream partitions and works through each one in order
+
+    One thread per busy partition, so partitions run in parallel while each one's entries
+    are handled strictly one after another. Every CHAT_STREAM_HEARTBEAT_SECONDS the worker
+    renews its leases, hands over partitions now assigned elsewhere (after the entry in
+    hand) and acquires the ones assigned to it as soon as their lease is free.
+    """
+
+    def __init__(self, stream: ChatStream, handler: Callable[[dict], None] = process_entry,
+                 worker_id: Optional[str] = None, threads: Optional[int] = None):
+        self.stream = stream
+        self.handler = handler
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.pool = ThreadPoolExecutor(threads or settings.CHAT_STREAM_WORKER_THREADS,
+                                       thread_name_prefix="chat-stream")
+        self.owned: Set[int] = set()
+        self.busy: Dict[int, Future] = {}
+        self.has_pending: Set[int] = set()  # read our unacked entries before new ones
+        self.paused_until: Dict[int, float] = {}
+        self.releasing: Set[int] = set()  # reassigned, lease freed once the batch in hand ends
+        self.running = False
+        self._next_heartbeat = 0.0
+        self._lock = threading.Lock()
+
+    def rebalance(self):
+        live = self.stream.heartbeat(self.worker_id)
+        assigned = {
+            partition for partition, owner in self.stream.assignment(live).items()
+            if owner == self.worker_id
+        }
+        for partition in sorted(self.owned):
+            if partition not in assigned:
+                # Hand it over: stop after the entry in hand, then free the lease
+                self._drop(partition)
+                self.releasing.add(partition)
+            elif not self.stream.renew(partition, self.worker_id):
+                # Lost it (e.g. a long pause); the entry in hand finishes, nothing after it
+                self._drop(partition)
+        for partition in sorted(assigned - self.owned):
+            if self.stream.acquire(partition, self.worker_id):
+                reclaimed = self.stream.claim_pending(partition, self.worker_id)
+                CHAT_STREAM_RECLAIMED.inc(reclaimed)
+                with self._lock:
+                    self.owned.add(partition)
+                    self.has_pending.add(partition)
+        CHAT_STREAM_PARTITIONS_OWNED.set(len(self.owned))
+
+    def _drop(self, partition: int):
+        with self._lock:
+            self.owned.discard(partition)
+            self.has_pending.discard(partition)
+            self.paused_until.pop(partition, None)
+
+    def run_once(self, block_ms: int = 1000) -> int:
+        """Hand out one batch per idle partition, returning the number of entries"""
+        now = time.monotonic()
+        if now >= self._next_heartbeat:
+            self.stream.ensure_groups()
+            self.rebalance()
+            self._next_heartbeat = now + settings.CHAT_STREAM_HEARTBEAT_SECONDS
+
+        for partition, future in list(self.busy.items()):
+            if future.done():
+                del self.busy[partition]
+        for partition in sorted(self.releasing - set(self.busy)):
+            # Unacked entries stay pending for the next owner to claim
+            self.stream.release(partition, self.worker_id)
+            self.releasing.discard(partition)
+        with self._lock:
+            ready = [
+                partition for partition in sorted(self.owned)
+                if partition not in self.busy and self.paused_until.get(partition, 0) <= now
+            ]
+            pending = [partition for partition in ready if partition in self.has_pending]
+        if not ready:
+            time.sleep(0.05)
+            return 0
+
+        batches = self.stream.read(pending, self.worker_id, pending=True, count=settings.CHAT_STREAM_BATCH_SIZE)
+        with self._lock:
+            for partition in pending:
+                if not batches.get(partition):
+                    self.has_pending.discard(partition)
+        batches = {partition: entries for partition, entries in batches.items() if entries}
+        fresh = [partition for partition in ready if partition not in batches]
+        if fresh:
+            # Wait for new work only while no partition is busy
+            batches.update(self.stream.read(
+                fresh, self.worker_id, count=settings.CHAT_STREAM_BATCH_SIZE,
+                block_ms=None if self.busy or batches else block_ms
+            ))
+
+        handed_out = 0
+        for partition, entries in batches.items():
+            if entries:
+                self.busy[partition] = self.pool.submit(self._process, partition, entries)
+                handed_out += len(entries)
+        if not handed_out:
+            time.sleep(0.01)  # nothing new: do not spin while partitions are busy
+        return handed_out
+
+    def _process(self, partition: int, entries):
+        for entry_id, entry in entries:
+            if partition not in self.owned:
+                return  # the next owner claims what is left
+            if entry is not None:
+                try:
+                    self.handler(entry)
+                except DEFERRALS as e:
+                    # Keep the entry, and everything after it, until Gemini is back, the
+                    # message's lease expires or the token budget's window rolls
+                    with self._lock:
+                        self.paused_until[partition] = time.monotonic() + e.retry_after
+                        self.has_pending.add(partition)
+                    CHAT_STREAM_ENTRIES.labels("deferred").inc()
+                    return
+                except Exception as e:
+                    # The message is marked failed; holding the partition would not help it
+                    print(f"Chat stream entry error: {e}")
+                    CHAT_STREAM_ENTRIES.labels("error").inc()
+                else:
+                    CHAT_STREAM_ENTRIES.labels("processed").inc()
+            self.stream.ack(partition, entry_id)
+
+    def run(self):
+        """Process partitions until stopped, then hand them back"""
+        self.running = True
+        try:
+            while self.running:
+                self.run_once()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.running = False
+
+    def shutdown(self):
+        """Finish the batches in hand and release every partition for the other workers"""
+        self.pool.shutdown(wait=True)
+        self.busy.clear()
+        for partition in sorted(self.owned | self.releasing):
+            self.stream.release(partition, self.worker_id)
+        self.owned.clear()
+        self.releasing.clear()
+        self.stream.leave(self.worker_id)
+        CHAT_STREAM_PARTITIONS_OWNED.set(0)
+
+def run_worker(threads: Optional[int] = None):
+    """Start a blocking chat stream worker"""
+    from .celery_app import celery_app
+
+    celery_app.finalize()  # bind the tasks before several threads call them at once
+    ChatStreamWorker(get_chat_stream(), threads=threads).run()
+
+if __name__ == "__main__":
+    run_worker()
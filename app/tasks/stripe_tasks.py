@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+from redis.exceptions import LockError
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import SessionLocal
+from ..models.stripe_event import StripeEvent
+from ..models.subscription import Subscription
+from ..clients import get_redis
+from ..services.stripe_service import StripeService
+from ..services.stripe_webhook_service import StripeWebhookService
+from ..services.subscription_service import SubscriptionService
+from ..utils.metrics import STRIPE_CANCEL_FAILURES, track_task_runtime
+from .celery_app import celery_app
+
+@celery_app.task(bind=True, max_retries=settings.STRIPE_EVENT_MAX_ATTEMPTS)
+@track_task_runtime
+def process_stripe_events(self, ordering_key: str, lock_waits: int = 0):
+    """Drain pending ledger events for one subscription, in order"""
+    # One drainer per subscription keeps events ordered across workers; a drain outliving
+    # the lock stops at the next event rather than racing whoever took it over
+    lock = get_redis().lock(f"stripe_events:lock:{ordering_key}", timeout=settings.STRIPE_EVENT_LOCK_SECONDS)
+    if not lock.acquire(blocking=False):
+        # Another drain is running: try again as a fresh task, so waiting never uses up the
+        # failure retries. The lock expires within STRIPE_EVENT_LOCK_SECONDS; past that many
+        # waits the sweep picks the events up.
+        if lock_waits < settings.STRIPE_EVENT_LOCK_SECONDS:
+            process_stripe_events.apply_async((ordering_key,), {"lock_waits": lock_waits + 1}, countdown=1)
+        return
+
+    db: Session = SessionLocal()
+    try:
+        StripeWebhookService(db).process_pending(ordering_key, on_progress=lock.reacquire)
+    except LockError as e:
+        print(f"Stripe event drain for {ordering_key} lost its lock: {e}")
+    except Exception as e:
+        print(f"Stripe event processing error: {e}")
+        raise self.retry(countdown=min(2 ** self.request.retries, 300))
+    finally:
+        db.close()
+        try:
+            lock.release()
+        except LockError:
+            pass  # expired (and maybe taken) already; nothing of ours to release
+
+@celery_app.task
+@track_task_runtime
+def sweep_pending_stripe_events():
+    """Re-enqueue subscriptions whose events were recorded but never drained"""
+    db: Session = SessionLocal()
+    try:
+        cutoff = datetime.now(tz=timezone.utc) - timedelta(minutes=1)
+        keys = db.query(StripeEvent.ordering_key).filter(
+            StripeEvent.status.in_(('pending', 'failed')),
+            StripeEvent.received_at < cutoff
+        ).distinct().all()
+        for (ordering_key,) in keys:
+            process_stripe_events.delay(ordering_key)
+    finally:
+        db.close()
+
+@celery_app.task(bind=True, max_retries=8)
+@track_task_runtime
+def cancel_stripe_subscription(self, stripe_subscription_id: str):
+    """Cancel a subscription in Stripe outside the request path"""
+    try:
+        StripeService().cancel_subscription(stripe_subscription_id)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            # Out of retries while Stripe may still be billing: alert. The row keeps its
+            # cancel_requested_at, so the next reconciliation enqueues the cancel again.
+            STRIPE_CANCEL_FAILURES.inc()
+            print(f"ALERT: Stripe cancel of {stripe_subscription_id} failed after {self.request.retries} retries: {e}")
+            return
+        print(f"Stripe cancel error: {e}")
+        raise self.retry(countdown=min(2 ** self.request.retries * 5, 600))
+
+@celery_app.task
+@track_task_runtime
+def reconcile_subscriptions():
+    """Page through Stripe in bulk and repair any local subscription drift"""
+    db: Session = SessionLocal()
+    try:
+        subscription_service = SubscriptionService(db)
+        for index, stripe_subscription in enumerate(StripeService().iter_subscriptions(), start=1):
+            subscription_service.apply_stripe_subscription(stripe_subscription)
+            if index % 100 == 0:
+                db.commit()
+        db.commit()
+
+        # Cancelled here but still live in Stripe (applying it cleared the rest): tell Stripe
+        # again, leaving recent requests to the cancel task still retrying them
+        cutoff = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+        pending = db.query(Subscription.stripe_subscription_id).filter(
+            Subscription.cancel_requested_at < cutoff
+        ).all()
+        for (stripe_subscription_id,) in pending:
+            cancel_stripe_subscription.delay(stripe_subscription_id)
+    except Exception as e:
+        db.rollback()
+        print(f"Subscription reconciliation error: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,219 @@
+import threading
+import time
+from typing import Optional
+from .metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open"""
+
+class CircuitBreaker:
+    """In-process circuit breaker: closed -> open after consecutive failures -> half-open probe"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Whether a call may proceed right now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the breaker, raising CircuitOpenError while open"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+class RedisCircuitBreaker(CircuitBreaker):
+    """Circuit breaker whose state and rolling call stats live in Redis, shared by every worker
+
+    Opens when, over the last window_seconds and at least min_calls, the error rate reaches
+    error_rate_threshold or the share of calls slower than slow_call_seconds reaches
+    slow_rate_threshold. After reset_timeout one worker gets a half-open probe; every failed
+    probe doubles the open time, up to max_reset_timeout. If Redis is unreachable calls are
+    allowed through rather than failing everything.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        redis_client,
+        window_seconds: int = 60,
+        bucket_seconds: int = 10,
+        min_calls: int = 20,
+        error_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_rate_threshold: float = 0.5,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 300.0
+    ):
+        super().__init__(name, reset_timeout=reset_timeout)
+        self.redis = redis_client
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.max_reset_timeout = max_reset_timeout
+        self.state_key = f"breaker:{name}"
+        self.probe_key = f"breaker:{name}:probe"
+
+    def _bucket_key(self, bucket: int) -> str:
+        return f"breaker:{self.name}:stats:{bucket}"
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set((self.CLOSED, self.HALF_OPEN, self.OPEN).index(state))
+
+    def _read_state(self) -> dict:
+        raw = self.redis.hgetall(self.state_key)
+        return {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in raw.items()
+        }
+
+    def _admit(self) -> Optional[str]:
+        """'closed' or 'probe' when the call may go ahead, None when it must fail fast"""
+        try:
+            shared = self._read_state()
+            if shared.get("state", self.CLOSED) == self.CLOSED:
+                self._set_state(self.CLOSED)
+                return self.CLOSED
+            if time.time() < float(shared.get("opened_until", 0)):
+                self._set_state(self.OPEN)
+                return None
+            # Only one worker across the fleet probes at a time
+            if self.redis.set(self.probe_key, 1, nx=True, ex=max(1, int(self.slow_call_seconds * 2))):
+                self.redis.hset(self.state_key, "state", self.HALF_OPEN)
+                self._set_state(self.HALF_OPEN)
+                return "probe"
+            return None
+        except Exception as e:
+            print(f"Circuit breaker {self.name} state error: {e}")
+            return self.CLOSED
+
+    def _open(self, trips: int):
+        timeout = min(self.reset_timeout * (2 ** (trips - 1)), self.max_reset_timeout)
+        self.redis.hset(self.state_key, mapping={
+            "state": self.OPEN,
+            "opened_until": time.time() + timeout,
+            "trips": trips
+        })
+        self._set_state(self.OPEN)
+
+    def _close(self):
+        pipe = self.redis.pipeline()
+        pipe.delete(self.state_key, self.probe_key)
+        now_bucket = int(time.time() // self.bucket_seconds)
+        for offset in range(self.window_seconds // self.bucket_seconds + 1):
+            pipe.delete(self._bucket_key(now_bucket - offset))
+        pipe.execute()
+        self._set_state(self.CLOSED)
+
+    def _window_rates(self):
+        now_bucket = int(time.time() // self.bucket_seconds)
+        pipe = self.redis.pipeline()
+        for offset in range(self.window_seconds // self.bucket_seconds):
+            pipe.hmget(self._bucket_key(now_bucket - offset), "calls", "failures", "slow")
+        calls = failures = slow = 0
+        for values in pipe.execute():
+            calls += int(values[0] or 0)
+            failures += int(values[1] or 0)
+            slow += int(values[2] or 0)
+        if calls < self.min_calls:
+            return 0.0, 0.0
+        return failures / calls, slow / calls
+
+    def _record(self, mode: str, ok: bool, duration: float):
+        try:
+            slow = duration >= self.slow_call_seconds
+            if mode == "probe":
+                if ok and not slow:
+                    self._close()
+                else:
+                    self._open(int(self._read_state().get("trips", 1)) + 1)
+                    self.redis.delete(self.probe_key)
+                return
+
+            key = self._bucket_key(int(time.time() // self.bucket_seconds))
+            pipe = self.redis.pipeline()
+            pipe.hincrby(key, "calls", 1)
+            if not ok:
+                pipe.hincrby(key, "failures", 1)
+            if slow:
+                pipe.hincrby(key, "slow", 1)
+            pipe.expire(key, self.window_seconds + self.bucket_seconds)
+            pipe.execute()
+
+            # Healthy calls never pay for the window scan
+            if ok and not slow:
+                return
+            error_rate, slow_rate = self._window_rates()
+            if error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold:
+                self._open(1)
+        except Exception as e:
+            print(f"Circuit breaker {self.name} record error: {e}")
+
+    def allow_request(self) -> bool:
+        return self._admit() is not None
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a probe through"""
+        try:
+            return max(1.0, float(self._read_state().get("opened_until", 0)) - time.time())
+        except Exception:
+            return self.reset_timeout
+
+    def call(self, func, *args, **kwargs):
+        mode = self._admit()
+        if mode is None:
+            CIRCUIT_REJECTIONS.labels(self.name).inc()
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._record(mode, False, time.perf_counter() - start)
+            raise
+        self._record(mode, True, time.perf_counter() - start)
+        return result
@@ -0,0 +1,27 @@
+import hashlib
+from fastapi import Request, Response, status
+
+def make_etag(*parts) -> str:
+    """Build a weak ETag from cheap version fields (timestamps, counters, ids)"""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    digest = hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+    # Weak, since the compression middleware may re-encode the body
+    return f'W/"{digest}"'
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against the current ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = _opaque_tag(etag)
+    return any(_opaque_tag(tag) == current for tag in header.split(","))
+
+def not_modified_response(etag: str) -> Response:
+    """Empty 304 response carrying the ETag"""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
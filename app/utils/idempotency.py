@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import Optional
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from ..config import settings
+from .metrics import IDEMPOTENT_REQUESTS
+
+# Store the response, or drop the claim, only while the key still holds our in-flight marker:
+# a request that outlived IDEMPOTENCY_LOCK_SECONDS must not overwrite its successor's claim
+COMPLETE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', tonumber(ARGV[3])) and 1 or 0
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class IdempotentRequest:
+    """Single-flight execution of a request keyed by the client's Idempotency-Key
+
+    The first request claims the key with an in-flight marker; concurrent duplicates wait
+    for it and replay its stored response, so the handler body runs at most once.
+    """
+
+    def __init__(self, redis_client, user_id: int, scope: str, key: str, payload: str):
+        self.redis = redis_client
+        self.redis_key = f"idem:{user_id}:{scope}:{key}"
+        self.fingerprint = hashlib.sha256(payload.encode()).hexdigest()
+        # Unique per request, so the marker only ever matches the claim this request made
+        self.marker = json.dumps({"state": "in_flight", "fingerprint": self.fingerprint, "owner": uuid.uuid4().hex})
+
+    def _read(self) -> Optional[dict]:
+        raw = self.redis.get(self.redis_key)
+        return json.loads(raw) if raw else None
+
+    def _replay(self, record: dict) -> JSONResponse:
+        if record["fingerprint"] != self.fingerprint:
+            IDEMPOTENT_REQUESTS.labels("mismatch").inc()
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request body"
+            )
+        IDEMPOTENT_REQUESTS.labels("replayed").inc()
+        return JSONResponse(
+            status_code=record["status_code"],
+            content=record["body"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    async def begin(self) -> Optional[JSONResponse]:
+        """Claim the key, or return the stored response of the request that owns it"""
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            if self.redis.set(self.redis_key, self.marker, nx=True, ex=settings.IDEMPOTENCY_LOCK_SECONDS):
+                IDEMPOTENT_REQUESTS.labels("executed").inc()
+                return None
+
+            # None: the owner failed and released the key; try to claim it after the pause
+            record = self._read()
+            if record is not None and (record["state"] == "done" or record["fingerprint"] != self.fingerprint):
+                return self._replay(record)
+
+            if time.monotonic() >= deadline:
+                IDEMPOTENT_REQUESTS.labels("timed_out").inc()
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still being processed",
+                    headers={"Retry-After": "1"}
+                )
+            await asyncio.sleep(0.05)
+
+    def complete(self, status_code: int, body) -> bool:
+        """Store the response for replays; False if our claim had already expired"""
+        record = {"state": "done", "fingerprint": self.fingerprint, "status_code": status_code, "body": body}
+        stored = self.redis.register_script(COMPLETE_SCRIPT)(
+            keys=[self.redis_key], args=[self.marker, json.dumps(record), settings.IDEMPOTENCY_TTL_SECONDS]
+        )
+        return bool(stored)
+
+    def release(self) -> bool:
+        """Drop the claim after a failure so a retry executes again; False if it was no longer ours"""
+        return bool(self.redis.register_script(RELEASE_SCRIPT)(keys=[self.redis_key], args=[self.marker]))
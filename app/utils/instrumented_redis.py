@@ -0,0 +1,24 @@
+"""The shared Redis client class, apart from utils.metrics so redis is imported on first use"""
+import time
+import redis
+from opentelemetry import trace
+from .metrics import REDIS_COMMAND_LATENCY
+from .tracing import tracer, record_exception
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client recording per-command latency and a span per command"""
+
+    def execute_command(self, *args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        start = time.perf_counter()
+        outcome = "ok"
+        span = tracer.start_span(f"redis.{command}", kind=trace.SpanKind.CLIENT)
+        try:
+            return super().execute_command(*args, **options)
+        except Exception as e:
+            outcome = "error"
+            record_exception(span, e)
+            raise
+        finally:
+            span.end()
+            REDIS_COMMAND_LATENCY.labels(command, outcome).observe(time.perf_counter() - start)
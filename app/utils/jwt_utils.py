@@ -1,11 +1,15 @@
+import uuid
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from ..config import settings
+from .request_batch import current_batch
 from typing import Optional
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+REFRESH_TOKEN_LIFETIME = timedelta(days=30)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -19,14 +23,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(tz=timezone.utc) + timedelta(hours=1)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
 def create_refresh_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.now(tz=timezone.utc) + timedelta(days=30)
+    expire = datetime.now(tz=timezone.utc) + REFRESH_TOKEN_LIFETIME
     to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
@@ -35,4 +41,32 @@ def verify_token(token: str):
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         return payload
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def verify_access_token(token: str) -> Optional[dict]:
+    """Payload of a valid, unrevoked access token; the revocation check is normally in-memory"""
+    batch = current_batch()
+    if batch is not None and token in batch.payloads:
+        return batch.payloads[token]  # sub-requests of a batch verify the token once
+    payload = _verify_access_token(token)
+    if batch is not None:
+        batch.payloads[token] = payload
+    return payload
+
+def _verify_access_token(token: str) -> Optional[dict]:
+    payload = verify_token(token)
+    if not payload or payload.get("type") == "refresh":
+        return None
+    from ..clients import get_revocation_store
+
+    if get_revocation_store().is_revoked(payload):
+        return None
+    return payload
+
+def get_token_user_id(request) -> Optional[int]:
+    """user_id from the request's bearer token, without a DB lookup"""
+    authorization = request.headers.get("authorization") if request is not None else None
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    payload = verify_access_token(authorization[7:].strip())
+    return payload.get("user_id") if payload else None
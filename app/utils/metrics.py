@@ -0,0 +1,248 @@
+import os
+import time
+import functools
+from contextvars import ContextVar
+from typing import Optional
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from fastapi import Response
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled DB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Number of SQL statements executed per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+REDIS_COMMAND_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Redis command latency",
+    ["command", "outcome"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+)
+GEMINI_REQUEST_LATENCY = Histogram(
+    "gemini_request_duration_seconds",
+    "Gemini API call latency",
+    ["model", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+)
+GEMINI_TOKENS = Counter(
+    "gemini_tokens_total",
+    "Gemini tokens consumed",
+    ["model", "kind"]
+)
+GEMINI_ERRORS = Counter(
+    "gemini_errors_total",
+    "Gemini API call failures",
+    ["model"]
+)
+TASK_DURATION = Histogram(
+    "task_duration_seconds",
+    "Background task runtime",
+    ["task", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by rate limits",
+    ["limit"]
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "gemini_scheduler_queue_depth",
+    "Gemini jobs waiting in the schedulers of live processes",
+    ["tier"],
+    multiprocess_mode="livesum"
+)
+SCHEDULER_WAIT = Histogram(
+    "gemini_scheduler_wait_seconds",
+    "Time Gemini jobs spend queued before a worker picks them up",
+    ["tier"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+)
+SCHEDULER_REJECTIONS = Counter(
+    "gemini_scheduler_rejections_total",
+    "Gemini jobs refused at admission",
+    ["tier", "reason"]
+)
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state as last seen by the live processes (0 closed, 1 half-open, 2 open)",
+    ["breaker"],
+    multiprocess_mode="livemax"
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total",
+    "Circuit breaker state changes observed by this process",
+    ["breaker", "state"]
+)
+CIRCUIT_REJECTIONS = Counter(
+    "circuit_breaker_rejections_total",
+    "Calls failed fast because the circuit was open",
+    ["breaker"]
+)
+IDEMPOTENT_REQUESTS = Counter(
+    "idempotent_requests_total",
+    "Requests carrying an Idempotency-Key, by outcome",
+    ["outcome"]
+)
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "semantic_cache_lookups_total",
+    "Semantic cache lookups before calling Gemini",
+    ["result"]
+)
+SEMANTIC_CACHE_ENTRIES = Gauge(
+    "semantic_cache_entries",
+    "Prompts held in the semantic cache indexes of live processes",
+    multiprocess_mode="livesum"
+)
+TOKEN_REVOCATION_CHECKS = Counter(
+    "token_revocation_checks_total",
+    "Token revocation checks, by how they were answered",
+    ["result"]  # clear, false_positive, revoked, unsynced
+)
+TOKEN_REFRESH_REUSE = Counter(
+    "token_refresh_reuse_total",
+    "Rotated refresh tokens presented again; each revokes its token family"
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "How late the event loop wakes a short sleep (decaying peak), worst live process",
+    multiprocess_mode="livemax"
+)
+LOAD_SHED_THRESHOLDS = Gauge(
+    "load_shed_threshold",
+    "Configured load-shedding thresholds (lag in seconds, in-flight caps in requests)",
+    ["threshold"],
+    multiprocess_mode="livemax"
+)
+LOAD_SHED_IN_FLIGHT = Gauge(
+    "load_shed_in_flight_requests",
+    "Requests in flight by route class, summed over live processes",
+    ["route_class"],
+    multiprocess_mode="livesum"
+)
+LOAD_SHED_REJECTIONS = Counter(
+    "load_shed_rejections_total",
+    "Requests answered 503 by the load shedder",
+    ["route_class", "reason"]  # reason: poll_lag, basic_lag, in_flight
+)
+STRIPE_CANCEL_FAILURES = Counter(
+    "stripe_cancel_failures_total",
+    "Stripe cancellations that failed every retry; reconciliation tries them again"
+)
+MESSAGE_LEASES_RECOVERED = Counter(
+    "message_leases_recovered_total",
+    "Messages whose lease expired (crashed worker, lost queue) and were re-enqueued"
+)
+CHAT_STREAM_PARTITIONS_OWNED = Gauge(
+    "chat_stream_partitions_owned",
+    "Chat stream partitions leased to live workers",
+    multiprocess_mode="livesum"
+)
+CHAT_STREAM_ENTRIES = Counter(
+    "chat_stream_entries_total",
+    "Chat stream entries handled by partition workers",
+    ["outcome"]  # processed, deferred (Gemini unavailable, message leased or token budget spent), error
+)
+CHAT_STREAM_RECLAIMED = Counter(
+    "chat_stream_reclaimed_total",
+    "Unacknowledged chat stream entries taken over from a previous partition owner"
+)
+MESSAGES_IMPORTED = Counter(
+    "messages_imported_total",
+    "Historical messages written by bulk conversation imports"
+)
+
+# Per-request SQL statement counter; a mutable cell so threadpool copies of the context share it
+_request_query_count: ContextVar[Optional[list]] = ContextVar("request_query_count", default=None)
+
+def start_query_count():
+    return _request_query_count.set([0])
+
+def finish_query_count(token) -> int:
+    cell = _request_query_count.get()
+    _request_query_count.reset(token)
+    return cell[0] if cell else 0
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    cell = _request_query_count.get()
+    if cell is not None:
+        cell[0] += 1
+
+def instrument_engine(engine):
+    """Count SQL statements against the current request"""
+    event.listen(engine, "before_cursor_execute", _count_query)
+    return engine
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+class CeleryQueueCollector:
+    """Reports Celery broker queue depth at scrape time"""
+
+    def __init__(self, redis_client, queues=("celery",)):
+        self.redis_client = redis_client
+        self.queues = queues
+
+    def collect(self):
+        gauge = GaugeMetricFamily("celery_queue_depth", "Messages waiting in the Celery broker", labels=["queue"])
+        for queue in self.queues:
+            try:
+                gauge.add_metric([queue], self.redis_client.llen(queue))
+            except Exception as e:
+                print(f"Celery queue depth error: {e}")
+        yield gauge
+
+def track_task_runtime(func):
+    """Record task runtime whether it runs in a Celery worker or inline"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            TASK_DURATION.labels(func.__name__, outcome).observe(time.perf_counter() - start)
+    return wrapper
+
+_celery_collector: Optional[CeleryQueueCollector] = None
+
+def register_celery_queue_collector(redis_client):
+    """Register the queue depth collector once per process"""
+    global _celery_collector
+    if _celery_collector is None:
+        _celery_collector = CeleryQueueCollector(redis_client)
+        REGISTRY.register(_celery_collector)
+
+def metrics_response() -> Response:
+    """Prometheus text exposition; under app.server, merged across every worker process"""
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _celery_collector is not None:
+        registry.register(_celery_collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
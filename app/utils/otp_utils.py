@@ -1,30 +1,90 @@
-import random
+import secrets
 import string
-from datetime import datetime, timedelta
-from ..services.cache_service import CacheService
+import time
+from fastapi import HTTPException, status
+from ..clients import get_redis, get_sms_queue
+from ..config import settings
+from .metrics import RATE_LIMIT_REJECTIONS
 
-cache_service = CacheService()
+OTP_VERIFIED = 1
+OTP_INVALID = 0
+OTP_LOCKED = -1
+
+# Compare-and-consume in a single round trip. Wrong guesses bump a per-number
+# counter; once it reaches the limit the pending OTP is burned and the number
+# stays locked for the full lockout period from that last guess.
+#   KEYS[1] = otp key, KEYS[2] = attempts key
+#   ARGV[1] = submitted code, ARGV[2] = max attempts, ARGV[3] = lockout seconds
+VERIFY_AND_CONSUME_SCRIPT = """
+local attempts = tonumber(redis.call('GET', KEYS[2]) or '0')
+if attempts >= tonumber(ARGV[2]) then
+    return -1
+end
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+    return 0
+end
+if stored == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+end
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+    redis.call('DEL', KEYS[1])
+    return -1
+end
+return 0
+"""
+
+_verify_and_consume = None
+
+def _verify_and_consume_script():
+    global _verify_and_consume
+    if _verify_and_consume is None:
+        _verify_and_consume = get_redis().register_script(VERIFY_AND_CONSUME_SCRIPT)
+    return _verify_and_consume
+
+def _otp_key(mobile_number: str) -> str:
+    return f"otp:{mobile_number}"
+
+def _attempts_key(mobile_number: str) -> str:
+    return f"otp_attempts:{mobile_number}"
 
 def generate_otp(length: int = 6) -> str:
     """Generate a random OTP"""
-    return ''.join(random.choices(string.digits, k=length))
+    return ''.join(secrets.choice(string.digits) for _ in range(length))
 
 def store_otp(mobile_number: str, otp: str, expiration_minutes: int = 5):
-    """Store OTP in cache with expiration"""
-    key = f"otp:{mobile_number}"
-    cache_service.set(key, otp, expiration_minutes * 60)
+    """Store OTP in Redis with expiration, replacing any pending code"""
+    get_redis().set(_otp_key(mobile_number), otp, ex=expiration_minutes * 60)
 
 def verify_otp(mobile_number: str, otp: str) -> bool:
-    """Verify OTP from cache"""
-    key = f"otp:{mobile_number}"
-    stored_otp = cache_service.get(key)
-    if stored_otp and stored_otp == otp:
-        cache_service.delete(key)  # OTP used, remove it
-        return True
-    return False
+    """Atomically verify and consume an OTP"""
+    result = _verify_and_consume_script()(
+        keys=[_otp_key(mobile_number), _attempts_key(mobile_number)],
+        args=[otp, settings.OTP_MAX_ATTEMPTS, settings.OTP_LOCKOUT_MINUTES * 60]
+    )
+    if result == OTP_LOCKED:
+        RATE_LIMIT_REJECTIONS.labels("otp_verify").inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many invalid OTP attempts. Please try again later."
+        )
+    return result == OTP_VERIFIED
 
-def send_otp_sms(mobile_number: str, otp: str):
-    """Mock SMS sending - replace with actual SMS service"""
-    print(f"Sending OTP {otp} to {mobile_number}")
-    # In production, integrate with SMS service like Twilio
-    return True
\ No newline at end of file
+def send_otp_sms(mobile_number: str, otp: str, expiration_minutes: int = 5):
+    """Queue the OTP SMS for the delivery worker (app.tasks.sms_tasks); never sent once the code expired"""
+    try:
+        get_sms_queue().enqueue(
+            mobile_number,
+            f"Your verification code is {otp}",
+            expires_at=time.time() + expiration_minutes * 60
+        )
+        return True
+    except Exception as e:
+        print(f"SMS enqueue error: {e}")
+        return False
@@ -0,0 +1,45 @@
+"""State shared by the sub-requests of one POST /batch call
+
+While a batch runs, get_db/get_read_db hand every sub-request the batch's session,
+get_chat_db/get_chat_read_db reuse one session per shard, and the bearer token is verified
+and its user loaded once. Outside a batch current_batch() is None and nothing changes.
+"""
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+_current: ContextVar[Optional["RequestBatch"]] = ContextVar("request_batch", default=None)
+
+class RequestBatch:
+    def __init__(self, db, token: str):
+        self.db = db
+        self.token = token
+        self.user = None
+        self.payloads: Dict[str, Optional[dict]] = {}
+        self.chat_sessions: Dict[str, object] = {}
+        # Sub-requests resolve their sync dependencies on threadpool threads at the same time
+        self._lock = threading.Lock()
+
+    def chat_session(self, shard: str, open_session: Callable):
+        with self._lock:
+            if shard not in self.chat_sessions:
+                self.chat_sessions[shard] = open_session(shard)
+            return self.chat_sessions[shard]
+
+    def user_for(self, token: str):
+        """The batch's user for its own token, None for any other"""
+        return self.user if token == self.token else None
+
+    def close(self):
+        for session in self.chat_sessions.values():
+            session.close()
+        self.db.close()
+
+def current_batch() -> Optional[RequestBatch]:
+    return _current.get()
+
+def start_batch(batch: RequestBatch):
+    return _current.set(batch)
+
+def end_batch(token):
+    _current.reset(token)
@@ -0,0 +1,74 @@
+from typing import Optional
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import Status, StatusCode
+from sqlalchemy import event
+from ..config import settings
+
+tracer = trace.get_tracer("gemini_backend")
+
+# Populated when TRACING_EXPORTER=memory so tests can read finished spans
+memory_exporter: Optional[InMemorySpanExporter] = None
+_configured = False
+
+def configure_tracing(exporter_name: Optional[str] = None):
+    """Install the tracer provider once per process (API worker or Celery worker)"""
+    global memory_exporter, _configured
+    if _configured:
+        return
+    exporter_name = exporter_name or settings.TRACING_EXPORTER
+    if exporter_name == "none":
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}))
+    if exporter_name == "memory":
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _configured = True
+
+def inject_trace_context() -> dict:
+    """Serialize the current span context into carrier headers (traceparent/tracestate)"""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+def extract_trace_context(carrier: Optional[dict]):
+    """Rebuild a parent context from carrier headers"""
+    return propagate.extract(carrier or {})
+
+def record_exception(span, exc: Exception):
+    span.record_exception(exc)
+    span.set_status(Status(StatusCode.ERROR, str(exc)))
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span("db.query", kind=trace.SpanKind.CLIENT)
+    span.set_attribute("db.system", conn.engine.dialect.name)
+    span.set_attribute("db.statement", statement[:500])
+    context._trace_span = span
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, "_trace_span", None)
+    if span is not None:
+        span.end()
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, "_trace_span", None)
+    if span is not None:
+        record_exception(span, exception_context.original_exception)
+        span.end()
+
+def trace_engine(engine):
+    """Emit a span per SQL statement"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
@@ -0,0 +1,272 @@
+"""In-process load test for the whole API, with SQLite, fakeredis and stubbed externals
+
+Run from the repository root (needs ``httpx`` and ``fakeredis[lua]``; no network is used):
+
+    python -m benchmarks.api_load                         # run and compare with the baseline
+    python -m benchmarks.api_load --update-baseline       # record the current numbers
+    python -m benchmarks.api_load --scenario send_message_burst --concurrency 32
+
+Each scenario drives the ASGI app through httpx.ASGITransport and reports throughput and
+p50/p95/p99 per endpoint as JSON. Endpoints whose p95 grows (or throughput drops) by more
+than --tolerance relative to benchmarks/baseline.json are flagged and the exit code is 1.
+Gemini work runs on the scheduler's worker threads, so send_message latency excludes it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+from .stubs import configure_environment, install_stubs
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+PASSWORD = "bench-password"
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class Recorder:
+    """Latencies and status codes per endpoint label"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client, label: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[label].append((time.perf_counter() - start) * 1000)
+        self.statuses[label][response.status_code] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label, values in self.latencies.items():
+            values = sorted(values)
+            endpoints[label] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 0.50), 2),
+                "p95_ms": round(percentile(values, 0.95), 2),
+                "p99_ms": round(percentile(values, 0.99), 2),
+                "statuses": dict(self.statuses[label]),
+            }
+        return endpoints
+
+class Fixture:
+    """Seeded users (all Pro, so the daily limit does not skew the numbers) and their tokens"""
+
+    def __init__(self, users: int, history_rooms: int, history_messages: int):
+        from sqlalchemy import insert
+        from app.database import SessionLocal
+        from app.models.chatroom import Chatroom, Message
+        from app.models.user import User, SubscriptionTier, SubscriptionStatus
+        from app.utils.jwt_utils import create_access_token, get_password_hash
+
+        password_hash = get_password_hash(PASSWORD)  # bcrypt once, not per user
+        db = SessionLocal()
+        try:
+            self.users = []
+            for index in range(users):
+                user = User(
+                    mobile_number=f"+1555{index:07d}",
+                    password_hash=password_hash,
+                    subscription_tier=SubscriptionTier.PRO,
+                    subscription_status=SubscriptionStatus.ACTIVE
+                )
+                db.add(user)
+                self.users.append(user)
+            db.flush()
+
+            self.rooms = {}
+            for user in self.users:
+                room = Chatroom(user_id=user.id, title="bench")
+                db.add(room)
+                self.rooms[user.id] = room
+            db.flush()
+
+            # One heavy user with a long history for the listing scenario
+            self.heavy_user = self.users[0]
+            heavy_rooms = [Chatroom(user_id=self.heavy_user.id, title=f"history {i}") for i in range(history_rooms)]
+            db.add_all(heavy_rooms)
+            db.flush()
+            rows = [
+                {"chatroom_id": heavy_rooms[i % history_rooms].id, "content": f"message {i}",
+                 "gemini_response": "reply", "processing_status": "completed"}
+                for i in range(history_messages)
+            ] if history_rooms else []
+            if rows:
+                db.execute(insert(Message), rows)
+            for room in heavy_rooms:
+                room.message_count = history_messages // history_rooms
+            db.commit()
+
+            self.tokens = {user.id: create_access_token({"user_id": user.id}) for user in self.users}
+            self.mobiles = {user.id: user.mobile_number for user in self.users}
+            self.room_ids = {user_id: room.id for user_id, room in self.rooms.items()}
+            self.heavy_user_id = self.heavy_user.id
+        finally:
+            db.close()
+
+    def headers(self, user_id: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+async def _run_workers(concurrency: int, total: int, action: Callable):
+    """Run total actions with at most concurrency in flight"""
+    counter = iter(range(total))
+
+    async def worker():
+        for index in counter:
+            await action(index)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+# Each scenario builds an action(index) coroutine; index picks the user so load spreads out
+
+def login_storm(client, fixture: Fixture, recorder: Recorder) -> Callable:
+    user_ids = list(fixture.tokens)
+
+    async def action(index):
+        # The login limiter allows 5 attempts per number per 5 minutes, so cycle through users
+        mobile = fixture.mobiles[user_ids[index % len(user_ids)]]
+        await recorder.request(client, "POST /auth/login", "POST", "/auth/login",
+                               json={"mobile_number": mobile, "password": PASSWORD})
+    return action
+
+def send_message_burst(client, fixture: Fixture, recorder: Recorder) -> Callable:
+    user_ids = list(fixture.tokens)
+
+    async def action(index):
+        user_id = user_ids[index % len(user_ids)]
+        await recorder.request(
+            client, "POST /chatrooms/{id}/messages", "POST",
+            f"/chatrooms/{fixture.room_ids[user_id]}/messages",
+            json={"content": f"burst message {index}"}, headers=fixture.headers(user_id)
+        )
+    return action
+
+def poll_messages(client, fixture: Fixture, recorder: Recorder) -> Callable:
+    """Clients poll with the ETag they last saw, as the mobile app does"""
+    user_ids = list(fixture.tokens)
+    etags: Dict[int, str] = {}
+
+    async def action(index):
+        user_id = user_ids[index % len(user_ids)]
+        headers = fixture.headers(user_id)
+        if user_id in etags:
+            headers["If-None-Match"] = etags[user_id]
+        response = await recorder.request(
+            client, "GET /chatrooms/{id}/messages", "GET",
+            f"/chatrooms/{fixture.room_ids[user_id]}/messages", headers=headers
+        )
+        if "etag" in response.headers:
+            etags[user_id] = response.headers["etag"]
+    return action
+
+def list_large_history(client, fixture: Fixture, recorder: Recorder) -> Callable:
+    async def action(index):
+        await recorder.request(
+            client, "GET /chatrooms/", "GET", f"/chatrooms/?skip={(index % 10) * 20}&limit=20",
+            headers=fixture.headers(fixture.heavy_user_id)
+        )
+    return action
+
+def mixed(client, fixture: Fixture, recorder: Recorder) -> Callable:
+    """Roughly what a fleet of chat clients does: mostly polling, some sending, a few listings"""
+    rng = random.Random(7)
+    weighted = [(poll_messages, 6), (send_message_burst, 3), (list_large_history, 1)]
+    actions = [scenario(client, fixture, recorder) for scenario, _ in weighted]
+    weights = [weight for _, weight in weighted]
+
+    async def action(index):
+        await rng.choices(actions, weights)[0](rng.randrange(len(fixture.tokens)))
+    return action
+
+SCENARIOS = {
+    "login_storm": login_storm,
+    "send_message_burst": send_message_burst,
+    "poll_messages": poll_messages,
+    "list_large_history": list_large_history,
+    "mixed": mixed,
+}
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+
+    install_stubs(gemini_latency_ms=args.gemini_latency_ms)
+    results = {}
+    async with app.router.lifespan_context(app):
+        fixture = Fixture(args.users, args.history_rooms, args.history_messages)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenario or list(SCENARIOS):
+                recorder = Recorder()
+                start = time.perf_counter()
+                action = SCENARIOS[name](client, fixture, recorder)
+                total = min(args.requests, len(fixture.tokens) * 4) if name == "login_storm" else args.requests
+                await _run_workers(args.concurrency, total, action)
+                results[name] = recorder.summary(time.perf_counter() - start)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for scenario, endpoints in results.items():
+        for label, current in endpoints.items():
+            previous = baseline.get(scenario, {}).get(label)
+            if not previous:
+                continue
+            if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{scenario} {label}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+            if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+                regressions.append(
+                    f"{scenario} {label}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--history-rooms", type=int, default=200)
+    parser.add_argument("--history-messages", type=int, default=20000)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment()
+    results = asyncio.run(run(args))
+    report = json.dumps(results, indent=2, sort_keys=True)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(report + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline on a reference machine")
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
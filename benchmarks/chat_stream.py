@@ -0,0 +1,294 @@
+"""Per-chatroom ordering and parallelism of the partitioned chat stream workers, on SQLite
+
+Run from the repository root (needs ``fakeredis``; no network is used):
+
+    python -m benchmarks.chat_stream
+    python -m benchmarks.chat_stream --chatrooms 200 --messages 4000 --workers 4 --latency-ms 5
+
+Publishes bursts of messages to many chatrooms on an in-memory Redis stand-in and drains
+them with --workers ChatStreamWorker threads running the real handler (message claim,
+stub Gemini sleeping --latency-ms, persist). Mid-run one more worker joins (partitions
+rebalance) and one worker crashes in the middle of Gemini calls: its messages stay leased
+to it for --message-lease-seconds, longer than its partitions' --lease-seconds, and the
+new owners must wait for those leases rather than answer later messages first.
+
+Prints throughput and rebalance stats as JSON, and exits 1 unless: every message is
+answered once; each chatroom's messages are answered in the order they were sent; no
+partition is ever worked on by two workers at once; partitions really do run in parallel;
+and the crash caught at least one message mid-call.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from .stubs import StubGeminiService, configure_environment, install_stubs
+
+class RecordingGemini(StubGeminiService):
+    """Logs which prompt each Gemini call answers, in the order the calls started"""
+
+    def __init__(self, latency_ms: float):
+        super().__init__(latency_ms)
+        self.lock = threading.Lock()
+        self.prompts = []
+
+    def generate_response(self, prompt: str) -> str:
+        with self.lock:
+            self.prompts.append(prompt)
+        return super().generate_response(prompt)
+
+class Recorder:
+    """Wraps the handler and logs what ran where"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handled = []  # (message_id, partition, worker_id, start, end)
+        self.running = 0
+        self.max_running = 0
+
+    def handler_for(self, worker_id: str, stream):
+        from app.tasks.stream_tasks import process_entry
+
+        def handle(entry):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            start = time.monotonic()
+            try:
+                process_entry(entry)
+            finally:
+                end = time.monotonic()
+                with self.lock:
+                    self.running -= 1
+                    self.handled.append((entry["message_id"], stream.partition_for(entry["chatroom_id"]),
+                                         worker_id, start, end))
+        return handle
+
+def start_worker(stream_factory, recorder: Recorder, worker_id: str, threads: int, crashable: bool = False):
+    from app.database import SessionLocal
+    from app.services.message_lease import claim_message, claim_owner
+    from app.tasks.stream_tasks import ChatStreamWorker
+
+    stream = stream_factory()
+    worker = ChatStreamWorker(stream, recorder.handler_for(worker_id, stream), worker_id=worker_id, threads=threads)
+    worker.crashed = False
+    worker.dead = False
+    worker.died_holding = []
+    if crashable:
+        process = worker._process
+
+        def process_until_crash(partition, entries):
+            for entry_id, entry in entries:
+                if worker.crashed:
+                    # Dies mid-call: the message stays leased to it, the rest of the batch unacked
+                    worker.dead = True
+                    if entry is not None:
+                        db = SessionLocal()
+                        try:
+                            if claim_message(db, entry["message_id"], claim_owner()):
+                                worker.died_holding.append(entry["message_id"])
+                        finally:
+                            db.close()
+                    return
+                process(partition, [(entry_id, entry)])
+        worker._process = process_until_crash
+
+    def run():
+        worker.running = True
+        while worker.running and not worker.dead:
+            worker.run_once(block_ms=100)
+        if not worker.dead:
+            worker.shutdown()
+
+    thread = threading.Thread(target=run, name=worker_id, daemon=True)
+    thread.start()
+    return worker, thread
+
+def seed(chatrooms: int, messages: int, rng: random.Random) -> list:
+    """A user with that many chatrooms, and queued messages sent to them in bursts
+
+    Returns (chatroom id, message id, content) in the order the messages were sent.
+    """
+    from sqlalchemy import insert, select
+    from app.database import Base, SessionLocal, engine
+    from app.main import app  # noqa: F401  registers every model
+    from app.models.chatroom import Chatroom, Message
+    from app.models.user import User
+    from app.services.message_lease import lease_owner, pending_lease_expiry
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(mobile_number="+15559999002", password_hash="x")
+        db.add(user)
+        db.flush()
+        rooms = [Chatroom(user_id=user.id, title=f"stream {index}") for index in range(chatrooms)]
+        db.add_all(rooms)
+        db.flush()
+        room_ids = [room.id for room in rooms]
+        db.commit()
+
+        # Bursts: a chatroom's messages arrive back to back, interleaved with other rooms
+        order = []
+        while len(order) < messages:
+            chatroom_id = rng.choice(room_ids)
+            order += [chatroom_id] * min(rng.randint(1, 5), messages - len(order))
+        prefix = f"stream {user.id}:"
+        db.execute(insert(Message.__table__), [
+            {"chatroom_id": chatroom_id, "content": f"{prefix}{index}", "is_user_message": True,
+             "processing_status": "Pending..", "lease_owner": lease_owner(),
+             "lease_expires_at": pending_lease_expiry()}
+            for index, chatroom_id in enumerate(order)
+        ])
+        db.commit()
+        return db.execute(
+            select(Message.chatroom_id, Message.id, Message.content)
+            .where(Message.chatroom_id.in_(room_ids)).order_by(Message.id)
+        ).all()
+    finally:
+        db.close()
+
+def check(gemini: RecordingGemini, recorder: Recorder, sent: list, partitions: int, died_holding: list) -> list:
+    failures = []
+    by_content = {content: (chatroom_id, message_id) for chatroom_id, message_id, content in sent}
+    answered = [by_content[prompt] for prompt in gemini.prompts]
+    unanswered = len(by_content) - len({message_id for _, message_id in answered})
+    if unanswered:
+        failures.append(f"{unanswered} messages never answered")
+    if len(answered) != len(set(answered)):
+        failures.append(f"{len(answered) - len(set(answered))} messages answered twice")
+
+    per_chatroom = defaultdict(list)
+    for chatroom_id, message_id in answered:
+        per_chatroom[chatroom_id].append(message_id)
+    out_of_order = [chatroom_id for chatroom_id, ids in per_chatroom.items() if ids != sorted(ids)]
+    if out_of_order:
+        failures.append(f"{len(out_of_order)} chatrooms answered out of order, e.g. {out_of_order[0]}")
+
+    per_partition = defaultdict(list)
+    for _, partition, worker_id, start, end in recorder.handled:
+        per_partition[partition].append((start, end, worker_id))
+    overlaps = 0
+    for spans in per_partition.values():
+        spans.sort()
+        for (_, previous_end, _), (start, _, _) in zip(spans, spans[1:]):
+            if start < previous_end:
+                overlaps += 1
+    if overlaps:
+        failures.append(f"{overlaps} times a partition was worked on twice at once")
+    if recorder.max_running < 2 and partitions > 1:
+        failures.append("partitions never ran in parallel")
+    if not died_holding:
+        failures.append("the crash never caught a message mid-call")
+    return failures
+
+def run(args) -> tuple:
+    import fakeredis
+    from app import clients
+    from app.config import settings
+    from app.services.chat_stream import ChatStream
+    from app.tasks.celery_app import celery_app
+
+    install_stubs()
+    gemini = RecordingGemini(args.latency_ms)
+    clients._gemini_services[settings.GEMINI_MODEL] = gemini
+    celery_app.finalize()  # bind the tasks once, not racing in every thread
+    server = fakeredis.FakeServer()
+    reclaimed = []
+
+    class CountingStream(ChatStream):
+        def claim_pending(self, partition, worker_id, batch_size=100):
+            claimed = super().claim_pending(partition, worker_id, batch_size)
+            reclaimed.append(claimed)
+            return claimed
+
+    def stream_factory():
+        return CountingStream(fakeredis.FakeRedis(server=server), partitions=args.partitions,
+                              lease_seconds=args.lease_seconds)
+
+    publisher = stream_factory()
+    publisher.ensure_groups()
+    recorder = Recorder()
+    sent = seed(args.chatrooms, args.messages, random.Random(args.seed))
+
+    def publish(messages):
+        for chatroom_id, message_id, _ in messages:
+            publisher.publish(chatroom_id, message_id)
+
+    workers = [
+        start_worker(stream_factory, recorder, f"worker-{index}", args.threads, crashable=index == 0)
+        for index in range(args.workers)
+    ]
+    start = time.monotonic()
+    half = args.messages // 2
+    publish(sent[:half])
+
+    time.sleep(args.lease_seconds / 2)
+    joined = start_worker(stream_factory, recorder, f"worker-{args.workers}", args.threads)
+    crashed_worker, _ = workers[0]
+    crashed_partitions = len(crashed_worker.owned)
+    crashed_worker.crashed = True  # dies on the next entry it starts
+    publish(sent[half:])
+
+    deadline = time.monotonic() + args.timeout
+    while len(set(gemini.prompts)) < args.messages and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start
+    survivors = [worker for worker, _ in workers[1:]] + [joined[0]]
+    owned_at_end = {worker.worker_id: len(worker.owned) for worker in survivors}
+    for worker in survivors:
+        worker.stop()
+    for _, thread in workers[1:] + [joined]:
+        thread.join(timeout=10)
+
+    report = {
+        "messages": args.messages,
+        "chatrooms": args.chatrooms,
+        "partitions": args.partitions,
+        "seconds": round(elapsed, 3),
+        "messages_per_s": round(args.messages / elapsed),
+        "serial_messages_per_s": round(1000 / args.latency_ms) if args.latency_ms else None,
+        "max_parallel_handlers": recorder.max_running,
+        "redelivered": len(recorder.handled) - len({row[0] for row in recorder.handled}),
+        "crashed_worker_partitions": crashed_partitions,
+        "died_holding_messages": len(crashed_worker.died_holding),
+        "reclaimed_entries": sum(reclaimed),
+        "partitions_owned_at_end": owned_at_end,
+    }
+    return report, check(gemini, recorder, sent, args.partitions, crashed_worker.died_holding)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chatrooms", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=8, help="partitions one worker processes at once")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated Gemini call")
+    parser.add_argument("--lease-seconds", type=int, default=2, help="partition lease")
+    parser.add_argument("--message-lease-seconds", type=int, default=4, help="claimed message lease")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment(extra={
+        "CHAT_STREAM_HEARTBEAT_SECONDS": str(args.lease_seconds / 5),
+        "MESSAGE_LEASE_SECONDS": str(args.message_lease_seconds),
+        "GEMINI_TOKENS_PER_MINUTE": str(10**9),  # measure the stream, not the budget
+    })
+    report, failures = run(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Import-time budget check for the API, based on ``python -X importtime``
+
+Run from the repository root:
+
+    python -m benchmarks.import_time --budget-ms 1000
+
+Fails (exit 1) when importing ``app.main`` exceeds the budget or pulls in an SDK
+that must only be loaded lazily from the lifespan hook. The test suite checks only the
+lazy imports (tests/test_import_time.py); wall-clock timing is left to this script. Most
+of the ~650-800 ms the tree takes today is FastAPI (with its pydantic.v1 probe) and
+SQLAlchemy themselves.
+"""
+import argparse
+import subprocess
+import sys
+
+# Must stay out of the import graph of app.main
+LAZY_MODULES = ("google.generativeai", "stripe", "celery", "pyinstrument", "redis")
+BUDGET_MS = 1000.0
+
+def measure(module: str = "app.main") -> dict:
+    """Return {module: (self_us, cumulative_us)} for a fresh interpreter importing module"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+def check(timings: dict, module: str = "app.main", budget_ms: float = BUDGET_MS) -> list:
+    """Reasons the import is too slow or too eager; empty when it is fine"""
+    failures = []
+    total_ms = timings[module][1] / 1000
+    if total_ms > budget_ms:
+        failures.append(f"import took {total_ms:.1f} ms, over the {budget_ms:.0f} ms budget")
+    for name in LAZY_MODULES:
+        if name in timings:
+            failures.append(f"{name} is imported eagerly")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    timings = measure(args.module)
+    total_ms = timings[args.module][1] / 1000
+    print(f"{args.module}: {total_ms:.1f} ms cumulative (budget {args.budget_ms:.0f} ms)")
+    for name, (_, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = check(timings, args.module, args.budget_ms)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Recovery of messages stuck in Pending../processing after a crash, on SQLite
+
+Run from the repository root (needs ``fakeredis``; no network or broker is used):
+
+    python -m benchmarks.lease_recovery
+    python -m benchmarks.lease_recovery --stuck 100000 --sweepers 4 --batch-size 1000
+
+Seeds --stuck messages a dead process left behind (expired ``processing`` leases, expired
+``Pending..`` leases, and pre-lease rows with none) next to live-leased and completed ones.
+Then:
+
+1. --sweepers threads run take_over_expired concurrently until nothing is left, timed as
+   recovered rows per second; every stuck message must be taken exactly once.
+2. Each recovered message is delivered twice at once (the sweeper's re-enqueue racing a
+   redelivery of the original task) to process_gemini_message with a stub Gemini, which
+   must be called exactly once per message.
+3. The recover_expired_leases beat task runs (Celery eager mode) over a second, smaller
+   crash and must leave every message answered.
+
+Prints the results as JSON and exits 1 if any check fails or live leases were touched.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from .stubs import configure_environment, install_stubs
+
+STATES = ("processing", "pending", "legacy")
+
+def seed(chatroom_id: int, stuck: int, live: int, completed: int) -> dict:
+    """Insert the rows; returns {kind: [ids]}"""
+    from sqlalchemy import insert, select
+    from app.database import SessionLocal
+    from app.models.chatroom import Message
+
+    now = datetime.now(tz=timezone.utc)
+    long_ago = now - timedelta(hours=1)
+    rows = []
+
+    def add(content, status, owner=None, expires=None, response=None):
+        # executemany needs the same keys in every row
+        rows.append({"chatroom_id": chatroom_id, "content": content, "is_user_message": True,
+                     "created_at": long_ago, "processing_status": status, "lease_owner": owner,
+                     "lease_expires_at": expires, "gemini_response": response})
+
+    for index in range(stuck):
+        state = STATES[index % len(STATES)]
+        if state == "legacy":
+            add(f"stuck {index}", "Pending..")
+        else:
+            add(f"stuck {index}", "processing" if state == "processing" else "Pending..", "dead-host:1", long_ago)
+    for index in range(live):
+        add(f"live {index}", "processing", "live-host:1", now + timedelta(hours=1))
+    for index in range(completed):
+        add(f"done {index}", "completed", response="reply")
+
+    db = SessionLocal()
+    try:
+        db.execute(insert(Message.__table__), rows)
+        db.commit()
+        ids = {"stuck": [], "live": [], "completed": []}
+        for message_id, content in db.execute(
+            select(Message.id, Message.content).where(Message.chatroom_id == chatroom_id)
+        ):
+            ids[{"stuck": "stuck", "live": "live", "done": "completed"}[content.split()[0]]].append(message_id)
+        return ids
+    finally:
+        db.close()
+
+def sweep(sweepers: int, batch_size: int) -> tuple:
+    """Concurrent take_over_expired loops; returns (ids per sweeper, seconds)"""
+    from app.database import SessionLocal
+    from app.services.message_lease import take_over_expired
+
+    taken = [[] for _ in range(sweepers)]
+    barrier = threading.Barrier(sweepers)
+
+    def run(index):
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            while True:
+                recovered = take_over_expired(db, f"sweeper-{index}", batch_size)
+                taken[index] += [message_id for message_id, _ in recovered]
+                if not recovered:
+                    return
+        finally:
+            db.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(sweepers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return taken, time.perf_counter() - start
+
+def statuses(message_ids) -> dict:
+    from collections import Counter
+    from sqlalchemy import select
+    from app.database import SessionLocal
+    from app.models.chatroom import Message
+
+    db = SessionLocal()
+    try:
+        found = Counter()
+        for offset in range(0, len(message_ids), 500):
+            chunk = message_ids[offset:offset + 500]
+            found.update(db.execute(
+                select(Message.processing_status).where(Message.id.in_(chunk))
+            ).scalars())
+        return dict(found)
+    finally:
+        db.close()
+
+def live_leases_intact(message_ids) -> bool:
+    from sqlalchemy import func, select
+    from app.database import SessionLocal
+    from app.models.chatroom import Message
+
+    db = SessionLocal()
+    try:
+        return db.execute(select(func.count()).where(
+            Message.id.in_(message_ids),
+            Message.processing_status == "processing",
+            Message.lease_owner == "live-host:1"
+        )).scalar() == len(message_ids)
+    finally:
+        db.close()
+
+def run(args) -> tuple:
+    from app import clients
+    from app.config import settings
+    from app.database import Base, SessionLocal, engine
+    from app.main import app  # noqa: F401  registers every model
+    from app.models.chatroom import Chatroom
+    from app.models.user import User
+    from app.tasks.celery_app import celery_app
+    from app.tasks.gemini_tasks import process_gemini_message, recover_expired_leases
+
+    install_stubs()
+    gemini = clients._gemini_services[settings.GEMINI_MODEL]
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(mobile_number="+15559999001", password_hash="x")
+        db.add(user)
+        db.flush()
+        room = Chatroom(user_id=user.id, title="crash")
+        db.add(room)
+        db.commit()
+        room_id = room.id
+    finally:
+        db.close()
+
+    failures = []
+    ids = seed(room_id, args.stuck, args.live, args.completed)
+
+    # 1. Concurrent sweepers
+    taken, sweep_seconds = sweep(args.sweepers, args.batch_size)
+    recovered = [message_id for part in taken for message_id in part]
+    if len(recovered) != len(set(recovered)):
+        failures.append(f"{len(recovered) - len(set(recovered))} messages taken by two sweepers")
+    if set(recovered) != set(ids["stuck"]):
+        failures.append(f"sweepers took {len(set(recovered))} messages, {len(ids['stuck'])} were stuck")
+
+    # 2. Duplicate deliveries of every recovered message
+    celery_app.finalize()  # bind the tasks once, not racing in every thread
+    calls_before = gemini.calls
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        list(pool.map(lambda message_id: process_gemini_message(message_id), recovered + recovered))
+    process_seconds = time.perf_counter() - start
+    gemini_calls = gemini.calls - calls_before
+    if gemini_calls != len(set(recovered)):
+        failures.append(f"{gemini_calls} Gemini calls for {len(set(recovered))} recovered messages")
+    done = statuses(ids["stuck"])
+    if done != {"completed": len(ids["stuck"])}:
+        failures.append(f"recovered messages ended as {done}")
+
+    # 3. The beat task, end to end
+    celery_app.conf.task_always_eager = True
+    second = seed(room_id, args.stuck // 10, 0, 0)["stuck"]
+    second = sorted(set(second) - set(ids["stuck"]))
+    calls_before = gemini.calls
+    recover_expired_leases(batch_size=args.batch_size, max_batches=len(second) // args.batch_size + 2)
+    if gemini.calls - calls_before != len(second):
+        failures.append(f"recover_expired_leases: {gemini.calls - calls_before} Gemini calls for {len(second)} messages")
+    done = statuses(second)
+    if done != {"completed": len(second)}:
+        failures.append(f"recover_expired_leases left messages as {done}")
+
+    if not live_leases_intact(ids["live"]):
+        failures.append("live leases were taken over")
+    if statuses(ids["completed"]) != {"completed": len(ids["completed"])}:
+        failures.append("completed messages were touched")
+
+    report = {
+        "stuck": len(ids["stuck"]),
+        "sweepers": args.sweepers,
+        "batch_size": args.batch_size,
+        "sweep_seconds": round(sweep_seconds, 3),
+        "recovered_per_s": round(len(recovered) / sweep_seconds) if sweep_seconds else None,
+        "taken_per_sweeper": [len(part) for part in taken],
+        "duplicate_deliveries": len(recovered),
+        "gemini_calls": gemini_calls,
+        "processed_per_s": round(len(recovered) * 2 / process_seconds) if process_seconds else None,
+        "beat_task_recovered": len(second),
+    }
+    return report, failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stuck", type=int, default=5000)
+    parser.add_argument("--live", type=int, default=1000)
+    parser.add_argument("--completed", type=int, default=5000)
+    parser.add_argument("--sweepers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8, help="threads delivering messages in step 2")
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment()
+    report, failures = run(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
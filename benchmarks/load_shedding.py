@@ -0,0 +1,151 @@
+"""Load shedding under injected event-loop stalls
+
+Run from the repository root (needs ``httpx`` and ``fakeredis[lua]``; no network is used):
+
+    python -m benchmarks.load_shedding
+    python -m benchmarks.load_shedding --stall-ms 400 --stall-every-ms 100 --requests 600
+
+Drives the ASGI app in-process with Basic-tier and Pro-tier polls (single GETs and POST
+/batch) on a healthy loop, then
+adds logins while a background task blocks the loop with time.sleep() (standing in for
+sync ORM calls or a slow Gemini fallback). Logins stay out of the healthy phase: their
+bcrypt hashing runs on the loop and is itself enough lag to shed Basic polls.
+
+Prints status counts per traffic class and phase as JSON, and exits 1 unless: nothing is
+shed on the healthy loop; Basic polls and batches are shed (503 + Retry-After) under
+stalls; Pro polls and logins never are.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from .stubs import configure_environment, install_stubs
+
+async def _stall_loop(stall_seconds: float, every_seconds: float, stop: asyncio.Event):
+    while not stop.is_set():
+        await asyncio.sleep(every_seconds)
+        time.sleep(stall_seconds)  # deliberately blocks the event loop
+
+async def run_phase(client, fixture, args, stalled: bool) -> dict:
+    from .api_load import PASSWORD, _run_workers
+
+    user_ids = list(fixture.tokens)
+    basic_ids = user_ids[:len(user_ids) // 2]
+    pro_ids = user_ids[len(user_ids) // 2:]
+    counts = defaultdict(lambda: defaultdict(int))
+    missing_retry_after = 0
+
+    async def action(index):
+        nonlocal missing_retry_after
+        if stalled and index % 10 == 0:
+            kind = "login"
+            user_id = user_ids[index // 10 % len(user_ids)]
+            response = await client.post("/auth/login", json={
+                "mobile_number": fixture.mobiles[user_id], "password": PASSWORD
+            })
+        else:
+            tier = "basic" if index % 2 else "pro"
+            group = basic_ids if tier == "basic" else pro_ids
+            user_id = group[index % len(group)]
+            headers = {"Authorization": f"Bearer {fixture.tokens[user_id]}"}
+            path = f"/chatrooms/{fixture.room_ids[user_id]}/messages"
+            if index % 4 in (0, 1):
+                kind = f"{tier}_poll"
+                response = await client.get(path, headers=headers)
+            else:
+                kind = f"{tier}_batch"
+                response = await client.post("/batch", headers=headers, json={"requests": [
+                    {"method": "GET", "path": "/users/profile"}, {"method": "GET", "path": path}
+                ]})
+        counts[kind][response.status_code] += 1
+        if response.status_code == 503 and "retry-after" not in response.headers:
+            missing_retry_after += 1
+
+    stop = asyncio.Event()
+    stall_task = None
+    if stalled:
+        stall_task = asyncio.create_task(_stall_loop(args.stall_ms / 1000, args.stall_every_ms / 1000, stop))
+    try:
+        await _run_workers(args.concurrency, args.requests, action)
+    finally:
+        stop.set()
+        if stall_task is not None:
+            await stall_task
+    return {
+        "statuses": {kind: dict(statuses) for kind, statuses in counts.items()},
+        "missing_retry_after": missing_retry_after,
+    }
+
+async def run(args) -> dict:
+    import httpx
+    from app.database import SessionLocal
+    from app.main import app
+    from app.models.user import SubscriptionTier, User
+    from .api_load import Fixture
+
+    install_stubs()
+    async with app.router.lifespan_context(app):
+        fixture = Fixture(args.users, history_rooms=0, history_messages=0)
+        basic_ids = list(fixture.tokens)[:args.users // 2]
+        db = SessionLocal()
+        try:
+            db.query(User).filter(User.id.in_(basic_ids)).update(
+                {User.subscription_tier: SubscriptionTier.BASIC}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            # Every user is seen once, so the shedder knows their tier
+            for user_id, token in fixture.tokens.items():
+                await client.get("/users/profile", headers={"Authorization": f"Bearer {token}"})
+            await asyncio.sleep(0.5)  # let the lag estimate settle after startup
+            healthy = await run_phase(client, fixture, args, stalled=False)
+            stalled = await run_phase(client, fixture, args, stalled=True)
+    return {"healthy": healthy, "stalled": stalled}
+
+def check(report: dict) -> list:
+    failures = []
+    healthy, stalled = report["healthy"]["statuses"], report["stalled"]["statuses"]
+    for kind, statuses in healthy.items():
+        if statuses.get(503):
+            failures.append(f"healthy loop: {statuses[503]} {kind} requests shed")
+    for kind in ("basic_poll", "basic_batch"):
+        if not stalled.get(kind, {}).get(503):
+            failures.append(f"stalled loop: no {kind} requests were shed")
+    for kind in ("pro_poll", "pro_batch", "login"):
+        if stalled.get(kind, {}).get(503):
+            failures.append(f"stalled loop: {stalled[kind][503]} {kind} requests shed")
+    if report["stalled"]["missing_retry_after"]:
+        failures.append("503 responses without Retry-After")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=400, help="per phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stall-ms", type=float, default=300)
+    parser.add_argument("--stall-every-ms", type=float, default=100)
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment(extra={"LOAD_SHED_ENABLED": "true"})
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    failures = check(report)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Storage size and read latency of message text: plain Text vs CompressedText
+
+Run from the repository root (needs ``zstandard`` for the zstd modes):
+
+    python -m benchmarks.message_compression
+    python -m benchmarks.message_compression --messages 20000 --reads 5000
+
+Writes the same synthetic chat history (short prompts, long markdown-ish replies) into a
+separate SQLite file per mode: plain Text, zlib, zstd, and zstd with a dictionary trained
+on a sample of the replies. Reports stored bytes, file size after VACUUM, insert rate and
+p50/p95 latency of reading one message by id, as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from .api_load import percentile
+from .stubs import configure_environment
+
+TOPICS = ["database indexing", "async IO", "rate limiting", "caching", "unit testing", "deployment",
+          "message queues", "authentication", "schema migrations", "observability"]
+PHRASES = [
+    "Here is a step-by-step explanation of how {topic} works in practice.",
+    "First, consider the trade-offs between latency and throughput when applying {topic}.",
+    "A common mistake with {topic} is to optimize before measuring the actual bottleneck.",
+    "```python\ndef example(items):\n    return [item for item in items if item.ready]\n```",
+    "In summary, {topic} is most effective when combined with good monitoring.",
+    "- **Pros:** simpler code, predictable behaviour\n- **Cons:** more memory, harder to tune",
+    "You can verify the behaviour by running the benchmark again with a larger data set.",
+    "Let me know if you would like a more detailed example of {topic} for your use case.",
+]
+
+def synthetic_history(count: int, rng: random.Random):
+    """(prompt, reply) pairs: prompts are short, replies run to a few KB like LLM answers"""
+    history = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        prompt = f"Can you explain {topic} with an example? ({rng.randint(1, 10 ** 6)})"
+        paragraphs = [rng.choice(PHRASES).format(topic=topic) for _ in range(rng.randint(8, 40))]
+        paragraphs.append(f"Reference id {rng.getrandbits(64):x}.")
+        history.append((prompt, "\n\n".join(paragraphs)))
+    return history
+
+def configure_mode(mode: str, dictionary_path: str):
+    from app.config import settings
+    from app.models import types
+
+    settings.MESSAGE_COMPRESSION_DICT_PATH = dictionary_path if mode == "zstd_dict" else None
+    # zlib mode takes the same path as a deployment without zstandard installed
+    types._zstd = (lambda: None) if mode == "zlib" else _real_zstd
+    types.reset_codecs()
+
+def measure(mode: str, history, args, workdir: str, dictionary_path: str) -> dict:
+    from sqlalchemy import Column, Integer, MetaData, Table, Text, create_engine, func, select, type_coerce
+    from sqlalchemy.types import NullType
+    from app.models.types import CompressedText
+
+    configure_mode(mode, dictionary_path)
+    path = os.path.join(workdir, f"{mode}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    text_type = Text if mode == "plain" else CompressedText
+    table = Table("messages", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("content", text_type), Column("gemini_response", text_type))
+    table.create(engine)
+
+    rows = [{"id": index + 1, "content": prompt, "gemini_response": reply}
+            for index, (prompt, reply) in enumerate(history)]
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+    insert_seconds = time.perf_counter() - start
+
+    with engine.connect() as connection:
+        stored = connection.execute(select(
+            func.sum(func.length(type_coerce(table.c.content, NullType()))) +
+            func.sum(func.length(type_coerce(table.c.gemini_response, NullType())))
+        )).scalar()
+        rng = random.Random(args.seed)
+        latencies = []
+        for _ in range(args.reads):
+            message_id = rng.randint(1, len(history))
+            start = time.perf_counter()
+            row = connection.execute(select(table).where(table.c.id == message_id)).one()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if row.gemini_response != history[message_id - 1][1]:
+                raise AssertionError(f"{mode}: message {message_id} did not round-trip")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        "stored_bytes": stored,
+        "file_bytes": os.path.getsize(path),
+        "insert_rows_per_s": round(len(rows) / insert_seconds),
+        "read_p50_ms": round(percentile(latencies, 0.50), 4),
+        "read_p95_ms": round(percentile(latencies, 0.95), 4),
+    }
+
+def train_dictionary(history, workdir: str, samples: int) -> str:
+    import zstandard
+
+    dictionary = zstandard.train_dictionary(112640, [reply.encode("utf-8") for _, reply in history[:samples]])
+    path = os.path.join(workdir, "message.dict")
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    return path
+
+def main():
+    global _real_zstd
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--dictionary-samples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment()
+    from app.models import types
+
+    _real_zstd = types._zstd
+    modes = ["plain", "zlib"]
+    workdir = tempfile.mkdtemp(prefix="message-compression-")
+    history = synthetic_history(args.messages, random.Random(args.seed))
+    dictionary_path = None
+    if _real_zstd() is not None:
+        modes += ["zstd", "zstd_dict"]
+        dictionary_path = train_dictionary(history, workdir, args.dictionary_samples)
+    else:
+        print("zstandard is not installed; measuring plain and zlib only", file=sys.stderr)
+
+    report = {}
+    for mode in modes:
+        report[mode] = measure(mode, history, args, workdir, dictionary_path)
+        print(f"{mode}: {report[mode]['stored_bytes']} bytes stored", file=sys.stderr)
+    plain = report["plain"]["stored_bytes"] or 1
+    for result in report.values():
+        result["ratio"] = round(plain / (result["stored_bytes"] or 1), 2)
+
+    output = json.dumps({"messages": args.messages, "modes": report}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
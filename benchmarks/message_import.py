@@ -0,0 +1,98 @@
+"""Throughput of the bulk conversation import (POST /chatrooms/import) on SQLite
+
+Run from the repository root (needs ``httpx`` and ``fakeredis[lua]``; no network is used):
+
+    python -m benchmarks.message_import
+    python -m benchmarks.message_import --messages 500000 --min-rate 50000
+
+Streams a synthetic NDJSON history through the ASGI app in --chunk-bytes pieces and
+reports imported messages per second (end to end: parsing, validation, batched inserts
+and the final commit) as JSON. Exits 1 if the rate is below --min-rate. Then checks that
+the room's counters and a page of messages read back as expected.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from .stubs import configure_environment, install_stubs
+
+def synthetic_ndjson(count: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    lines = []
+    for index in range(count):
+        record = {
+            "content": f"Question {index}: how do I tune setting {rng.randint(1, 500)}?",
+            "created_at": (start + timedelta(seconds=index * 30)).isoformat(),
+        }
+        if index % 20:
+            record["gemini_response"] = f"Set it to {rng.randint(1, 100)} and measure again. " * rng.randint(1, 4)
+        lines.append(json.dumps(record))
+    return ("\n".join(lines) + "\n").encode()
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+    from .api_load import Fixture
+
+    install_stubs()
+    body = synthetic_ndjson(args.messages, args.seed)
+
+    async def chunks():
+        for offset in range(0, len(body), args.chunk_bytes):
+            yield body[offset:offset + args.chunk_bytes]
+
+    async with app.router.lifespan_context(app):
+        fixture = Fixture(1, history_rooms=0, history_messages=0)
+        user_id = next(iter(fixture.tokens))
+        headers = {"Authorization": f"Bearer {fixture.tokens[user_id]}", "Content-Type": "application/x-ndjson"}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300.0) as client:
+            start = time.perf_counter()
+            response = await client.post("/chatrooms/import", params={"title": "imported"},
+                                         content=chunks(), headers=headers)
+            elapsed = time.perf_counter() - start
+            response.raise_for_status()
+            result = response.json()
+
+            page = await client.get(f"/chatrooms/{result['chatroom_id']}/messages",
+                                    params={"limit": 5}, headers=headers)
+            page.raise_for_status()
+            messages = page.json()
+
+    if result["imported"] != args.messages or result["message_count"] != args.messages:
+        raise AssertionError(f"imported {result}, expected {args.messages}")
+    if [message["content"].split(":")[0] for message in messages] != [f"Question {i}" for i in range(5)]:
+        raise AssertionError("history did not read back in order")
+    return {
+        "messages": args.messages,
+        "body_bytes": len(body),
+        "seconds": round(elapsed, 3),
+        "messages_per_s": round(args.messages / elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--chunk-bytes", type=int, default=65536)
+    parser.add_argument("--min-rate", type=float, default=50000, help="messages/second required")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args()
+
+    configure_environment(extra={"MESSAGE_IMPORT_MAX_MESSAGES": str(max(args.messages, 200000))})
+    result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if result["messages_per_s"] < args.min_rate:
+        print(f"Below the required {args.min_rate:.0f} messages/s", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
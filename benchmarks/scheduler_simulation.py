@@ -0,0 +1,162 @@
+"""Discrete-event simulation of the Gemini fair scheduler under synthetic load
+
+Run from the repository root (pure Python, no services needed):
+
+    python -m benchmarks.scheduler_simulation
+    python -m benchmarks.scheduler_simulation --pattern flood --duration 600 --workers 4
+
+Drives app.services.gemini_scheduler.FairScheduler with a simulated clock, Poisson
+arrivals per tier and simulated Gemini latency, then prints per-tier queue waits,
+rejections and per-user service shares as JSON. Exits 1 if a property fails: admitted
+work must not wait longer than --max-wait-seconds (p99, every tier), Pro waits must stay
+below Basic waits under contention, and a flooding user must not get more than its fair
+share of the Basic tier.
+"""
+import argparse
+import heapq
+import json
+import random
+import sys
+from collections import defaultdict
+from typing import Dict, List
+from app.services.gemini_scheduler import AdmissionRejected, FairScheduler, TokenBudget
+from .api_load import percentile
+
+FLOOD_USER = 10_000
+
+def arrivals(pattern: str, duration: float, rng: random.Random):
+    """Yield (time, user_id, tier, tokens) sorted by time"""
+    streams = [
+        # (tier, users, messages per second across the tier)
+        ("pro", range(1, 21), 2.0),
+        ("basic", range(100, 400), 4.0),
+    ]
+    if pattern in ("flood", "mixed"):
+        streams.append(("basic", [FLOOD_USER], 6.0))
+    events = []
+    for tier, users, rate in streams:
+        users = list(users)
+        now = 0.0
+        while True:
+            now += rng.expovariate(rate)
+            if now >= duration:
+                break
+            events.append((now, rng.choice(users), tier, int(rng.lognormvariate(6.2, 0.5))))
+    if pattern in ("burst", "mixed"):
+        # Every Basic user taps "send" within the same ten seconds
+        start = duration / 3
+        for user_id in range(100, 400):
+            events.append((start + rng.uniform(0, 10), user_id, "basic", int(rng.lognormvariate(6.2, 0.5))))
+    return sorted(events)
+
+def simulate(args) -> dict:
+    rng = random.Random(args.seed)
+    clock = [0.0]
+    scheduler = FairScheduler(
+        {"pro": 8, "basic": 1, "free": 1},
+        TokenBudget(args.tokens_per_minute, clock=lambda: clock[0]),
+        max_queue_per_tier=args.max_queue_per_tier,
+        max_pending_per_user=args.max_pending_per_user,
+        max_wait_seconds=args.max_wait_seconds,
+        workers=args.workers,
+        clock=lambda: clock[0]
+    )
+
+    waits: Dict[str, List[float]] = defaultdict(list)
+    rejections: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    served_tokens: Dict[int, int] = defaultdict(int)
+    tiers_by_user: Dict[int, str] = {}
+    idle_workers = args.workers
+    events = []  # (time, order, kind, job)
+    order = 0
+
+    def push(at, kind, job=None):
+        nonlocal order
+        order += 1
+        heapq.heappush(events, (at, order, kind, job))
+
+    for at, user_id, tier, tokens in arrivals(args.pattern, args.duration, rng):
+        push(at, "arrival", (user_id, tier, tokens))
+
+    def dispatch():
+        nonlocal idle_workers
+        while idle_workers:
+            job = scheduler.next_job()
+            if job is None:
+                if any(scheduler.queued_jobs.values()):
+                    push(clock[0] + min(1.0, scheduler.budget.retry_after()), "wake")
+                return
+            idle_workers -= 1
+            waits[job.tier].append(clock[0] - job.enqueued_at)
+            served_tokens[job.user_id] += job.cost
+            # Gemini latency grows with output size, with a heavy tail
+            latency = 0.4 + job.cost / 2000 + rng.expovariate(4.0)
+            push(clock[0] + latency, "done", job)
+
+    while events:
+        clock[0], _, kind, payload = heapq.heappop(events)
+        if kind == "arrival":
+            user_id, tier, tokens = payload
+            tiers_by_user[user_id] = tier
+            try:
+                job = scheduler.admit(user_id, tier, tokens)
+            except AdmissionRejected as e:
+                rejections[tier][e.reason] += 1
+            else:
+                scheduler.enqueue(job)
+        elif kind == "done":
+            scheduler.complete(payload)
+            idle_workers += 1
+        dispatch()
+
+    report = {"pattern": args.pattern, "max_wait_s": args.max_wait_seconds, "tiers": {}}
+    for tier in ("pro", "basic"):
+        tier_waits = sorted(waits[tier])
+        report["tiers"][tier] = {
+            "served": len(waits[tier]),
+            "rejected": dict(rejections[tier]),
+            "wait_p50_s": round(percentile(tier_waits, 0.50), 3),
+            "wait_p95_s": round(percentile(tier_waits, 0.95), 3),
+            "wait_p99_s": round(percentile(tier_waits, 0.99), 3),
+        }
+    basic_users = [user for user, tier in tiers_by_user.items() if tier == "basic" and served_tokens[user]]
+    basic_total = sum(served_tokens[user] for user in basic_users) or 1
+    report["flood_user_basic_share"] = round(served_tokens[FLOOD_USER] / basic_total, 4)
+    report["basic_users_served"] = len(basic_users)
+    return report
+
+def check(report: dict) -> List[str]:
+    failures = []
+    for tier, stats in report["tiers"].items():
+        if stats["wait_p99_s"] > report["max_wait_s"]:
+            failures.append(f"{tier} p99 wait {stats['wait_p99_s']}s is over the {report['max_wait_s']}s admission bound")
+    pro, basic = report["tiers"]["pro"], report["tiers"]["basic"]
+    if basic["wait_p95_s"] > 1.0 and pro["wait_p95_s"] >= basic["wait_p95_s"]:
+        failures.append(f"pro p95 wait {pro['wait_p95_s']}s is not below basic {basic['wait_p95_s']}s")
+    if report["pattern"] in ("flood", "mixed"):
+        # The flooder is held to max_pending_per_user; with fair rotation it should get far
+        # less than the 60% of Basic demand it generates
+        if report["flood_user_basic_share"] > 0.25:
+            failures.append(f"flooding user got {report['flood_user_basic_share']:.0%} of basic throughput")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pattern", choices=("steady", "flood", "burst", "mixed"), default="mixed")
+    parser.add_argument("--duration", type=float, default=300.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tokens-per-minute", type=int, default=250_000)
+    parser.add_argument("--max-queue-per-tier", type=int, default=1000)
+    parser.add_argument("--max-pending-per-user", type=int, default=10)
+    parser.add_argument("--max-wait-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    report = simulate(args)
+    failures = check(report)
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Offline stand-ins for external services, installed into the lazy client slots of app.clients
+
+Call ``configure_environment`` before anything imports ``app``, then ``install_stubs`` once
+the app is imported. Nothing here opens a network connection.
+"""
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+def configure_environment(workdir: Optional[str] = None, extra: Optional[dict] = None) -> str:
+    """Point settings at a throwaway SQLite database; returns the working directory"""
+    workdir = workdir or tempfile.mkdtemp(prefix="gemini-bench-")
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "DATABASE_REPLICA_URLS": "[]",
+        "REDIS_URL": "redis://stub",
+        "JWT_SECRET_KEY": "bench-secret",
+        "GEMINI_API_KEY": "stub",
+        "STRIPE_SECRET_KEY": "sk_test_stub",
+        "STRIPE_WEBHOOK_SECRET": "whsec_stub",
+        "SMS_PROVIDER": "fake",
+        "SMS_FAKE_OUTBOX_PATH": os.path.join(workdir, "sms_outbox.jsonl"),
+        "TRACING_EXPORTER": "none",
+        "PROFILING_ENABLED": "false",
+        "AUTO_CREATE_SCHEMA": "true",
+    }
+    env.update(extra or {})
+    os.environ.update(env)
+    return workdir
+
+class StubGeminiService:
+    """Answers instantly (or after latency_ms) with a canned reply"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def generate(self, prompt: str):
+        from app.services.gemini_service import GeminiResult
+
+        return GeminiResult(
+            text=self.generate_response(prompt),
+            model="stub",
+            prompt_tokens=len(prompt) // 4 + 1,
+            response_tokens=8,
+            latency_ms=self.latency_ms
+        )
+
+    def generate_response(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return f"stub reply to {len(prompt)} chars"
+
+    def generate_chat_response(self, message: str, context: str = "") -> str:
+        return self.generate_response(message)
+
+class _StubResource:
+    def __init__(self, factory):
+        self._factory = factory
+
+    def create(self, params=None, **kwargs):
+        return self._factory(params or {})
+
+    def retrieve(self, object_id, **kwargs):
+        return self._factory({"id": object_id})
+
+    def cancel(self, object_id, **kwargs):
+        return self._factory({"id": object_id, "status": "canceled"})
+
+    def list(self, params=None, **kwargs):
+        return SimpleNamespace(data=[], has_more=False)
+
+class StubStripeClient:
+    """Just enough of stripe.StripeClient for checkout and subscription calls"""
+
+    def __init__(self):
+        self.checkout = SimpleNamespace(sessions=_StubResource(
+            lambda params: SimpleNamespace(id="cs_stub", url="https://checkout.invalid/cs_stub", **params)
+        ))
+        self.subscriptions = _StubResource(lambda params: {"status": "active", "metadata": {}, **params})
+
+def install_stubs(gemini_latency_ms: float = 0.0, redis_client=None):
+    """Fill app.clients' lazy slots so nothing reaches Redis, Gemini or Stripe"""
+    from app import clients
+    from app.config import settings
+    from app.services import stripe_service
+
+    if redis_client is None:
+        import fakeredis
+
+        redis_client = fakeredis.FakeRedis()
+    clients._redis_client = redis_client
+    clients._cache_service = None
+    clients._sms_queue = None
+    clients._stream_admission = None
+    clients._gemini_services[settings.GEMINI_MODEL] = StubGeminiService(gemini_latency_ms)
+    stripe_service._stripe_client = StubStripeClient()
+    return redis_client
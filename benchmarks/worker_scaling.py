@@ -0,0 +1,177 @@
+"""Throughput of the pre-fork server (app.server) from 1 to N worker processes
+
+Run from the repository root (needs ``gunicorn``, ``uvicorn``, ``httpx`` and ``fakeredis[lua]``):
+
+    python -m benchmarks.worker_scaling                    # 1, 2, 4 ... up to the CPU count
+    python -m benchmarks.worker_scaling --workers 1 --workers 8 --duration 20
+
+For each worker count a real server is started on a local port with the stubbed clients
+preloaded in its master, then client processes poll it over TCP for --duration seconds
+with --concurrency-per-worker requests in flight per worker. Keep that below a worker's DB
+pool (15 by default): handlers hold their session until the response is sent, so a worker
+with more requests in flight than connections stalls its event loop on pool checkout.
+Reports requests/second, p50/p95 latency and the speedup over the smallest worker count
+as JSON. Each worker gets its own fakeredis, and every worker reads the same SQLite file.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from .api_load import percentile
+from .stubs import configure_environment
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _load_stubbed_app():
+    from app.main import app
+    from .stubs import install_stubs
+
+    install_stubs()
+    return app
+
+def serve(workdir: str, workers: int, port: int):
+    """Server side (a child process): the real launcher with stubs installed before the fork"""
+    configure_environment(workdir)
+    from app.server import run
+
+    run(workers, f"127.0.0.1:{port}", load_app=_load_stubbed_app)
+
+def seed(workdir: str, users: int) -> dict:
+    configure_environment(workdir)
+    from app.main import app  # noqa: F401 - registers every model
+    from app.database import Base, engine
+    from .api_load import Fixture
+
+    Base.metadata.create_all(bind=engine)
+    fixture = Fixture(users, history_rooms=0, history_messages=0)
+    return {"tokens": fixture.tokens, "room_ids": fixture.room_ids}
+
+def _client(base_url: str, fixture: dict, concurrency: int, duration: float, queue):
+    """One load-generating process; returns its latencies (ms) through the queue"""
+    import httpx
+
+    async def main():
+        latencies, errors = [], 0
+        user_ids = list(fixture["tokens"])
+        deadline = time.monotonic() + duration
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+            async def worker(offset):
+                nonlocal errors
+                index = offset
+                while time.monotonic() < deadline:
+                    user_id = user_ids[index % len(user_ids)]
+                    index += concurrency
+                    headers = {"Authorization": f"Bearer {fixture['tokens'][user_id]}"}
+                    url = f"/chatrooms/{fixture['room_ids'][user_id]}/messages" if index % 2 else "/users/profile"
+                    start = time.perf_counter()
+                    response = await client.get(url, headers=headers)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        errors += 1
+
+            await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        return latencies, errors
+
+    queue.put(asyncio.run(main()))
+
+def _wait_until_ready(base_url: str, process, timeout: float = 60.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+def measure(args, workdir: str, fixture: dict, workers: int) -> dict:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.worker_scaling", "--serve", workdir,
+         "--serve-workers", str(workers), "--port", str(port)],
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None
+    )
+    try:
+        _wait_until_ready(base_url, process)
+        queue = multiprocessing.Queue()
+        per_client = max(1, args.concurrency_per_worker * workers // args.clients)
+        clients = [
+            multiprocessing.Process(target=_client, args=(base_url, fixture, per_client, args.duration, queue))
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        results = [queue.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+    latencies = sorted(value for values, _ in results for value in values)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "throughput_rps": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, action="append", help="worker counts to measure")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency-per-worker", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=max(2, (os.cpu_count() or 1) // 2),
+                        help="load-generating processes")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--verbose", action="store_true", help="show server output")
+    parser.add_argument("--output", help="also write the results JSON here")
+    parser.add_argument("--serve", metavar="WORKDIR", help=argparse.SUPPRESS)
+    parser.add_argument("--serve-workers", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.serve_workers, args.port)
+        return
+
+    max_workers = os.cpu_count() or 1
+    counts = sorted(args.workers or {1, max_workers, *(2 ** i for i in range(1, 8) if 2 ** i <= max_workers)})
+    workdir = configure_environment()
+    fixture = seed(workdir, args.users)
+
+    report = {}
+    for workers in counts:
+        report[workers] = measure(args, workdir, fixture, workers)
+        print(f"{workers} workers: {report[workers]['throughput_rps']} rps", file=sys.stderr)
+    single = report[counts[0]]["throughput_rps"] or 1.0
+    for result in report.values():
+        result["speedup"] = round(result["throughput_rps"] / single, 2)
+
+    output = json.dumps({"cpus": max_workers, "workers": report}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Shared fixtures: the app on a throwaway SQLite database with the offline stubs installed
+
+The environment has to be set before anything imports ``app``, so it is done here at import
+time; every test then gets a flushed fakeredis and fresh stubs.
+"""
+import itertools
+import fakeredis
+import pytest
+from .stubs import configure_environment, install_stubs
+
+WORKDIR = configure_environment()
+
+_redis = fakeredis.FakeRedis()
+_mobiles = itertools.count(1)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(autouse=True)
+def redis_client():
+    """One in-memory Redis for the whole run, emptied before each test"""
+    _redis.flushall()
+    install_stubs(redis_client=_redis)
+    return _redis
+
+@pytest.fixture
+def gemini(redis_client):
+    """The stub Gemini service install_stubs put in place, counting its calls"""
+    from app import clients
+    from app.config import settings
+
+    return clients._gemini_services[settings.GEMINI_MODEL]
+
+@pytest.fixture
+async def client(redis_client):
+    """An httpx client talking to the app in-process, with startup and shutdown run"""
+    import httpx
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        install_stubs(redis_client=redis_client)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+
+@pytest.fixture
+def db():
+    """A session on the test database, with the schema in place"""
+    from app.main import app  # noqa: F401  registers every model
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def make_user(db):
+    """Create a user with a mobile number no other test uses"""
+    from app.models.user import User
+
+    def make(**values):
+        user = User(mobile_number=f"+1999{next(_mobiles):07d}", password_hash="x", **values)
+        db.add(user)
+        db.commit()
+        return user
+    return make
+
+@pytest.fixture
+def auth_headers():
+    """Bearer headers for a user, as /auth/login would issue them"""
+    from app.utils.jwt_utils import create_access_token
+
+    def headers(user) -> dict:
+        return {"Authorization": f"Bearer {create_access_token({'user_id': user.id})}"}
+    return headers
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.chat_stream import ChatStream
+from app.services.message_lease import MessageLeased, claim_message, claim_owner
+from app.tasks.stream_tasks import ChatStreamWorker
+
+@pytest.fixture
+def stream(redis_client):
+    stream = ChatStream(redis_client, partitions=4, lease_seconds=30)
+    stream.ensure_groups()
+    return stream
+
+@pytest.fixture
+def queue_message(db, make_user):
+    from app.models.chatroom import Chatroom, Message
+    from app.services.message_lease import lease_owner, pending_lease_expiry
+
+    user = make_user()
+
+    def queue(chatroom_id=None) -> Message:
+        if chatroom_id is None:
+            room = Chatroom(user_id=user.id, title="stream")
+            db.add(room)
+            db.flush()
+            chatroom_id = room.id
+        message = Message(chatroom_id=chatroom_id, content="hi", is_user_message=True,
+                          processing_status="Pending..", lease_owner=lease_owner(),
+                          lease_expires_at=pending_lease_expiry())
+        db.add(message)
+        db.commit()
+        return message
+    return queue
+
+def drain(worker: ChatStreamWorker):
+    """One round of run_once, waiting for the batches it handed out"""
+    worker.run_once(block_ms=10)
+    for future in list(worker.busy.values()):
+        future.result()
+
+def statuses(db, messages) -> list:
+    db.expire_all()
+    return [message.processing_status for message in messages]
+
+def test_each_chatroom_is_handled_in_order(stream):
+    handled = []
+    worker = ChatStreamWorker(stream, handled.append, worker_id="worker-a", threads=4)
+    sent = []
+    for message_id in range(30):
+        chatroom_id = message_id % 3
+        stream.publish(chatroom_id, message_id)
+        sent.append((chatroom_id, message_id))
+    try:
+        while len(handled) < len(sent):
+            drain(worker)
+    finally:
+        worker.shutdown()
+    for chatroom_id in range(3):
+        ids = [entry["message_id"] for entry in handled if entry["chatroom_id"] == chatroom_id]
+        assert ids == [message_id for room, message_id in sent if room == chatroom_id]
+
+def test_new_owner_waits_for_the_crashed_workers_message(db, stream, queue_message, gemini):
+    from app.models.chatroom import Message
+
+    first = queue_message()
+    second = queue_message(first.chatroom_id)
+    partition = stream.partition_for(first.chatroom_id)
+    for message in (first, second):
+        stream.publish(message.chatroom_id, message.id)
+    # A worker read both entries and died in the middle of the first message's Gemini call;
+    # its partition lease has expired but the message lease has not
+    stream.read([partition], "dead-worker")
+    assert claim_message(db, first.id, claim_owner())
+
+    worker = ChatStreamWorker(stream, worker_id="worker-b", threads=2)
+    try:
+        drain(worker)
+        assert partition in worker.owned
+        assert worker.paused_until[partition] > 0
+        assert gemini.calls == 0
+        assert statuses(db, [first, second]) == ["processing", "Pending.."]
+        assert stream.redis_client.xpending(stream.stream_key(partition), "gemini")["pending"] == 2
+
+        # The lease runs out: the partition resumes with the first message
+        db.query(Message).filter(Message.id == first.id).update(
+            {Message.lease_expires_at: datetime.now(tz=timezone.utc) - timedelta(seconds=1)}
+        )
+        db.commit()
+        worker.paused_until.clear()
+        drain(worker)
+    finally:
+        worker.shutdown()
+    assert gemini.calls == 2
+    assert statuses(db, [first, second]) == ["completed", "completed"]
+    assert stream.redis_client.xpending(stream.stream_key(partition), "gemini")["pending"] == 0
+
+def test_stream_handler_waits_for_a_live_lease(db, queue_message):
+    from app.config import settings
+    from app.tasks.gemini_tasks import process_gemini_message
+
+    message = queue_message()
+    assert claim_message(db, message.id, claim_owner())
+
+    # Celery deliveries skip it; the ordered stream holds the partition until the lease ends
+    process_gemini_message(message.id)
+    with pytest.raises(MessageLeased) as leased:
+        process_gemini_message(message.id, wait_for_lease=True)
+    assert 0 < leased.value.retry_after <= settings.MESSAGE_LEASE_SECONDS
+
+def test_spent_token_budget_pauses_the_partition(db, stream, queue_message, gemini, redis_client, monkeypatch):
+    from app.clients import get_stream_admission
+    from app.config import settings
+    from app.services.gemini_scheduler import StreamAdmission
+
+    monkeypatch.setattr(settings, "GEMINI_TOKENS_PER_MINUTE", 1000)
+    admission = get_stream_admission()
+    message = queue_message()
+    ticket = admission.admit(message.chatroom.user_id, "pro", 100)
+    stream.publish(message.chatroom_id, message.id, ticket=ticket, cost=100)
+    partition = stream.partition_for(message.chatroom_id)
+    assert admission.budget.try_consume(1000)  # the other workers spent this minute's tokens
+
+    worker = ChatStreamWorker(stream, worker_id="worker-a", threads=2)
+    try:
+        drain(worker)
+        assert worker.paused_until[partition] > 0
+        assert gemini.calls == 0
+        assert redis_client.zscore(StreamAdmission.TICKETS_KEY, ticket) is not None  # still queued
+
+        for key in redis_client.scan_iter("gemini:tpm:*"):  # the window rolls
+            redis_client.delete(key)
+        worker.paused_until.clear()
+        drain(worker)
+    finally:
+        worker.shutdown()
+    assert gemini.calls == 1
+    assert statuses(db, [message]) == ["completed"]
+    assert redis_client.zscore(StreamAdmission.TICKETS_KEY, ticket) is None
+    assert int(redis_client.get(StreamAdmission.TOKENS_KEY)) == 0
+
+@pytest.mark.anyio
+async def test_stream_messages_are_admitted_before_publishing(client, db, make_user, auth_headers, redis_client,
+                                                              monkeypatch):
+    from app.config import settings
+    from app.models.chatroom import Chatroom
+    from app.services.gemini_scheduler import StreamAdmission
+
+    monkeypatch.setattr(settings, "CHAT_STREAM_ENABLED", True)
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_PENDING_PER_USER", 1)
+    user = make_user()
+    room = Chatroom(user_id=user.id, title="admission")
+    db.add(room)
+    db.commit()
+
+    url = f"/chatrooms/{room.id}/messages"
+    assert (await client.post(url, json={"content": "first"}, headers=auth_headers(user))).status_code == 200
+    refused = await client.post(url, json={"content": "second"}, headers=auth_headers(user))
+    assert refused.status_code == 429
+    assert int(refused.headers["Retry-After"]) >= 1
+
+    stream = ChatStream(redis_client)
+    [(_, fields)] = redis_client.xrange(stream.stream_key(stream.partition_for(room.id)))
+    ticket = fields[b"ticket"].decode()
+    assert ticket.endswith(f":{user.id}:{int(fields[b'cost'])}")
+    assert redis_client.zscore(StreamAdmission.TICKETS_KEY, ticket) is not None
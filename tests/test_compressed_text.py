@@ -0,0 +1,67 @@
+import pytest
+from app.config import settings
+from app.models.types import CODEC_ZSTD_DICT, CODEC_ZSTD_DICT_ID, compress_text, decompress_text, reset_codecs
+from app.tasks.compression_tasks import _stored, train_dictionary
+
+@pytest.fixture(autouse=True)
+def fresh_codecs():
+    reset_codecs()
+    yield
+    reset_codecs()
+
+@pytest.mark.parametrize("text", [
+    "\x00abc",
+    "\x00\x01\x03hello",  # looks like a zlib-compressed header
+    "\x00\x01\x01" + "x" * 2000,  # ... or a zstd one, and long enough to compress
+    "\x00" * 600,
+    "plain",
+    "y" * 2000,
+])
+def test_round_trip(text):
+    assert decompress_text(compress_text(text)) == text
+
+def test_decompressing_keeps_leading_nul_framed():
+    stored = compress_text("\x00" + "z" * 2000)
+    plain = _stored(stored, decompress=True)
+    assert decompress_text(plain) == "\x00" + "z" * 2000
+    assert len(plain) > 2000
+
+def write_dictionary(path, seed: int) -> str:
+    import random
+    import zstandard
+
+    rng = random.Random(seed)
+    words = [f"word{index}" for index in range(300)]
+    samples = [" ".join(rng.choice(words) for _ in range(80)).encode() for _ in range(500)]
+    path.write_bytes(zstandard.train_dictionary(4096, samples).as_bytes())
+    return str(path)
+
+def test_rows_stay_readable_after_a_new_dictionary(tmp_path, monkeypatch):
+    import zstandard
+
+    first, second = write_dictionary(tmp_path / "first.dict", 1), write_dictionary(tmp_path / "second.dict", 2)
+    text = "word1 word2 word3 " * 40
+    monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_DICT_PATH", first)
+    reset_codecs()
+    old = compress_text(text)
+    first_id = zstandard.ZstdCompressionDict(open(first, "rb").read()).dict_id()
+    assert old[2] == CODEC_ZSTD_DICT_ID and int.from_bytes(old[3:7], "big") == first_id
+    # As written before the header carried the id
+    legacy = old[:2] + bytes((CODEC_ZSTD_DICT,)) + old[7:]
+
+    monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_DICT_PATH", second)
+    reset_codecs()
+    with pytest.raises(ValueError, match=str(first_id)):
+        decompress_text(old)
+
+    monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_OLD_DICT_PATHS", [first])
+    reset_codecs()
+    new = compress_text(text)
+    assert new[3:7] != old[3:7]
+    assert decompress_text(old) == decompress_text(legacy) == decompress_text(new) == text
+
+def test_training_refuses_to_overwrite_a_dictionary(tmp_path, monkeypatch):
+    path = write_dictionary(tmp_path / "current.dict", 1)
+    monkeypatch.setattr(settings, "MESSAGE_COMPRESSION_DICT_PATH", path)
+    with pytest.raises(ValueError, match="in use"):
+        train_dictionary(str(tmp_path / "." / "current.dict"))
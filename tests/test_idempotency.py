@@ -0,0 +1,127 @@
+import time
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.utils.idempotency import IdempotentRequest
+
+pytestmark = pytest.mark.anyio
+
+class ChurningRedis:
+    """Another request keeps claiming and releasing the key: SET NX fails, GET finds nothing"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def set(self, *args, **kwargs):
+        self.calls += 1
+        return False
+
+    def get(self, key):
+        return None
+
+async def test_released_key_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_WAIT_SECONDS", 0.3)
+    redis_client = ChurningRedis()
+    request = IdempotentRequest(redis_client, 1, "send", "key-1", "{}")
+    with pytest.raises(HTTPException) as timed_out:
+        await request.begin()
+    assert timed_out.value.status_code == 409
+    assert redis_client.calls <= 10  # ~one claim per 50 ms pause, not a spin
+
+async def test_duplicate_replays_the_stored_response(redis_client):
+    first = IdempotentRequest(redis_client, 1, "send", "key-2", '{"a": 1}')
+    assert await first.begin() is None
+    first.complete(201, {"id": 5})
+
+    replay = await IdempotentRequest(redis_client, 1, "send", "key-2", '{"a": 1}').begin()
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+
+async def test_stale_owner_cannot_overwrite_its_successor(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_LOCK_SECONDS", 1)
+    stale = IdempotentRequest(redis_client, 1, "send", "key-3", "{}")
+    assert await stale.begin() is None
+    redis_client.delete(stale.redis_key)  # the claim expired while the request ran on
+    successor = IdempotentRequest(redis_client, 1, "send", "key-3", "{}")
+    assert await successor.begin() is None
+
+    assert not stale.release()
+    assert not stale.complete(200, {"id": "stale"})
+    assert successor.complete(200, {"id": "fresh"})
+    replay = await IdempotentRequest(redis_client, 1, "send", "key-3", "{}").begin()
+    assert replay.body == b'{"id":"fresh"}'
+
+@pytest.fixture
+def room(db, make_user):
+    from app.models.chatroom import Chatroom
+
+    room = Chatroom(user_id=make_user().id, title="idempotency")
+    db.add(room)
+    db.commit()
+    return room
+
+async def answered(db, message_id: int):
+    """Wait for the dispatcher to finish the message"""
+    import anyio
+    from app.models.chatroom import Message
+
+    for _ in range(200):
+        db.expire_all()
+        if db.get(Message, message_id).processing_status == "completed":
+            return
+        await anyio.sleep(0.01)
+    raise AssertionError(f"message {message_id} was never answered")
+
+def sent(db, room) -> tuple:
+    """(messages in the room, the owner's daily usage)"""
+    from app.models.chatroom import Message
+
+    db.expire_all()
+    return db.query(Message).filter(Message.chatroom_id == room.id).count(), room.user.daily_usage_count
+
+async def test_replayed_message_is_not_sent_twice(client, db, room, auth_headers, gemini):
+    headers = auth_headers(room.user) | {"Idempotency-Key": "send-1"}
+    url = f"/chatrooms/{room.id}/messages"
+    first = await client.post(url, json={"content": "hello"}, headers=headers)
+    assert first.status_code == 200
+    await answered(db, first.json()["id"])
+    assert sent(db, room) == (1, 1)
+    assert gemini.calls == 1
+
+    replay = await client.post(url, json={"content": "hello"}, headers=headers)
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == first.json()
+    assert sent(db, room) == (1, 1)
+    assert gemini.calls == 1
+
+async def test_concurrent_duplicate_waits_for_the_first(client, db, room, auth_headers, gemini, monkeypatch):
+    import anyio
+    from app.api import chatroom
+
+    check_daily_limit = chatroom.RateLimitMiddleware.check_daily_limit
+
+    def slow_check(self):
+        time.sleep(0.3)  # the first request is still running when its duplicate arrives
+        return check_daily_limit(self)
+    monkeypatch.setattr(chatroom.RateLimitMiddleware, "check_daily_limit", slow_check)
+
+    headers = auth_headers(room.user) | {"Idempotency-Key": "send-2"}
+    responses = []
+
+    async def send():
+        responses.append(await client.post(f"/chatrooms/{room.id}/messages", json={"content": "hi"}, headers=headers))
+
+    async with anyio.create_task_group() as group:
+        group.start_soon(send)
+        await anyio.sleep(0.1)
+        group.start_soon(send)
+
+    first, duplicate = responses
+    assert first.status_code == duplicate.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert duplicate.headers["Idempotent-Replayed"] == "true"
+    assert duplicate.json() == first.json()
+    await answered(db, first.json()["id"])
+    assert sent(db, room) == (1, 1)
+    assert gemini.calls == 1
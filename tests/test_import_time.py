@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+# Loaded on first use (or from the lifespan hook), never by importing the app
+LAZY_MODULES = {"google.generativeai", "stripe", "celery", "pyinstrument", "redis"}
+
+def test_app_import_leaves_sdks_for_first_use():
+    # A fresh interpreter, with this suite's environment (SQLite, no driver to load)
+    proc = subprocess.run([sys.executable, "-c", "import sys, app.main; print(*sys.modules)"],
+                          capture_output=True, text=True, check=True)
+    assert LAZY_MODULES.isdisjoint(proc.stdout.split())
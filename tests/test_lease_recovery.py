@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.message_lease import claim_message, claim_owner, finish_message, take_over_expired
+
+@pytest.fixture
+def room(db, make_user):
+    from app.models.chatroom import Chatroom
+
+    room = Chatroom(user_id=make_user().id, title="leases")
+    db.add(room)
+    db.commit()
+    return room
+
+@pytest.fixture
+def add_message(db, room):
+    from app.models.chatroom import Message
+
+    def add(status="Pending..", owner=None, expires_in=None, age=0, response=None) -> int:
+        now = datetime.now(tz=timezone.utc)
+        message = Message(chatroom_id=room.id, content="hi", is_user_message=True, processing_status=status,
+                          lease_owner=owner, gemini_response=response, created_at=now - timedelta(seconds=age),
+                          lease_expires_at=None if expires_in is None else now + timedelta(seconds=expires_in))
+        db.add(message)
+        db.commit()
+        return message.id
+    return add
+
+def statuses(db, message_ids) -> list:
+    from app.models.chatroom import Message
+
+    db.expire_all()
+    return [db.get(Message, message_id).processing_status for message_id in message_ids]
+
+def test_sweep_takes_only_expired_leases_once(db, add_message):
+    stuck = [
+        add_message("processing", "dead:1", expires_in=-60),
+        add_message("Pending..", "dead:1", expires_in=-60),
+        add_message(age=3600),  # queued before leases existed
+    ]
+    live = add_message("processing", "live:1", expires_in=3600)
+    queued = add_message("Pending..", "live:1", expires_in=3600)
+    done = add_message("completed", response="reply", age=3600)
+
+    taken = []
+    while True:
+        batch = take_over_expired(db, "sweeper", batch_size=2)
+        assert len(batch) <= 2
+        if not batch:
+            break
+        taken += [message_id for message_id, _ in batch]
+    assert len(taken) == len(set(taken))
+    assert set(stuck) <= set(taken)
+    assert not {live, queued, done} & set(taken)
+    assert statuses(db, stuck) == ["Pending.."] * 3
+    assert statuses(db, [live, queued, done]) == ["processing", "Pending..", "completed"]
+
+def test_recovered_messages_are_answered(db, add_message, gemini, monkeypatch):
+    from app.tasks.celery_app import celery_app
+    from app.tasks.gemini_tasks import recover_expired_leases
+
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    stuck = [add_message("processing", "dead:1", expires_in=-60) for _ in range(5)]
+    recover_expired_leases(batch_size=2)
+    assert gemini.calls == 5
+    assert statuses(db, stuck) == ["completed"] * 5
+
+def test_duplicate_deliveries_call_gemini_once(db, add_message, gemini):
+    from app.tasks.celery_app import celery_app
+    from app.tasks.gemini_tasks import process_gemini_message
+
+    celery_app.finalize()  # bind the task once, not racing in every thread
+    message_ids = [add_message() for _ in range(10)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(process_gemini_message, message_ids * 2))
+    assert gemini.calls == 10
+    assert statuses(db, message_ids) == ["completed"] * 10
+
+def test_threads_of_one_process_hold_separate_leases(db, add_message):
+    from app.models.chatroom import Message
+
+    message_id = add_message()
+    first, second = claim_owner(), claim_owner()
+    assert first != second
+    assert claim_message(db, message_id, first)
+    # The first thread stalls past its lease; the message is handed to a second thread
+    db.query(Message).filter(Message.id == message_id).update(
+        {Message.lease_expires_at: datetime.now(tz=timezone.utc) - timedelta(seconds=1)}
+    )
+    db.commit()
+    assert claim_message(db, message_id, second)
+
+    assert not finish_message(db, message_id, first, processing_status="completed")
+    assert finish_message(db, message_id, second, processing_status="completed")
+    db.commit()
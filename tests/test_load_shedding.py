@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.config import settings
+from app.middleware.load_shedding_middleware import (
+    POLL, WRITE, LoadSheddingMiddleware, TierDirectory, route_class
+)
+from app.utils.jwt_utils import create_access_token
+
+pytestmark = pytest.mark.anyio
+
+BASIC, PRO = 1, 2
+
+async def ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+@pytest.fixture
+def monitor():
+    return SimpleNamespace(lag=0.0)
+
+@pytest.fixture
+async def shedder(monitor):
+    tiers = TierDirectory()
+    tiers.remember(BASIC, "basic")
+    tiers.remember(PRO, "pro")
+    transport = httpx.ASGITransport(app=LoadSheddingMiddleware(ok, monitor=monitor, tiers=tiers))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+def headers(user_id: int) -> dict:
+    return {"Authorization": f"Bearer {create_access_token({'user_id': user_id})}"}
+
+async def statuses(client) -> dict:
+    requests = {
+        "poll": ("GET", "/chatrooms/1/messages"),
+        "batch": ("POST", "/batch"),
+        "write": ("POST", "/chatrooms/1/message"),
+    }
+    found = {}
+    for name, (method, path) in requests.items():
+        for tier, user_id in (("basic", BASIC), ("pro", PRO)):
+            response = await client.request(method, path, headers=headers(user_id))
+            found[f"{tier}_{name}"] = response.status_code
+            if response.status_code == 503:
+                assert response.headers["retry-after"]
+    found["login"] = (await client.post("/auth/login")).status_code
+    return found
+
+def test_batch_is_shed_as_a_poll():
+    assert route_class("POST", "/batch") == POLL
+    assert route_class("POST", "/chatrooms/1/message") == WRITE
+
+async def test_nothing_is_shed_on_a_healthy_loop(shedder):
+    assert set((await statuses(shedder)).values()) == {200}
+
+async def test_poll_lag_sheds_basic_polls_and_batches(shedder, monitor):
+    monitor.lag = settings.LOAD_SHED_POLL_LAG_MS / 1000
+    found = await statuses(shedder)
+    assert [name for name, status in found.items() if status == 503] == ["basic_poll", "basic_batch"]
+
+async def test_basic_lag_sheds_every_basic_request(shedder, monitor):
+    monitor.lag = settings.LOAD_SHED_BASIC_LAG_MS / 1000
+    found = await statuses(shedder)
+    assert [name for name, status in found.items() if status == 503] == ["basic_poll", "basic_batch", "basic_write"]
@@ -0,0 +1,58 @@
+import json
+import threading
+import pytest
+from app.schemas.chatroom import ImportedMessage
+
+pytestmark = pytest.mark.anyio
+
+def ndjson(count: int, start: int = 0) -> bytes:
+    return b"".join(json.dumps({"content": f"question {index}", "gemini_response": "answer"}).encode() + b"\n"
+                    for index in range(start, start + count))
+
+async def test_upload_holds_no_transaction_and_validates_off_the_loop(client, make_user, auth_headers, monkeypatch):
+    from app.config import settings
+    from app.database import SessionLocal
+    from app.models.chatroom import Chatroom
+
+    user = make_user()
+    monkeypatch.setattr(settings, "MESSAGE_IMPORT_BATCH_SIZE", 50)
+    validating_threads = set()
+    validate = ImportedMessage.model_validate_json
+
+    def record_thread(data, *args, **kwargs):
+        validating_threads.add(threading.get_ident())
+        return validate(data, *args, **kwargs)
+    monkeypatch.setattr(ImportedMessage, "model_validate_json", record_thread)
+
+    async def body():
+        yield ndjson(120)
+        # Mid-upload another request writes; SQLite would report "database is locked" if the
+        # import held a write transaction open
+        other = SessionLocal()
+        try:
+            other.add(Chatroom(user_id=user.id, title="meanwhile", message_count=0))
+            other.commit()
+        finally:
+            other.close()
+        yield ndjson(80, start=120)
+
+    response = await client.post("/chatrooms/import", params={"title": "history"}, content=body(),
+                                 headers=auth_headers(user))
+
+    assert response.status_code == 200, response.text
+    assert response.json()["imported"] == 200
+    assert response.json()["message_count"] == 200
+    assert validating_threads and threading.get_ident() not in validating_threads
+
+async def test_invalid_line_imports_nothing(client, make_user, auth_headers, db):
+    from app.models.chatroom import Chatroom
+
+    user = make_user()
+    body = ndjson(10) + b'{"gemini_response": "no content"}\n' + ndjson(5)
+
+    response = await client.post("/chatrooms/import", params={"title": "broken"}, content=body,
+                                 headers=auth_headers(user))
+
+    assert response.status_code == 422
+    assert "line 11" in response.json()["detail"]
+    assert db.query(Chatroom).filter(Chatroom.user_id == user.id).count() == 0
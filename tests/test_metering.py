@@ -0,0 +1,58 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+import pytest
+from app.models.usage import UsageEvent, UsageRollup
+from app.services.metering_service import MeteringService
+from app.tasks import metering_tasks
+
+@pytest.fixture
+def local_time_ahead_of_utc(monkeypatch):
+    """Run as a server whose local time is UTC+5"""
+    monkeypatch.setenv("TZ", "Etc/GMT-5")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def add_events(db, user_id: int, *hours: datetime):
+    for hour in hours:
+        db.add(UsageEvent(event_id=uuid.uuid4().hex, user_id=user_id, outcome="ok", prompt_tokens=10,
+                          response_tokens=20, latency_ms=5.0, occurred_at=hour, hour_start=hour))
+    db.commit()
+
+def hour_buckets(db, user_id: int) -> list:
+    return [row.bucket_start for row in db.query(UsageRollup).filter(
+        UsageRollup.user_id == user_id, UsageRollup.granularity == "hour"
+    ).order_by(UsageRollup.bucket_start)]
+
+def test_naive_since_is_utc(db, local_time_ahead_of_utc):
+    user_id = 9100
+    add_events(db, user_id, datetime(2026, 1, 1, 8), datetime(2026, 1, 1, 10), datetime(2026, 1, 1, 12))
+
+    # 10:00 UTC; read as local time it would be 05:00 UTC and pull in the 08:00 bucket too
+    refreshed = MeteringService(db).backfill(datetime(2026, 1, 1, 10), until=datetime(2026, 1, 1, 12), user_id=user_id)
+
+    assert refreshed == 1
+    assert hour_buckets(db, user_id) == [datetime(2026, 1, 1, 10)]
+
+def test_backfill_waits_for_the_flush_lock(db, redis_client):
+    user_id = 9101
+    add_events(db, user_id, datetime(2026, 2, 1, 9))
+    flush_lock = redis_client.lock(metering_tasks.FLUSH_LOCK_KEY, timeout=metering_tasks.FLUSH_LOCK_SECONDS)
+    assert flush_lock.acquire(blocking=False)
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(metering_tasks.backfill(datetime(2026, 2, 1), user_id=user_id)))
+    thread.start()
+    time.sleep(0.3)
+    db.expire_all()
+    assert not result and hour_buckets(db, user_id) == []
+
+    flush_lock.release()
+    thread.join(timeout=10)
+    db.expire_all()
+    assert result == [1]
+    assert hour_buckets(db, user_id) == [datetime(2026, 2, 1, 9)]
+    assert not redis_client.exists(metering_tasks.FLUSH_LOCK_KEY)
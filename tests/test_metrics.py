@@ -0,0 +1,48 @@
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+pytestmark = pytest.mark.anyio
+
+def samples(text: str) -> dict:
+    """{(sample name, frozenset of labels): value} from a scrape"""
+    return {
+        (sample.name, frozenset(sample.labels.items())): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+def value(scrape: dict, name: str, **labels) -> float:
+    return scrape.get((name, frozenset(labels.items())), 0.0)
+
+async def test_metrics_scrape(client, db, make_user, auth_headers, redis_client):
+    from app.models.chatroom import Chatroom
+
+    user = make_user()
+    room = Chatroom(user_id=user.id, title="metrics")
+    db.add(room)
+    db.commit()
+
+    before = samples((await client.get("/metrics")).text)
+    assert (await client.get("/health")).status_code == 200
+    assert (await client.get(f"/chatrooms/{room.id}", headers=auth_headers(user))).status_code == 200
+    assert (await client.get("/no/such/route")).status_code == 404
+    redis_client.rpush("celery", "job-1", "job-2")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    after = samples(response.text)
+
+    def delta(name, **labels):
+        return value(after, name, **labels) - value(before, name, **labels)
+
+    # Latency is labelled by route template, not by the raw path
+    assert delta("http_request_duration_seconds_count", method="GET", route="/health", status="200") == 1
+    assert delta("http_request_duration_seconds_count", method="GET",
+                 route="/chatrooms/{chatroom_id}", status="200") == 1
+    assert delta("http_request_duration_seconds_count", method="GET", route="unmatched", status="404") == 1
+    assert not any(f"/chatrooms/{room.id}" in dict(labels).get("route", "") for _, labels in after)
+
+    assert delta("db_queries_per_request_count", route="/chatrooms/{chatroom_id}") == 1
+    assert delta("db_queries_per_request_sum", route="/chatrooms/{chatroom_id}") >= 1
+    assert value(after, "celery_queue_depth", queue="celery") == 2
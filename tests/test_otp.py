@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.utils.otp_utils import store_otp, verify_otp
+
+MOBILE = "+15550001000"
+
+def _attempt(code: str) -> str:
+    try:
+        return "verified" if verify_otp(MOBILE, code) else "invalid"
+    except HTTPException as e:
+        assert e.status_code == 429
+        return "locked"
+
+def test_parallel_correct_code_verifies_once():
+    store_otp(MOBILE, "123456")
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(_attempt, ["123456"] * 100))
+    assert results.count("verified") == 1
+    assert results.count("invalid") == 99
+
+def test_parallel_guesses_stop_at_max_attempts():
+    store_otp(MOBILE, "123456")
+    guesses = [f"{code:06d}" for code in range(200000, 200100)]
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(_attempt, guesses))
+    assert results.count("verified") == 0
+    assert results.count("invalid") == settings.OTP_MAX_ATTEMPTS - 1
+    assert results.count("locked") == 100 - (settings.OTP_MAX_ATTEMPTS - 1)
+    # The code is burned: even the right one is refused while locked
+    assert _attempt("123456") == "locked"
+
+def test_lockout_runs_from_the_last_failure(redis_client):
+    store_otp(MOBILE, "123456")
+    assert _attempt("000000") == "invalid"
+    # Most of the window since the first failure has gone by
+    redis_client.expire(f"otp_attempts:{MOBILE}", 5)
+    for _ in range(settings.OTP_MAX_ATTEMPTS - 2):
+        assert _attempt("000000") == "invalid"
+    assert _attempt("000000") == "locked"
+    ttl = redis_client.ttl(f"otp_attempts:{MOBILE}")
+    assert ttl > settings.OTP_LOCKOUT_MINUTES * 60 - 5
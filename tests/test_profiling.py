@@ -0,0 +1,71 @@
+import os
+import anyio
+import pytest
+from app.config import settings
+from app.middleware.profiling_middleware import ProfilingMiddleware
+
+pytest.importorskip("pyinstrument")
+pytestmark = pytest.mark.anyio
+
+async def endpoint(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+@pytest.fixture
+def middleware(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILING_ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+    middleware = ProfilingMiddleware(endpoint)
+    intervals = []
+    profiler_class = middleware.profiler_class
+
+    def profiler(interval, **kwargs):
+        intervals.append(interval)
+        return profiler_class(interval=interval, **kwargs)
+
+    middleware.profiler_class = profiler
+    middleware.intervals = intervals
+    return middleware
+
+async def call(middleware, headers=()):
+    scope = {"type": "http", "method": "GET", "path": "/health", "headers": list(headers)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return sent[0]["status"]
+
+async def test_admin_token_is_compared_as_bytes(middleware, tmp_path):
+    assert await call(middleware, [(b"x-profile-token", "s3crét".encode("utf-8"))]) == 200
+    assert await call(middleware, [(b"x-profile-token", b"wrong")]) == 200
+    assert os.listdir(tmp_path) == []
+
+    assert await call(middleware, [(b"x-profile-token", b"s3cret")]) == 200
+    assert len(os.listdir(tmp_path)) == 1
+    assert middleware.intervals == [settings.PROFILING_INTERVAL]
+
+async def test_slow_watch_uses_the_coarse_interval(middleware, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_SLOW_THRESHOLD_MS", 10_000.0)
+    for _ in range(3):
+        assert await call(middleware) == 200
+    assert middleware.intervals == [settings.PROFILING_SLOW_INTERVAL] * 3
+    assert os.listdir(tmp_path) == []  # none was slow enough to keep
+
+async def test_concurrent_slow_requests_keep_every_profile(middleware, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_SLOW_THRESHOLD_MS", 10.0)
+
+    async def slow(scope, receive, send):
+        await anyio.sleep(0.05)
+        await endpoint(scope, receive, send)
+    middleware.app = slow
+
+    async with anyio.create_task_group() as group:
+        for _ in range(5):
+            group.start_soon(call, middleware)
+    assert len(os.listdir(tmp_path)) == 5
@@ -0,0 +1,87 @@
+import pytest
+from app import database
+from app.database import has_recent_write, mark_recent_write
+
+@pytest.fixture(autouse=True)
+def empty_writers():
+    database._recent_writers.clear()
+    yield
+    database._recent_writers.clear()
+
+def test_local_writers_are_bounded(monkeypatch, redis_client):
+    monkeypatch.setattr(database, "RECENT_WRITERS_MAX", 5)
+    for user_id in range(1, 21):
+        mark_recent_write(user_id)
+    assert list(database._recent_writers) == [16, 17, 18, 19, 20]
+    assert has_recent_write(1)  # evicted locally, still pinned through Redis
+
+def test_expired_writers_are_trimmed():
+    mark_recent_write(1)
+    mark_recent_write(2)
+    database._recent_writers[1] = 0.0  # its window has passed
+    mark_recent_write(3)
+    assert list(database._recent_writers) == [2, 3]
+
+@pytest.mark.anyio
+async def test_register_pins_the_new_user_to_the_primary(client, monkeypatch):
+    from app.api import auth
+
+    monkeypatch.setattr(auth, "replica_engines", [object()])
+    response = await client.post("/auth/register", json={"mobile_number": "+15557770001", "password": "secret1"})
+    assert response.status_code == 200
+    assert response.json()["id"] in database._recent_writers
+
+@pytest.fixture
+def replica(tmp_path, db, monkeypatch):
+    """A second SQLite file standing in for a replica that has not caught up"""
+    import itertools
+    from app.database import Base
+
+    engine = database.build_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(database, "replica_engines", [engine])
+    monkeypatch.setattr(database, "_replica_cycle", itertools.cycle([engine]))
+    yield engine
+    engine.dispose()
+
+def copy_rows(db, replica, table, *rows, **changes):
+    """Replicate rows by primary key, with changes the replica has not seen yet"""
+    from sqlalchemy import insert, select
+
+    values = [
+        dict(db.execute(select(table).where(table.c.id == row.id)).mappings().one()) | changes
+        for row in rows
+    ]
+    with replica.begin() as connection:
+        connection.execute(insert(table), values)
+
+@pytest.mark.anyio
+async def test_reads_use_the_replica_except_right_after_a_write(client, db, make_user, auth_headers, replica,
+                                                                monkeypatch):
+    import anyio
+    from app.models.chatroom import Chatroom
+    from app.models.user import User
+
+    monkeypatch.setattr(database.settings, "READ_YOUR_WRITES_SECONDS", 1)
+    writer, reader = make_user(), make_user()
+    rooms = [Chatroom(user_id=user.id, title="primary") for user in (writer, reader)]
+    db.add_all(rooms)
+    db.commit()
+    copy_rows(db, replica, User.__table__, writer, reader)
+    copy_rows(db, replica, Chatroom.__table__, *rooms, title="replica")
+
+    async def title(user, room) -> str:
+        response = await client.get(f"/chatrooms/{room.id}", headers=auth_headers(user))
+        assert response.status_code == 200
+        return response.json()["title"]
+
+    assert await title(writer, rooms[0]) == "replica"
+    response = await client.put(f"/chatrooms/{rooms[0].id}", json={"title": "renamed"}, headers=auth_headers(writer))
+    assert response.status_code == 200
+
+    # The writer reads its own write from the primary; everyone else stays on the replica
+    assert await title(writer, rooms[0]) == "renamed"
+    assert await title(reader, rooms[1]) == "replica"
+
+    await anyio.sleep(1.1)
+    assert await title(writer, rooms[0]) == "replica"  # the window has passed
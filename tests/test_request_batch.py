@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.config import settings
+from app.utils.request_batch import RequestBatch
+
+@pytest.fixture
+def room(db, make_user):
+    from app.models.chatroom import Chatroom
+
+    room = Chatroom(user_id=make_user().id, title="batch", message_count=0)
+    db.add(room)
+    db.commit()
+    return room
+
+async def batch(client, headers, *requests):
+    response = await client.post("/batch", json={"requests": list(requests)}, headers=headers)
+    return response.status_code, response.json()
+
+def test_one_chat_session_per_shard_under_concurrency():
+    opened = []
+    barrier = threading.Barrier(8)
+
+    def open_session(shard):
+        time.sleep(0.01)  # widen the window between the check and the insert
+        session = object()
+        opened.append(session)
+        return session
+
+    batch = RequestBatch(db=None, token="t")
+
+    def get(_):
+        barrier.wait()
+        return batch.chat_session("chat0", open_session)
+
+    with ThreadPoolExecutor(8) as pool:
+        sessions = list(pool.map(get, range(8)))
+
+    assert len(opened) == 1
+    assert all(session is opened[0] for session in sessions)
+
+@pytest.mark.anyio
+async def test_results_come_back_in_request_order(client, room, auth_headers):
+    status_code, body = await batch(
+        client, auth_headers(room.user),
+        {"id": "profile", "path": "/users/profile"},
+        {"id": "room", "path": f"/chatrooms/{room.id}"},
+        {"id": "missing", "path": "/chatrooms/999999999"},
+        {"id": "nowhere", "path": "/no/such/route"},
+        {"id": "create", "method": "POST", "path": "/chatrooms/", "body": {"title": "from a batch"}},
+        {"id": "invalid", "method": "POST", "path": "/chatrooms/", "body": {}},
+        {"id": "list", "path": "/chatrooms/"},
+    )
+    assert status_code == 200
+    results = body["responses"]
+    assert [(result["id"], result["status"]) for result in results] == [
+        ("profile", 200), ("room", 200), ("missing", 404), ("nowhere", 404),
+        ("create", 200), ("invalid", 422), ("list", 200),
+    ]
+    assert results[0]["body"]["id"] == room.user_id
+    assert results[1]["body"]["title"] == "batch"
+    assert "etag" in results[1]["headers"]
+    assert {"batch", "from a batch"} <= {chatroom["title"] for chatroom in results[6]["body"]["chatrooms"]}
+
+@pytest.mark.anyio
+async def test_failed_write_is_rolled_back_before_the_next_operation(client, db, room, auth_headers, monkeypatch):
+    from app.api import chatroom
+    from app.models.chatroom import Chatroom
+
+    increment_usage = chatroom.RateLimitMiddleware.increment_usage
+
+    def increment_then_fail(self):
+        increment_usage(self)  # the user and chatroom counters are changed, not yet committed
+        raise RuntimeError("usage store unavailable")
+    monkeypatch.setattr(chatroom.RateLimitMiddleware, "increment_usage", increment_then_fail)
+
+    status_code, body = await batch(
+        client, auth_headers(room.user),
+        {"method": "POST", "path": f"/chatrooms/{room.id}/messages", "body": {"content": "hi"}},
+        {"method": "PUT", "path": f"/chatrooms/{room.id}", "body": {"title": "renamed"}},
+    )
+    assert status_code == 200
+    failed, renamed = body["responses"]
+    assert (failed["status"], failed["body"]) == (500, {"detail": "Internal server error"})
+    assert renamed["status"] == 200
+
+    # The rename committed the shared session; the failed send's half-done counters did not ride along
+    db.expire_all()
+    chatroom_row = db.get(Chatroom, room.id)
+    assert (chatroom_row.title, chatroom_row.message_count) == ("renamed", 0)
+    assert chatroom_row.user.daily_usage_count == 0
+
+@pytest.mark.anyio
+async def test_nested_batch_is_rejected(client, room, auth_headers):
+    status_code, body = await batch(
+        client, auth_headers(room.user),
+        {"method": "POST", "path": "/batch", "body": {"requests": [{"path": "/users/profile"}]}},
+        {"path": "/users/profile"},
+    )
+    assert status_code == 200
+    nested, profile = body["responses"]
+    assert (nested["status"], nested["body"]) == (400, {"detail": "Batches cannot be nested"})
+    assert profile["status"] == 200
+
+@pytest.mark.anyio
+async def test_batch_size_is_limited(client, room, auth_headers, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_MAX_REQUESTS", 2)
+    status_code, body = await batch(client, auth_headers(room.user), *[{"path": "/users/profile"}] * 3)
+    assert status_code == 400
+    assert body["detail"] == "At most 2 requests per batch"
+
+@pytest.mark.anyio
+async def test_token_is_sent_and_verified_once(client, room, auth_headers, monkeypatch):
+    from app.utils import jwt_utils
+
+    verified = []
+    verify = jwt_utils._verify_access_token
+
+    def counting_verify(token):
+        verified.append(token)
+        return verify(token)
+    monkeypatch.setattr(jwt_utils, "_verify_access_token", counting_verify)
+
+    status_code, body = await batch(
+        client, auth_headers(room.user),
+        {"path": "/users/profile"},
+        # An operation's own Authorization header is ignored: the batch's token applies
+        {"path": f"/chatrooms/{room.id}", "headers": {"Authorization": "Bearer not-a-token"}},
+        {"method": "PUT", "path": f"/chatrooms/{room.id}", "body": {"title": "once"}},
+    )
+    assert status_code == 200
+    assert [result["status"] for result in body["responses"]] == [200, 200, 200]
+    assert len(verified) == 1
+
+    status_code, _ = await batch(client, {}, {"path": "/users/profile"})
+    assert status_code == 401
@@ -0,0 +1,107 @@
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+from app import sharding
+from app.models.chatroom import Chatroom, Message
+from app.reshard import migrate_user
+from app.sharding import SHARD_DIRECTORY_KEY, HashRing, get_chat_db
+from app.utils.jwt_utils import create_access_token
+
+@pytest.fixture
+def shards(db, tmp_path, monkeypatch):
+    """Two empty SQLite chat shards, a and b, with sharding switched on"""
+    engines = {}
+    for name in ("a", "b"):
+        engines[name] = create_engine(f"sqlite:///{tmp_path / f'shard-{name}.db'}")
+        monkeypatch.setitem(sharding.shard_engines, name, engines[name])
+        monkeypatch.setitem(sharding.shard_sessions, name, sessionmaker(bind=engines[name], autoflush=False))
+        sharding.create_shard_schema(name)
+    monkeypatch.setattr(sharding, "ring", HashRing(["a", "b"]))
+    return engines
+
+def seed(shard: str, user_id: int, rooms: int, messages: int):
+    db = sharding.open_chat_session(shard)
+    try:
+        for room_index in range(rooms):
+            room_id = user_id * 1000 + room_index
+            db.add(Chatroom(id=room_id, user_id=user_id, title=f"room {room_index}"))
+            for index in range(messages):
+                db.add(Message(id=room_id * 1000 + index, chatroom_id=room_id, content=f"message {index}",
+                               processing_status="completed"))
+        db.commit()
+    finally:
+        db.close()
+
+def count(shard: str, model) -> int:
+    db = sharding.open_chat_session(shard)
+    try:
+        return db.query(func.count(model.id)).scalar()
+    finally:
+        db.close()
+
+def chat_request(user_id: int) -> Request:
+    token = create_access_token({"user_id": user_id})
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+def test_move_copies_in_batches(shards, redis_client):
+    seed("a", 7, rooms=2, messages=10)
+    redis_client.hset(SHARD_DIRECTORY_KEY, "7", "a")
+    inserts = []
+    event.listen(shards["b"], "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: inserts.append(statement) if statement.startswith("INSERT") else None)
+
+    assert migrate_user(7, "b", batch_size=5)
+
+    assert (count("b", Chatroom), count("b", Message)) == (2, 20)
+    assert (count("a", Chatroom), count("a", Message)) == (0, 0)
+    assert redis_client.hget(SHARD_DIRECTORY_KEY, "7") == b"b"
+    # Rooms twice (first pass and catch-up), messages once per batch of 5
+    assert len(inserts) == 2 + 4
+
+def test_move_waits_for_writes_that_resolved_the_old_shard(shards, redis_client):
+    seed("a", 8, rooms=1, messages=3)
+    redis_client.hset(SHARD_DIRECTORY_KEY, "8", "a")
+
+    # A send-message request resolved shard a just before the move freezes writes
+    in_flight = get_chat_db(chat_request(8), db=None)
+    session = next(in_flight)
+
+    result = {}
+    mover = threading.Thread(target=lambda: result.update(moved=migrate_user(8, "b", wait_seconds=10)))
+    mover.start()
+    deadline = time.monotonic() + 5
+    while not (redis_client.hget(SHARD_DIRECTORY_KEY, "8") or b"").startswith(b"migrating:"):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    # Requests arriving now are told to retry...
+    with pytest.raises(HTTPException) as rejected:
+        next(get_chat_db(chat_request(8), db=None))
+    assert rejected.value.status_code == 503
+
+    # ...while the one already running commits to the old shard and must not be lost
+    time.sleep(0.2)
+    session.add(Message(id=8000999, chatroom_id=8000, content="late", processing_status="completed"))
+    session.commit()
+    in_flight.close()
+    mover.join(timeout=10)
+
+    assert result == {"moved": True}
+    assert count("b", Message) == 4
+    assert count("a", Message) == 0
+
+def test_move_aborts_when_a_write_never_finishes(shards, redis_client):
+    seed("a", 9, rooms=1, messages=2)
+    redis_client.hset(SHARD_DIRECTORY_KEY, "9", "a")
+    in_flight = get_chat_db(chat_request(9), db=None)
+    next(in_flight)
+    try:
+        assert not migrate_user(9, "b", wait_seconds=0.3)
+    finally:
+        in_flight.close()
+    assert redis_client.hget(SHARD_DIRECTORY_KEY, "9") == b"a"
+    assert (count("a", Message), count("b", Message)) == (2, 0)
@@ -0,0 +1,95 @@
+import pytest
+from app.services.gemini_scheduler import AdmissionRejected, FairScheduler, TokenBudget
+
+def make_scheduler(clock, tokens_per_minute=10**9, **kwargs) -> FairScheduler:
+    return FairScheduler({"pro": 8, "basic": 1}, TokenBudget(tokens_per_minute, clock=lambda: clock[0]),
+                         clock=lambda: clock[0], **kwargs)
+
+def test_backlogged_pro_work_gets_its_weighted_share():
+    scheduler = make_scheduler([0.0], max_pending_per_user=1000, max_queue_per_tier=1000)
+    for tier, first_user in (("pro", 1), ("basic", 1000)):
+        for index in range(450):
+            scheduler.enqueue(scheduler.admit(first_user + index % 10, tier, 100))
+    served = [scheduler.next_job().tier for _ in range(450)]
+    assert served.count("pro") == pytest.approx(8 * served.count("basic"), rel=0.1)
+
+def test_users_in_a_tier_take_turns():
+    scheduler = make_scheduler([0.0])
+    for _ in range(5):
+        scheduler.enqueue(scheduler.admit(1, "basic", 10))
+    scheduler.enqueue(scheduler.admit(2, "basic", 10))
+    assert [scheduler.next_job().user_id for _ in range(3)] == [1, 2, 1]
+
+def test_a_user_cannot_queue_without_bound():
+    scheduler = make_scheduler([0.0], max_pending_per_user=3)
+    for _ in range(3):
+        scheduler.enqueue(scheduler.admit(1, "basic", 10))
+    with pytest.raises(AdmissionRejected) as rejected:
+        scheduler.admit(1, "basic", 10)
+    assert rejected.value.reason == "user_pending"
+    scheduler.complete(scheduler.next_job())
+    scheduler.admit(1, "basic", 10)  # a finished job frees its slot
+
+def test_token_budget_paces_dispatch_and_admission():
+    clock = [0.0]
+    scheduler = make_scheduler(clock, tokens_per_minute=1000, max_wait_seconds=90.0)
+    for user_id in range(3):
+        scheduler.enqueue(scheduler.admit(user_id, "pro", 400))
+    with pytest.raises(AdmissionRejected) as rejected:
+        scheduler.admit(9, "pro", 400)  # 1600 queued tokens take 96s of budget
+    assert rejected.value.reason == "token_budget"
+
+    assert scheduler.next_job() is not None
+    assert scheduler.next_job() is not None
+    assert scheduler.next_job() is None  # this minute's budget is spent
+    clock[0] = 60.0
+    assert scheduler.next_job() is not None
+
+def test_admission_follows_queue_depth_not_past_waits():
+    clock = [0.0]
+    scheduler = make_scheduler(clock, max_wait_seconds=10.0, workers=1)
+    # One job measured at 1s each: the worker drains one job per second
+    job = scheduler.admit(1, "basic", 10)
+    scheduler.enqueue(job)
+    scheduler.next_job()
+    clock[0] = 1.0
+    scheduler.complete(job)
+
+    # A backlog queued all at once is refused as soon as it exceeds the bound, even though
+    # no job has waited yet
+    admitted = 0
+    with pytest.raises(AdmissionRejected) as rejected:
+        for user_id in range(100, 200):
+            scheduler.enqueue(scheduler.admit(user_id, "basic", 10))
+            admitted += 1
+    assert rejected.value.reason == "queue_wait"
+    assert 5 <= admitted <= 10
+
+def test_stream_admission_is_shared_through_redis(redis_client):
+    from app.services.gemini_scheduler import StreamAdmission
+
+    clock = [1000.0]
+
+    def admission():  # one per API process, all on the same Redis
+        return StreamAdmission(redis_client, TokenBudget(6000), {"pro": 8, "basic": 1}, max_pending_per_user=2,
+                               max_wait_seconds=60, stale_seconds=120, clock=lambda: clock[0])
+
+    first, second = admission(), admission()
+    tickets = [first.admit(1, "pro", 1000), second.admit(1, "pro", 1000)]
+    with pytest.raises(AdmissionRejected) as rejected:
+        first.admit(1, "pro", 1000)
+    assert rejected.value.reason == "user_pending"
+    second.release(tickets.pop())
+    tickets.append(first.admit(1, "pro", 1000))
+
+    # 2000 tokens queued: past Basic's eighth of the budget, well within Pro's
+    with pytest.raises(AdmissionRejected) as rejected:
+        second.admit(2, "basic", 500)
+    assert rejected.value.reason == "token_budget"
+    assert rejected.value.retry_after == pytest.approx((2500 - 750) / 6000 * 60)
+    second.admit(3, "pro", 1000)
+
+    # Tickets of messages nobody finished lapse
+    clock[0] += 121
+    second.admit(2, "basic", 500)
+    assert int(redis_client.get(StreamAdmission.TOKENS_KEY)) == 500
@@ -0,0 +1,30 @@
+from app.config import settings
+from app.services.semantic_cache import HashingEmbedder, SemanticCache
+
+def make_cache(embedder=None) -> SemanticCache:
+    return SemanticCache(embedder or HashingEmbedder(), capacity=100, threshold=0.5)
+
+def test_hashing_embedder_needs_the_same_wording():
+    cache = make_cache()
+    cache.store("Is it safe to mix bleach and vinegar?", "No.")
+
+    assert cache.lookup("is it safe to mix bleach and vinegar")[0] == "No."
+    assert cache.lookup("Is it not safe to mix bleach and vinegar?") is None
+    assert cache.lookup("Is it safe to mix vinegar and bleach?") is None
+
+def test_model_embedders_match_on_similarity():
+    class Paraphrases(HashingEmbedder):
+        exact_match = False
+
+    cache = make_cache(Paraphrases())
+    cache.store("Is it safe to mix bleach and vinegar?", "No.")
+    answer, similarity = cache.lookup("Is it safe to mix vinegar and bleach?")
+    assert answer == "No." and similarity < 1
+
+def test_entries_are_private_to_each_user_by_default():
+    assert settings.SEMANTIC_CACHE_SCOPE == "user"
+    cache = make_cache()
+    cache.store("What is my account number?", "It is 1234.", SemanticCache.scope_for(1))
+
+    assert cache.lookup("What is my account number?", SemanticCache.scope_for(2)) is None
+    assert cache.lookup("What is my account number?", SemanticCache.scope_for(1))[0] == "It is 1234."
@@ -0,0 +1,44 @@
+import pytest
+from app import server
+from app.config import per_worker, settings
+
+@pytest.fixture
+def server_env(monkeypatch, tmp_path):
+    """prepare_environment exports variables; keep them from leaking into other tests"""
+    monkeypatch.setenv("WEB_WORKER_PROCESSES", "1")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path / "metrics"))
+    return tmp_path
+
+def test_per_worker_splits_the_budget(monkeypatch):
+    monkeypatch.setenv("WEB_WORKER_PROCESSES", "4")
+    assert per_worker(64) == 16
+    with pytest.raises(ValueError):
+        per_worker(3)
+
+def test_server_refuses_more_workers_than_connections(server_env, monkeypatch):
+    monkeypatch.setattr(settings, "DB_MAX_CONNECTIONS", 4)
+    with pytest.raises(ValueError, match="DB_MAX_CONNECTIONS"):
+        server.prepare_environment(8)
+    server.prepare_environment(4)
+
+def test_metrics_dir_is_kept_while_another_master_uses_it(server_env):
+    import fcntl
+
+    path = server_env / "metrics"
+    server.prepare_environment(2)
+    # The old master during a USR2 upgrade: still holding the dir, its workers' files in it
+    old_master = server._metrics_lock
+    server._metrics_lock = None
+    (path / "counter_101.db").write_bytes(b"old master's worker")
+
+    server.prepare_environment(2)
+    assert (path / "counter_101.db").exists()
+
+    # Once no master is left, the next start empties it
+    old_master.close()
+    server._metrics_lock.close()
+    server.prepare_environment(2)
+    assert not (path / "counter_101.db").exists()
+    with open(path / server.METRICS_LOCK_FILE) as other:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
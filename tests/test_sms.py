@@ -0,0 +1,48 @@
+import time
+from app.config import settings
+from app.services.sms_service import FakeSMSProvider, SMSQueue, SMS_DEAD_LETTER_KEY, SMS_RETRY_KEY
+from app.tasks.sms_tasks import SMSWorker
+
+class ShortProvider(FakeSMSProvider):
+    """Answers for only the first message of each batch"""
+
+    def send_batch(self, messages):
+        return super().send_batch(messages)[:1]
+
+def test_crashed_worker_batch_is_requeued(redis_client):
+    queue = SMSQueue(redis_client)
+    for index in range(3):
+        queue.enqueue(f"+1555000{index:04d}", "hello")
+
+    # Takes the batch, then dies before sending or acking anything
+    queue.heartbeat("dead", 1)
+    assert len(queue.pop_batch("dead", 10)) == 3
+    redis_client.delete("sms:worker:dead")
+
+    provider = FakeSMSProvider()
+    worker = SMSWorker(queue, provider, worker_id="alive")
+    assert worker.run_once(timeout=0) == 3
+    assert [message["to"] for message in provider.sent] == [f"+1555000{index:04d}" for index in range(3)]
+    assert redis_client.llen("sms:processing:dead") == 0
+    assert redis_client.llen("sms:processing:alive") == 0
+
+def test_missing_provider_results_are_retried(redis_client):
+    queue = SMSQueue(redis_client)
+    for index in range(3):
+        queue.enqueue(f"+1555000{index:04d}", "hello")
+    worker = SMSWorker(queue, ShortProvider(), worker_id="w")
+    assert worker.run_once(timeout=0) == 3
+    assert redis_client.zcard(SMS_RETRY_KEY) == 2
+    assert redis_client.llen("sms:processing:w") == 0
+
+def test_expired_otp_is_not_retried(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "SMS_RETRY_BASE_SECONDS", 60.0)
+    queue = SMSQueue(redis_client)
+    queue.enqueue("+15550000001", "code", expires_at=time.time() + 10)  # expires before the retry
+    queue.enqueue("+15550000002", "code", expires_at=time.time() - 1)  # already expired
+    provider = FakeSMSProvider(fail_numbers={"+15550000001"})
+    worker = SMSWorker(queue, provider, worker_id="w")
+    assert worker.run_once(timeout=0) == 2
+    assert provider.sent == []
+    assert redis_client.zcard(SMS_RETRY_KEY) == 0
+    assert redis_client.llen(SMS_DEAD_LETTER_KEY) == 2
@@ -0,0 +1,161 @@
+import hashlib
+import hmac
+import json
+import time
+import uuid
+import pytest
+from app.config import settings
+from app.models.stripe_event import StripeEvent
+from app.services.stripe_webhook_service import StripeWebhookService
+from app.tasks import stripe_tasks
+
+pytestmark = pytest.mark.anyio
+
+def signed(event: dict, secret: str = None) -> tuple:
+    """Body and Stripe-Signature header, as Stripe would send them"""
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new((secret or settings.STRIPE_WEBHOOK_SECRET).encode(),
+                         f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return payload, {"Stripe-Signature": f"t={timestamp},v1={signature}", "Content-Type": "application/json"}
+
+def subscription_event(subscription_id: str, user_id: int, tier: str = "pro", status: str = "active",
+                       created: int = None) -> dict:
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": "customer.subscription.updated",
+        "created": created or int(time.time()),
+        "data": {"object": {
+            "id": subscription_id,
+            "object": "subscription",
+            "status": status,
+            "metadata": {"user_id": str(user_id), "tier": tier},
+        }},
+    }
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(stripe_tasks.process_stripe_events, "delay", calls.append)
+    return calls
+
+async def test_signed_event_is_recorded_once(client, make_user, enqueued):
+    user = make_user()
+    event = subscription_event(f"sub_{uuid.uuid4().hex}", user.id)
+    payload, headers = signed(event)
+
+    for _ in range(2):  # Stripe redelivers
+        response = await client.post("/subscriptions/webhook", content=payload, headers=headers)
+        assert response.status_code == 200
+    assert enqueued == [event["data"]["object"]["id"]]
+
+async def test_bad_signature_is_rejected(client, make_user, enqueued):
+    user = make_user()
+    payload, headers = signed(subscription_event(f"sub_{uuid.uuid4().hex}", user.id), secret="whsec_other")
+    response = await client.post("/subscriptions/webhook", content=payload, headers=headers)
+    assert response.status_code == 400
+    assert enqueued == []
+
+def _record(db, event: dict):
+    payload, headers = signed(event)
+    return StripeWebhookService(db).record_event(payload.encode(), headers["Stripe-Signature"])[0]
+
+def test_poison_event_is_dead_lettered(db, make_user, monkeypatch):
+    monkeypatch.setattr(settings, "STRIPE_EVENT_MAX_ATTEMPTS", 3)
+    user = make_user()
+    subscription_id = f"sub_{uuid.uuid4().hex}"
+    poison = _record(db, subscription_event(subscription_id, user.id, tier="platinum", created=1))
+    good = _record(db, subscription_event(subscription_id, user.id, tier="pro", created=2))
+    poison_id, good_id = poison.id, good.id
+
+    service = StripeWebhookService(db)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            service.process_pending(subscription_id)
+    assert service.process_pending(subscription_id) == 1
+
+    assert db.get(StripeEvent, poison_id).status == "dead"
+    assert db.get(StripeEvent, good_id).status == "processed"
+    db.refresh(user)
+    assert user.subscription_tier.value == "pro"
+
+def test_drain_stops_when_its_lock_is_lost(db, make_user, redis_client, monkeypatch):
+    user = make_user()
+    subscription_id = f"sub_{uuid.uuid4().hex}"
+    first = _record(db, subscription_event(subscription_id, user.id, created=1)).id
+    second = _record(db, subscription_event(subscription_id, user.id, created=2)).id
+
+    apply_event = StripeWebhookService.apply_event
+
+    def apply_and_expire(self, event):
+        apply_event(self, event)
+        redis_client.delete(f"stripe_events:lock:{subscription_id}")  # the lock timed out mid-drain
+
+    monkeypatch.setattr(StripeWebhookService, "apply_event", apply_and_expire)
+    stripe_tasks.process_stripe_events(subscription_id)  # must not raise from the release
+
+    db.expire_all()
+    assert db.get(StripeEvent, first).status == "processed"
+    assert db.get(StripeEvent, second).status == "pending"
+
+def _subscription(db, user, tier: str, status: str, period_start: int):
+    from datetime import datetime, timezone
+    from app.models.subscription import Subscription
+
+    subscription = Subscription(user_id=user.id, stripe_subscription_id=f"sub_{uuid.uuid4().hex}", tier=tier,
+                                status=status, current_period_start=datetime.fromtimestamp(period_start, tz=timezone.utc))
+    db.add(subscription)
+    db.commit()
+    return subscription
+
+def test_late_renewal_keeps_the_current_subscription(db, make_user):
+    from app.services.subscription_service import SubscriptionService
+
+    user = make_user()
+    old = _subscription(db, user, "pro", "cancelled", period_start=1_000)
+    _subscription(db, user, "basic", "active", period_start=2_000)
+    SubscriptionService(db).sync_user_entitlement(user)
+    db.commit()
+
+    StripeWebhookService(db).apply_event({"type": "invoice.payment_succeeded",
+                                          "data": {"object": {"subscription": old.stripe_subscription_id}}})
+    db.commit()
+    db.refresh(old)
+    db.refresh(user)
+    assert old.status == "cancelled"
+    assert (user.subscription_tier.value, user.subscription_status.value) == ("basic", "active")
+
+def test_checkout_does_not_override_a_known_subscription(db, make_user):
+    user = make_user()
+    canceled = _subscription(db, user, "pro", "cancelled", period_start=1_000)
+    StripeWebhookService(db).apply_event({"type": "checkout.session.completed", "data": {"object": {
+        "subscription": canceled.stripe_subscription_id, "created": 500,
+        "metadata": {"user_id": str(user.id), "tier": "pro"},
+    }}})
+    db.commit()
+    db.refresh(user)
+    assert user.subscription_status.value == "cancelled"
+
+    # A new checkout is in force straight away
+    StripeWebhookService(db).apply_event({"type": "checkout.session.completed", "data": {"object": {
+        "subscription": f"sub_{uuid.uuid4().hex}", "created": 3_000,
+        "metadata": {"user_id": str(user.id), "tier": "pro"},
+    }}})
+    db.commit()
+    db.refresh(user)
+    assert (user.subscription_tier.value, user.subscription_status.value) == ("pro", "active")
+
+def test_waiting_for_the_drain_lock_spends_no_retries(redis_client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(stripe_tasks.process_stripe_events, "apply_async",
+                        lambda args, kwargs, countdown: scheduled.append((args, kwargs)))
+    monkeypatch.setattr(stripe_tasks.process_stripe_events, "retry", pytest.fail)
+    lock = redis_client.lock("stripe_events:lock:sub_busy", timeout=60)
+    assert lock.acquire(blocking=False)
+
+    stripe_tasks.process_stripe_events("sub_busy")
+    assert scheduled == [(("sub_busy",), {"lock_waits": 1})]
+    # Once the lock must have expired, the sweep takes over
+    stripe_tasks.process_stripe_events("sub_busy", lock_waits=settings.STRIPE_EVENT_LOCK_SECONDS)
+    assert len(scheduled) == 1
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from app.config import settings
+from app.models.subscription import Subscription
+from app.models.user import SubscriptionStatus, SubscriptionTier
+from app.services import stripe_service
+from app.tasks.stripe_tasks import reconcile_subscriptions
+
+class MockStripe(BaseHTTPRequestHandler):
+    """Serves GET /v1/subscriptions from .subscriptions, two per page, newest first like Stripe"""
+
+    subscriptions = []
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        MockStripe.requests.append((url.path, query))
+        if url.path != "/v1/subscriptions":
+            self.send_error(404)
+            return
+        ids = [subscription["id"] for subscription in self.subscriptions]
+        start = ids.index(query["starting_after"]) + 1 if "starting_after" in query else 0
+        page = self.subscriptions[start:start + 2]
+        body = json.dumps({
+            "object": "list",
+            "url": "/v1/subscriptions",
+            "data": page,
+            "has_more": start + 2 < len(self.subscriptions),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def mock_stripe(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockStripe)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    MockStripe.requests = []
+    monkeypatch.setattr(settings, "STRIPE_API_BASE", f"http://127.0.0.1:{server.server_port}")
+    stripe_service.close_stripe_client()  # the real client, pointed at the mock
+    try:
+        yield MockStripe
+    finally:
+        server.shutdown()
+        stripe_service.close_stripe_client()
+
+def stripe_subscription(user_id: int, status: str, days_ago: int) -> dict:
+    start = int(time.time()) - days_ago * 86400
+    return {
+        "id": f"sub_{uuid.uuid4().hex}",
+        "object": "subscription",
+        "status": status,
+        "current_period_start": start,
+        "current_period_end": start + 30 * 86400,
+        "metadata": {"user_id": str(user_id), "tier": "pro"},
+    }
+
+def test_reconcile_keeps_the_active_subscription(db, make_user, mock_stripe):
+    upgraded, lapsed = make_user(), make_user()
+    current = stripe_subscription(upgraded.id, "active", days_ago=3)
+    mock_stripe.subscriptions = [
+        current,
+        stripe_subscription(lapsed.id, "canceled", days_ago=5),
+        # Older history, listed after the current subscription
+        stripe_subscription(upgraded.id, "canceled", days_ago=400),
+        stripe_subscription(upgraded.id, "past_due", days_ago=40) | {"status": "unpaid"},
+        stripe_subscription(lapsed.id, "active", days_ago=60) | {"status": "incomplete_expired"},
+    ]
+
+    reconcile_subscriptions()
+
+    assert [query.get("starting_after") for _, query in mock_stripe.requests] == [
+        None, mock_stripe.subscriptions[1]["id"], mock_stripe.subscriptions[3]["id"]
+    ]
+    db.expire_all()
+    assert db.query(Subscription).filter(Subscription.user_id == upgraded.id).count() == 3
+    db.refresh(upgraded)
+    db.refresh(lapsed)
+    assert (upgraded.subscription_status, upgraded.subscription_tier) == (SubscriptionStatus.ACTIVE, SubscriptionTier.PRO)
+    assert (lapsed.subscription_status, lapsed.subscription_tier) == (SubscriptionStatus.CANCELLED, SubscriptionTier.BASIC)
+
+def test_late_webhook_for_an_old_subscription_does_not_downgrade(db, make_user):
+    from app.services.subscription_service import SubscriptionService
+
+    user = make_user()
+    service = SubscriptionService(db)
+    old = stripe_subscription(user.id, "active", days_ago=400)
+    new = stripe_subscription(user.id, "active", days_ago=2)
+    service.apply_stripe_subscription(old)
+    service.apply_stripe_subscription(new)
+    db.commit()
+
+    # The old subscription's cancellation is delivered after the new one started
+    service.apply_stripe_subscription(old | {"status": "canceled"})
+    db.commit()
+    db.refresh(user)
+    assert (user.subscription_status, user.subscription_tier) == (SubscriptionStatus.ACTIVE, SubscriptionTier.PRO)
+
+    service.apply_stripe_subscription(new | {"status": "canceled"})
+    db.commit()
+    db.refresh(user)
+    assert (user.subscription_status, user.subscription_tier) == (SubscriptionStatus.CANCELLED, SubscriptionTier.BASIC)
+
+@pytest.fixture
+def cancels(monkeypatch):
+    from app.tasks import stripe_tasks
+
+    calls = []
+    monkeypatch.setattr(stripe_tasks.cancel_stripe_subscription, "delay", calls.append)
+    return calls
+
+@pytest.mark.anyio
+async def test_cancel_records_the_pending_stripe_cancel(client, db, make_user, auth_headers, cancels):
+    user = make_user()
+    subscription = Subscription(user_id=user.id, stripe_subscription_id=f"sub_{uuid.uuid4().hex}",
+                                status="active", tier="pro")
+    db.add(subscription)
+    db.commit()
+
+    response = await client.post("/subscriptions/cancel", headers=auth_headers(user))
+    assert response.status_code == 200
+    assert cancels == [subscription.stripe_subscription_id]
+    db.expire_all()
+    assert subscription.status == "cancelled"
+    assert subscription.cancel_requested_at is not None
+    assert (user.subscription_status, user.subscription_tier) == (SubscriptionStatus.CANCELLED, SubscriptionTier.BASIC)
+
+def test_reconcile_does_not_revive_a_pending_cancel(db, make_user, mock_stripe, cancels):
+    from datetime import datetime, timedelta
+
+    user = make_user(subscription_status=SubscriptionStatus.CANCELLED, subscription_tier=SubscriptionTier.BASIC)
+    live = stripe_subscription(user.id, "active", days_ago=3)
+    db.add(Subscription(user_id=user.id, stripe_subscription_id=live["id"], status="cancelled", tier="pro",
+                        cancel_requested_at=datetime.utcnow() - timedelta(hours=2)))
+    db.commit()
+
+    # Every Stripe cancel failed: Stripe still bills the subscription
+    mock_stripe.subscriptions = [live]
+    reconcile_subscriptions()
+    db.expire_all()
+    assert (user.subscription_status, user.subscription_tier) == (SubscriptionStatus.CANCELLED, SubscriptionTier.BASIC)
+    assert cancels == [live["id"]]
+
+    # Once Stripe reports it canceled there is nothing left to retry
+    mock_stripe.subscriptions = [live | {"status": "canceled"}]
+    reconcile_subscriptions()
+    db.expire_all()
+    subscription = db.query(Subscription).filter(Subscription.stripe_subscription_id == live["id"]).one()
+    assert subscription.cancel_requested_at is None
+    assert cancels == [live["id"]]
+
+def test_final_failed_cancel_is_counted(monkeypatch):
+    from prometheus_client import REGISTRY
+    from app.tasks.stripe_tasks import cancel_stripe_subscription
+
+    def fail(self, subscription_id):
+        raise RuntimeError("stripe down")
+    monkeypatch.setattr(stripe_service.StripeService, "cancel_subscription", fail)
+
+    before = REGISTRY.get_sample_value("stripe_cancel_failures_total") or 0
+    result = cancel_stripe_subscription.apply(("sub_failing",), retries=cancel_stripe_subscription.max_retries)
+    assert result.successful()
+    assert REGISTRY.get_sample_value("stripe_cancel_failures_total") == before + 1
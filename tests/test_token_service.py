@@ -0,0 +1,132 @@
+import time
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.services.token_service import REVOKED_IDS_KEY, RevocationStore, TokenService
+from app.utils.jwt_utils import verify_access_token, verify_token
+
+pytestmark = pytest.mark.anyio
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def revocations(redis_client):
+    """This process's revocation store, listening on the test Redis and synced"""
+    from app import clients
+
+    if clients._revocation_store is not None:
+        clients._revocation_store.stop(timeout=0)  # the listener exits within its 1 s poll
+    store = RevocationStore(redis_client)
+    store.start()
+    wait_for(store._synced.is_set)
+    clients._revocation_store, clients._token_service = store, None
+    try:
+        yield store
+    finally:
+        store.stop(timeout=0)
+        clients._revocation_store, clients._token_service = None, None
+
+@pytest.fixture
+def tokens(redis_client, revocations):
+    return TokenService(redis_client, revocations)
+
+def test_tokens_issued_before_the_bump_syncs_are_still_valid(redis_client):
+    # Two processes; neither runs its pub/sub listener, so process_b never hears of the bump
+    process_a, process_b = RevocationStore(redis_client), RevocationStore(redis_client)
+    process_a._load_snapshot()
+    process_b._load_snapshot()
+    process_a.bump_version(42)  # "log out everywhere"
+
+    tokens = TokenService(redis_client, process_b).issue_tokens(42)
+
+    payload = verify_token(tokens["access_token"])
+    assert payload["ver"] == 1
+    assert not process_a.is_revoked(payload)
+
+def test_rotation_replaces_the_refresh_token(tokens):
+    first = tokens.issue_tokens(7)
+    second = tokens.rotate(verify_token(first["refresh_token"]))
+    third = tokens.rotate(verify_token(second["refresh_token"]))
+
+    refresh = [verify_token(pair["refresh_token"]) for pair in (first, second, third)]
+    assert len({payload["fam"] for payload in refresh}) == 1
+    assert len({payload["jti"] for payload in refresh}) == 3
+    assert verify_access_token(third["access_token"])["user_id"] == 7
+
+def test_reused_refresh_token_revokes_the_family(tokens, redis_client):
+    from prometheus_client import REGISTRY
+
+    stolen = tokens.issue_tokens(7)
+    rotated = tokens.rotate(verify_token(stolen["refresh_token"]))
+    other_login = tokens.issue_tokens(7)
+    before = REGISTRY.get_sample_value("token_refresh_reuse_total") or 0
+
+    with pytest.raises(HTTPException) as reused:
+        tokens.rotate(verify_token(stolen["refresh_token"]))  # the script answers 0
+    assert reused.value.status_code == 401
+    assert REGISTRY.get_sample_value("token_refresh_reuse_total") == before + 1
+
+    # Neither the thief nor the rightful holder keeps the family
+    family = verify_token(stolen["refresh_token"])["fam"]
+    assert redis_client.exists(f"{REVOKED_IDS_KEY}:{family}")
+    with pytest.raises(HTTPException):
+        tokens.rotate(verify_token(rotated["refresh_token"]))
+    assert verify_access_token(rotated["access_token"]) is None
+    assert verify_access_token(other_login["access_token"]) is not None
+
+async def test_logout_revokes_this_session(client, tokens):
+    session, other = tokens.issue_tokens(7), tokens.issue_tokens(7)
+
+    response = await client.post("/auth/logout", headers={"Authorization": f"Bearer {session['access_token']}"})
+    assert response.status_code == 200
+    assert verify_access_token(session["access_token"]) is None
+    response = await client.post("/auth/refresh-token", json={"refresh_token": session["refresh_token"]})
+    assert response.status_code == 401
+    assert verify_access_token(other["access_token"]) is not None
+    assert (await client.post("/auth/refresh-token", json={"refresh_token": other["refresh_token"]})).status_code == 200
+
+async def test_logout_everywhere_revokes_every_session(client, tokens):
+    session, other = tokens.issue_tokens(8), tokens.issue_tokens(8)
+
+    response = await client.post("/auth/logout", params={"all_devices": "true"},
+                                 headers={"Authorization": f"Bearer {session['access_token']}"})
+    assert response.status_code == 200
+    for pair in (session, other):
+        assert verify_access_token(pair["access_token"]) is None
+        assert (await client.post("/auth/refresh-token", json={"refresh_token": pair["refresh_token"]})).status_code == 401
+    assert verify_access_token(tokens.issue_tokens(8)["access_token"]) is not None  # logging in again works
+
+def test_rebuild_drops_expired_revocations(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "REVOCATION_BLOOM_CAPACITY", 10)
+    store = RevocationStore(redis_client)
+    store._load_snapshot()
+    ids = [f"live-{index}" for index in range(30)]
+    for token_id in ids:
+        store.revoke(token_id, time.time() + 3600)
+    store.revoke("expired", time.time() - 1)
+
+    rebuilt = RevocationStore(redis_client)  # a process starting now
+    rebuilt._load_snapshot()
+    assert all(token_id in rebuilt._bloom for token_id in ids)  # sized past the configured capacity
+    assert redis_client.zscore(REVOKED_IDS_KEY, "expired") is None
+    assert rebuilt.is_revoked({"user_id": 1, "jti": ids[0]})
+    assert not rebuilt.is_revoked({"user_id": 1, "jti": "expired"})
+
+def test_revocations_reach_other_processes(redis_client, revocations):
+    other = RevocationStore(redis_client)
+    other.start()
+    try:
+        wait_for(other._synced.is_set)
+        revocations.revoke("jti-1", time.time() + 3600)
+        revocations.bump_version(9)
+
+        wait_for(lambda: "jti-1" in other._bloom and other._versions.get(9) == 1)
+        assert other.is_revoked({"user_id": 1, "jti": "jti-1"})
+        assert other.is_revoked({"user_id": 9, "ver": 0, "jti": "jti-2"})
+        assert not other.is_revoked({"user_id": 9, "ver": 1, "jti": "jti-2"})
+    finally:
+        other.stop(timeout=0)
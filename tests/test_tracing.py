@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+import anyio
+import pytest
+from app.utils import tracing
+
+pytestmark = pytest.mark.anyio
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: answers locally, with usage metadata"""
+
+    def generate_content(self, prompt, **kwargs):
+        return SimpleNamespace(
+            text=f"traced reply to {len(prompt)} chars",
+            usage_metadata=SimpleNamespace(prompt_token_count=7, candidates_token_count=5)
+        )
+
+@pytest.fixture
+def spans():
+    """TRACING_EXPORTER=memory for the rest of the run; finished spans start empty"""
+    tracing.configure_tracing("memory")
+    tracing.memory_exporter.clear()
+    return tracing.memory_exporter
+
+@pytest.fixture
+def traced_clients(client, redis_client):
+    """Instrumented Redis and a GeminiService on a local model, in place of the bare stubs"""
+    from app import clients
+    from app.config import settings
+    from app.services.gemini_service import GeminiService
+    from app.utils.circuit_breaker import RedisCircuitBreaker
+    from app.utils.instrumented_redis import InstrumentedRedis
+
+    instrumented = InstrumentedRedis(connection_pool=redis_client.connection_pool)
+    clients._redis_client = instrumented
+    service = GeminiService.__new__(GeminiService)  # skips importing google.generativeai
+    service.model_name = settings.GEMINI_MODEL
+    service.model = FakeModel()
+    service.breaker = RedisCircuitBreaker(f"gemini:{settings.GEMINI_MODEL}", instrumented)
+    clients._gemini_services[settings.GEMINI_MODEL] = service
+    return client
+
+async def test_message_trace_spans_request_and_dispatcher(traced_clients, db, make_user, auth_headers, spans):
+    from app.models.chatroom import Chatroom, Message
+
+    user = make_user()
+    room = Chatroom(user_id=user.id, title="tracing")
+    db.add(room)
+    db.commit()
+
+    response = await traced_clients.post(f"/chatrooms/{room.id}/messages", json={"content": "trace me"},
+                                         headers=auth_headers(user))
+    assert response.status_code == 200
+    message_id = response.json()["id"]
+    for _ in range(200):
+        db.expire_all()
+        message = db.get(Message, message_id)
+        if message.processing_status == "completed":
+            break
+        await anyio.sleep(0.01)
+    assert message.processing_status == "completed"
+    assert set(message.processing_latency) == {"queue_wait_ms", "model_ms", "persistence_ms"}
+    assert all(value is not None and value >= 0 for value in message.processing_latency.values())
+
+    finished = spans.get_finished_spans()
+    [task_span] = [span for span in finished if span.name == "process_gemini_message"]
+    trace_id = task_span.context.trace_id
+    in_trace = [span for span in finished if span.context.trace_id == trace_id]
+    by_id = {span.context.span_id: span for span in in_trace}
+
+    def under(span, ancestor) -> bool:
+        while span.parent is not None and span.parent.span_id in by_id:
+            span = by_id[span.parent.span_id]
+            if span is ancestor:
+                return True
+        return False
+
+    # The dispatcher thread has no ambient context: it joins the trace only through trace_headers
+    [request_span] = [span for span in in_trace if span.parent is None]
+    assert request_span.name == "POST /chatrooms/{chatroom_id}/messages"
+    assert under(task_span, request_span)
+    assert task_span.attributes["message.id"] == message_id
+
+    in_task = {span.name for span in in_trace if under(span, task_span)}
+    in_request = {span.name for span in in_trace if under(span, request_span) and not under(span, task_span)}
+    assert {"db.query", "gemini.generate_content", "message.claim", "message.persist"} <= in_task
+    assert any(name.startswith("redis.") for name in in_task)  # the Gemini circuit breaker
+    assert {"auth.lookup", "message.insert", "db.query"} <= in_request
+    [gemini_span] = [span for span in in_trace if span.name == "gemini.generate_content"]
+    assert gemini_span.attributes["gemini.prompt_tokens"] == 7